@@ -0,0 +1,82 @@
+"""
+Compare get_cross_references() with the straightforward per-relocation implementation.
+
+Usage (with dfrus installed or in PYTHONPATH):
+    python benchmarks/bench_cross_references.py [number_of_relocations]
+"""
+import io
+import random
+import sys
+import timeit
+
+from array import array
+from collections import defaultdict
+
+from dfrus.binio import read_bytes, from_dword
+from dfrus.cross_references import get_cross_references
+from dfrus.peclasses import Section, SectionTable
+
+image_base = 0x400000
+
+
+def reference_get_cross_references(fn, relocs, sections, image_base):
+    # Converts the relocations one by one
+    xrefs = defaultdict(list)
+    code_upper_bound = sections[0].rva + sections[0].virtual_size
+    base_offset = sections[0].physical_offset
+    size = sections[-1].physical_offset + sections[-1].physical_size - base_offset
+    buffer = read_bytes(fn, base_offset, size)
+    for reloc in relocs:
+        reloc_off = sections.rva_to_offset(reloc)
+        local_off = reloc_off - base_offset
+        obj_rva = from_dword(buffer[local_off:local_off+4]) - image_base
+        if code_upper_bound <= obj_rva:
+            obj_off = sections.rva_to_offset(obj_rva)
+            if obj_off is not None:
+                xrefs[obj_off].append(reloc_off)
+
+    return xrefs
+
+
+def make_test_data(count, seed=0):
+    rng = random.Random(seed)
+    code_size = count * 8
+    data_size = count * 4
+    sections = SectionTable([
+        Section(name=b'.text', virtual_size=code_size, rva=0x1000, physical_size=code_size,
+                physical_offset=0x400, flags=0),
+        Section(name=b'.rdata', virtual_size=data_size, rva=0x1000 + code_size, physical_size=data_size,
+                physical_offset=0x400 + code_size, flags=0),
+    ])
+
+    file_data = bytearray(0x400 + code_size + data_size)
+    relocs = set()
+    while len(relocs) < count:
+        # Unaligned references from the code to the data section
+        rva = 0x1000 + rng.randrange(0, code_size - 4)
+        if any(x in relocs for x in range(rva - 3, rva + 4)):
+            continue
+        relocs.add(rva)
+        target = sections[1].rva + rng.randrange(0, data_size // 4) * 4 + image_base
+        offset = sections.rva_to_offset(rva)
+        file_data[offset:offset + 4] = array('I', [target]).tobytes()
+
+    return io.BytesIO(file_data), relocs, sections
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    fn, relocs, sections = make_test_data(count)
+
+    assert (get_cross_references(fn, relocs, sections, image_base) ==
+            reference_get_cross_references(fn, relocs, sections, image_base))
+
+    for func in (reference_get_cross_references, get_cross_references):
+        timer = timeit.Timer(lambda: func(fn, relocs, sections, image_base))
+        number, _ = timer.autorange()
+        elapsed = min(timer.repeat(3, number)) / number
+        print('%-32s %8.1f ms  (%d relocations)' % (func.__name__, elapsed * 1000, count))
+
+
+if __name__ == '__main__':
+    main()
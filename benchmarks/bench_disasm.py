@@ -0,0 +1,90 @@
+"""
+Measure throughput of disasm() in instructions per second.
+
+Usage (with dfrus installed or in PYTHONPATH):
+    python benchmarks/bench_disasm.py [path_to_executable]
+
+If an executable is given, its code section is disassembled,
+otherwise a generated mix of instructions typical for compiled code is used.
+"""
+import random
+import sys
+import timeit
+
+from dfrus.code_index import CodeIndex
+from dfrus.disasm import disasm
+from dfrus.peclasses import PortableExecutable
+
+# Encodings of frequent instructions, 'b', 'w' and 'd' stand for random byte, word and dword values
+instruction_templates = [
+    (20, [0x8B, 0x45, 'b']),  # mov eax, [ebp+disp8]
+    (10, [0x89, 0x4D, 'b']),  # mov [ebp+disp8], ecx
+    (8, [0x8B, 0xC8]),  # mov ecx, eax
+    (8, [0x50]),  # push eax
+    (4, [0x5E]),  # pop esi
+    (6, [0x68, 'd']),  # push imm32
+    (8, [0xE8, 'd']),  # call near
+    (6, [0x74, 'b']),  # jz short
+    (3, [0x0F, 0x85, 'd']),  # jnz near
+    (4, [0x8D, 0x4C, 0x24, 'b']),  # lea ecx, [esp+disp8]
+    (4, [0x83, 0xEC, 'b']),  # sub esp, imm8
+    (4, [0x85, 0xC0]),  # test eax, eax
+    (2, [0x3B, 0x46, 'b']),  # cmp eax, [esi+disp8]
+    (2, [0xC3]),  # retn
+    (1, [0xC2, 'w']),  # retn imm16
+    (3, [0x0F, 0xB6, 0x08]),  # movzx ecx, byte [eax]
+    (2, [0x66, 0x89, 0x0E]),  # mov [esi], cx
+    (3, [0xC7, 0x45, 'b', 'd']),  # mov dword [ebp+disp8], imm32
+    (2, [0xA1, 'd']),  # mov eax, [imm32]
+    (1, [0xF3, 0xA5]),  # rep movsd
+    (2, [0xFF, 0x15, 'd']),  # call [imm32]
+    (3, [0x33, 0xC0]),  # xor eax, eax
+    (3, [0xB9, 'd']),  # mov ecx, imm32
+]
+
+
+def generate_code(count, seed=0):
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in instruction_templates]
+    templates = rng.choices([template for _, template in instruction_templates], weights, k=count)
+    code = bytearray()
+    for template in templates:
+        for item in template:
+            if item == 'b':
+                code.append(rng.randrange(0x100))
+            elif item == 'w':
+                code += rng.randrange(0x10000).to_bytes(2, 'little')
+            elif item == 'd':
+                code += rng.randrange(0x100000000).to_bytes(4, 'little')
+            else:
+                code.append(item)
+    return bytes(code)
+
+
+def read_code_section(path):
+    with open(path, 'rb') as file:
+        pe = PortableExecutable(file)
+        code_section = pe.section_table[0]
+        file.seek(code_section.physical_offset)
+        return file.read(code_section.physical_size)
+
+
+def main():
+    if len(sys.argv) > 1:
+        code = read_code_section(sys.argv[1])
+    else:
+        code = generate_code(200000)
+
+    count = sum(1 for _ in disasm(code))
+    print('%d bytes, %d instructions' % (len(code), count))
+
+    # Most of the callers look only at mnemonics, operands are decoded on demand
+    for title, func in [('mnemonics only', lambda: sum(1 for line in disasm(code) if line.mnemonic)),
+                        ('with operands', lambda: sum(1 for line in disasm(code) if line.operands is not None)),
+                        ('code index', lambda: CodeIndex.from_bytes(code))]:
+        elapsed = min(timeit.Timer(func).repeat(3, 1))
+        print('%-16s %8.1f ms  %8.0f instructions/s' % (title, elapsed * 1000, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Measure the costs of the pools of worker processes used with --jobs and the number of items which pays them off.
+
+Usage (from the root directory of the repository):
+    python -m benchmarks.bench_pool [--strings N] [--pointers N] [--gap N] [--workers N ...]
+
+For the analysis of the references (analyse_references) and for the extraction of strings (extract_strings)
+the following is measured on a synthetic executable, --gap sets the number of bytes between the pieces of code
+which use the strings (only the isolated references are analysed in the pool, see patchdf.isolated_references):
+    startup - wall time of a pool with one small chunk per worker process, it includes writing and loading
+              of the data shared with the workers
+    serial  - time of an item handled in the main process
+    worker  - time of an item handled the way a worker does it, including pickling of the result
+    main    - time the main process spends on an item handled by a worker (unpickling of the result and its checks)
+    rejected - share of the results of the analysis which read the code changed by the fixes of the previous
+               references, these references are analysed once more in the main process
+
+A pool of n workers on n CPUs saves (serial - worker / n - main - rejected * serial) per item,
+so it pays off with more than startup / saving items. These numbers are the thresholds of patchdf.parallel_workers().
+"""
+import argparse
+import io
+import os
+import pickle
+import tempfile
+import time
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.code_index import CodeIndex
+from dfrus.cross_references import get_cross_references
+from dfrus.extract_strings import (extract_strings, _extract_strings_worker, _strings_at_xrefs_parallel,
+                                   get_byte_classes)
+from dfrus.patchdf import analyse_references, pieces_unchanged, fix_len, isolated_references, _fix_len_worker
+from dfrus.peclasses import PortableExecutable
+from dfrus.trace_machine_code import TraceCache
+
+
+def timed(func, *args):
+    """Return the result of the call and its wall time"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def pickled(func, *args):
+    """Call the function the way a worker does it, return the pickled result"""
+    return pickle.dumps(func(*args), pickle.HIGHEST_PROTOCOL)
+
+
+def reference_jobs(image, sections, xrefs, strings):
+    """Arguments of fix_len() for the references from the code to the translated strings"""
+    translations = make_translations(strings)
+    code = sections[0]
+    code_end = code.physical_offset + code.physical_size
+    image_base = PortableExecutable(io.BytesIO(image)).optional_header.image_base
+    jobs = []
+    for off, string, _ in extract_strings(io.BytesIO(image), xrefs):
+        translation = translations.get(string)
+        if translation is None:
+            continue
+        string_address = sections.offset_to_rva(off) + image_base
+        # Longer translations are moved to the new section
+        new_address = string_address if len(translation) <= len(string) else string_address + 0x100000
+        jobs.extend((ref, len(string), len(translation), new_address, string_address)
+                    for ref in xrefs[off] if ref < code_end)
+    isolated = isolated_references(args[0] for args in jobs)
+    return jobs, [args for args in jobs if args[0] in isolated]
+
+
+def measure_references(image, code_index, jobs, workers):
+    """Return a dict of the startup times by the number of workers and the per item times"""
+    startup = {n: timed(analyse_references, image, jobs[:n * 4], n)[1] for n in workers}
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'image'), 'wb') as file:
+            file.write(image)
+
+        _fix_len_worker(directory, jobs[:1])  # Load the data of the worker
+        data, worker_time = timed(pickled, _fix_len_worker, directory, jobs)
+
+    (results, _), main_time = timed(pickle.loads, data)
+
+    # The references are fixed one after another, the results are checked before each fix the way fix_df_exe() does
+    fn = io.BytesIO(image)
+    trace_cache = TraceCache()
+    serial_time = 0
+    rejected = 0
+    for args, result in zip(jobs, results):
+        unchanged, check_time = timed(pieces_unchanged, fn, result[1])
+        main_time += check_time
+        rejected += not unchanged
+        serial_time += timed(lambda: fix_len(fn, *args, code_index=code_index, trace_cache=trace_cache))[1]
+
+    count = len(jobs)
+    return startup, serial_time / count, worker_time / count, main_time / count, rejected / count
+
+
+def measure_strings(image, xrefs, workers):
+    """Return a dict of the startup times by the number of workers and the per item times"""
+    s_xrefs = sorted(xrefs)
+    base = s_xrefs[0]
+    blocksize = 4096
+    data = image[base:s_xrefs[-1] + blocksize]
+    encoding = 'cp437'
+    decode = not get_byte_classes(encoding).one_char_per_byte
+
+    def run_pool(n, s_xrefs):
+        return list(_strings_at_xrefs_parallel(data, s_xrefs, n, blocksize, encoding, True, decode))
+
+    startup = {n: timed(run_pool, n, s_xrefs[:n * 4])[1] for n in workers}
+
+    keys = set()  # Only the strings with translations are decoded, the same way as it is done by fix_df_exe()
+    _, serial_time = timed(lambda: list(extract_strings(io.BytesIO(image), xrefs, encoding=encoding, arrays=True,
+                                                        keys=keys)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'data'), 'wb') as file:
+            file.write(data)
+        with open(os.path.join(directory, 'xrefs'), 'wb') as file:
+            pickle.dump(s_xrefs, file, pickle.HIGHEST_PROTOCOL)
+
+        _extract_strings_worker(directory, range(1), blocksize, encoding, True, decode)  # Load the data
+        data, worker_time = timed(pickled, _extract_strings_worker, directory, range(len(s_xrefs)), blocksize,
+                                  encoding, True, decode)
+
+    _, main_time = timed(pickle.loads, data)
+
+    count = len(s_xrefs)
+    return startup, serial_time / count, worker_time / count, main_time / count, 0
+
+
+def report(title, measured, workers):
+    startup, serial, worker, main, rejected = measured
+    print('%s: serial %.1f us, worker %.1f us, main %.1f us per item, %.0f%% rejected' %
+          (title, serial * 1e6, worker * 1e6, main * 1e6, rejected * 100))
+    for n in workers:
+        saving = serial - worker / n - main - rejected * serial
+        break_even = '%d items' % (startup[n] / saving) if saving > 0 else 'never'
+        print('    %d workers: startup %.0f ms, pays off with %s' % (n, startup[n] * 1000, break_even))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the costs of the pools of worker processes')
+    parser.add_argument('--strings', type=int, default=8000, help='number of strings')
+    parser.add_argument('--pointers', type=int, default=100000, help='number of pointers in the data section')
+    parser.add_argument('--gap', type=int, default=512, help='number of bytes between the pieces of code')
+    parser.add_argument('--workers', type=int, nargs='*', default=[2, 4, 8], help='numbers of worker processes')
+    args = parser.parse_args()
+
+    image, strings = build_pe(args.strings, pointer_count=args.pointers, code_gap=args.gap)
+    pe = PortableExecutable(io.BytesIO(image))
+    sections = pe.section_table
+    xrefs = get_cross_references(io.BytesIO(image), pe.relocation_table, sections, pe.optional_header.image_base)
+    code_index = CodeIndex.from_section(io.BytesIO(image), sections[0])
+    all_jobs, jobs = reference_jobs(image, sections, xrefs, strings)
+    print('%d bytes, %d strings, %d cross-references, %d references from the code to translated strings, '
+          '%d of them are isolated' % (len(image), len(strings), len(xrefs), len(all_jobs), len(jobs)))
+    print('%d CPUs, the startup of larger pools is measured with the workers sharing them' % (os.cpu_count() or 1))
+
+    if jobs:
+        report('analysis of references', measure_references(image, code_index, jobs, args.workers), args.workers)
+    report('extraction of strings', measure_strings(image, xrefs, args.workers), args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Compare the modes of dfrus.run() on a synthetic executable written to a temporary directory.
+
+Usage (from the root directory of the repository):
+    python -m benchmarks.bench_run [--strings N] [--pointers N] [--gap N] [--repeat N] [mode ...]
+
+Modes:
+    file     - the executable is copied and patched in the file (the default mode)
+    memory   - the executable is patched in memory and written at once (--in-memory)
+    cache-empty - with an empty analysis cache directory (--cache-dir), the results are stored there
+    cache-cold  - with the analysis cache filled before a translation in the middle of the dictionary was edited:
+                  the analysis of the executable is reused, but the translations after the edited one are moved,
+                  so the results of the length fixes of their references are not
+    cache-warm  - with the analysis cache filled by a run with the same dictionary
+    manifest-empty  - without a previous patch manifest (--manifest), the manifest is written
+    manifest-edited - with the manifest of a patch with the dictionary in which a translation in the middle
+                      was edited (it has the same length and stays in place): only the strings affected by it
+                      are patched again, the bytes written for the other ones are copied
+    manifest-same   - with the manifest of a patch with the same dictionary
+    jobs-2, jobs-4  - the references are analysed in a pool of 2 or 4 worker processes (--jobs), only the isolated
+                      ones are analysed in the pool, so it is used only if --gap is large enough
+
+Each mode is run --repeat times (the modes are run by turns), the best wall time and CPU time are shown.
+CPU time doesn't include the time of the worker processes.
+The patched executables of all the modes must be the same as the one of the first mode.
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import warnings
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.dfrus import run
+
+
+def mode_file(directory, source, translations):
+    return dict()
+
+
+def mode_memory(directory, source, translations):
+    return dict(in_memory=True)
+
+
+def mode_cache_empty(directory, source, translations):
+    return dict(cache_dir=tempfile.mkdtemp(dir=directory))
+
+
+def filled_cache(directory, source, name, translations):
+    """Get the cache directory filled by a run with the translations, the run is made once"""
+    cache_dir = os.path.join(directory, name)
+    if not os.path.exists(cache_dir):
+        measure(source, os.path.join(directory, name + '.exe'), translations, dict(cache_dir=cache_dir))
+    return cache_dir
+
+
+def mode_cache_cold(directory, source, translations):
+    other_translations = dict(translations)
+    edited = list(translations)[len(translations) // 2]
+    other_translations[edited] = translations[edited] + ' (edited)'
+    # A copy is used, as the run adds its results to the cache
+    cache_dir = os.path.join(tempfile.mkdtemp(dir=directory), 'cache')
+    shutil.copytree(filled_cache(directory, source, 'cold-cache', other_translations), cache_dir)
+    return dict(cache_dir=cache_dir)
+
+
+def mode_cache_warm(directory, source, translations):
+    return dict(cache_dir=filled_cache(directory, source, 'warm-cache', translations))
+
+
+def filled_manifest(directory, source, name, translations):
+    """Get a copy of the manifest written by a run with the translations, the run is made once"""
+    manifest_path = os.path.join(directory, name)
+    if not os.path.exists(manifest_path):
+        measure(source, os.path.join(directory, name + '.exe'), translations, dict(manifest_path=manifest_path))
+    # A copy is used, as the run rewrites the manifest
+    path = os.path.join(tempfile.mkdtemp(dir=directory), 'manifest')
+    shutil.copyfile(manifest_path, path)
+    return path
+
+
+def mode_manifest_empty(directory, source, translations):
+    return dict(manifest_path=os.path.join(tempfile.mkdtemp(dir=directory), 'manifest'))
+
+
+def mode_manifest_edited(directory, source, translations):
+    # The translation is shorter than the string, so it is written in place with any manifest
+    shorter = [key for key, translation in translations.items() if len(translation) < len(key)]
+    edited = shorter[len(shorter) // 2]
+    other_translations = dict(translations)
+    other_translations[edited] = translations[edited].lower()
+    return dict(manifest_path=filled_manifest(directory, source, 'edited-manifest', other_translations))
+
+
+def mode_manifest_same(directory, source, translations):
+    return dict(manifest_path=filled_manifest(directory, source, 'same-manifest', translations))
+
+
+def mode_jobs(workers):
+    def mode(directory, source, translations):
+        return dict(workers=workers)
+    return mode
+
+
+modes = {
+    'file': mode_file,
+    'memory': mode_memory,
+    'cache-empty': mode_cache_empty,
+    'cache-cold': mode_cache_cold,
+    'cache-warm': mode_cache_warm,
+    'manifest-empty': mode_manifest_empty,
+    'manifest-edited': mode_manifest_edited,
+    'manifest-same': mode_manifest_same,
+    'jobs-2': mode_jobs(2),
+    'jobs-4': mode_jobs(4),
+}
+
+
+def measure(source, dest, translations, kwargs):
+    """Return the wall time, the CPU time of the process and the PatchReport of a run"""
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        report = run(source, dest, translations, 'cp1251', **kwargs)
+        wall_time, cpu_time = time.perf_counter() - wall_time, time.process_time() - cpu_time
+    return wall_time, cpu_time, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the modes of dfrus.run() on a synthetic executable')
+    parser.add_argument('--strings', type=int, default=8000, help='number of strings')
+    parser.add_argument('--pointers', type=int, default=100000, help='number of pointers in the data section')
+    parser.add_argument('--gap', type=int, default=0, help='number of bytes between the pieces of code')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each mode')
+    parser.add_argument('modes', nargs='*', metavar='mode', help=', '.join(modes))
+    args = parser.parse_args()
+    for name in args.modes:
+        if name not in modes:
+            parser.error('unknown mode: %s' % name)
+
+    image, strings = build_pe(args.strings, pointer_count=args.pointers, code_gap=args.gap)
+    translations = make_translations(strings)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'Dwarf Fortress.exe')
+        with open(source, 'wb') as file:
+            file.write(image)
+
+        print('%d bytes, %d strings, %d translations' % (len(image), len(strings), len(translations)))
+        print('%-16s %10s %10s   %s' % ('mode', 'wall, ms', 'CPU, ms', 'slowest stages'))
+        names = args.modes or list(modes)
+        best = dict()  # mode -> (wall time, report)
+        best_cpu_time = dict()
+        # The modes are run by turns, so that a change of the load of the machine affects all of them
+        for _ in range(args.repeat):
+            for name in names:
+                dest = os.path.join(directory, name + '.exe')
+                kwargs = modes[name](directory, source, translations)
+                wall_time, cpu_time, report = measure(source, dest, translations, kwargs)
+                if name not in best or wall_time < best[name][0]:
+                    best[name] = wall_time, report
+                best_cpu_time[name] = min(cpu_time, best_cpu_time.get(name, cpu_time))
+
+        expected = None
+        for name in names:
+            with open(os.path.join(directory, name + '.exe'), 'rb') as file:
+                patched = file.read()
+            if expected is None:
+                expected = patched
+            assert patched == expected, 'The patched executable differs in %r mode' % name
+
+            best_time, best_report = best[name]
+            slowest = sorted(best_report.stages.items(), key=lambda item: -item[1][0])[:3]
+            stages = ', '.join('%s %.0f' % (stage, times[0] * 1000) for stage, times in slowest)
+            print('%-16s %10.1f %10.1f   %s' % (name, best_time * 1000, best_cpu_time[name] * 1000, stages))
+
+
+if __name__ == '__main__':
+    main()
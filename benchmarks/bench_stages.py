@@ -0,0 +1,139 @@
+"""
+Measure time and peak memory of the stages of patching on a synthetic executable.
+
+Usage (from the root directory of the repository):
+    python -m benchmarks.bench_stages [--strings N] [--pointers N] [--seed N] [--no-memory]
+
+The executable is generated by synthetic_pe.build_pe(), --pointers sets the size of the table of pointers
+in its data section, so that the image has hundreds of thousands of relocations.
+Each stage is run once to measure its time and once more under tracemalloc to measure its peak memory.
+"""
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.cross_references import get_cross_references
+from dfrus.disasm import disasm
+from dfrus.extract_strings import extract_strings
+from dfrus.patchdf import fix_len, fix_df_exe
+from dfrus.peclasses import PortableExecutable, RelocationTable
+
+
+class Image:
+    """Data of the synthetic executable shared by the stages"""
+
+    def __init__(self, image, strings):
+        self.image = image
+        self.strings = strings
+        self.translations = make_translations(strings)
+        pe = PortableExecutable(io.BytesIO(image))
+        self.sections = pe.section_table
+        self.image_base = pe.optional_header.image_base
+        self.relocs = pe.relocation_table
+        self.xrefs = get_cross_references(io.BytesIO(image), self.relocs, self.sections, self.image_base)
+        self.report = None  # PatchReport of the last fix_df_exe() call
+
+
+def stage_relocation_table(image):
+    return len(PortableExecutable(io.BytesIO(image.image)).relocation_table)
+
+
+def stage_relocation_table_build(image):
+    return len(RelocationTable.build(list(image.relocs)))
+
+
+def stage_cross_references(image):
+    return len(get_cross_references(io.BytesIO(image.image), image.relocs, image.sections, image.image_base))
+
+
+def stage_extract_strings(image):
+    return len(list(extract_strings(io.BytesIO(image.image), image.xrefs, arrays=True)))
+
+
+def stage_disasm(image):
+    code_section = image.sections[0]
+    code = image.image[code_section.physical_offset:code_section.physical_offset + code_section.physical_size]
+    return sum(1 for _ in disasm(code, code_section.rva + image.image_base))
+
+
+def stage_fix_len(image):
+    fn = io.BytesIO(image.image)
+    code_section = image.sections[0]
+    code_end = code_section.physical_offset + code_section.physical_size
+    count = 0
+    for off, s, _ in extract_strings(fn, image.xrefs):
+        string_address = image.sections.offset_to_rva(off) + image.image_base
+        for ref in image.xrefs[off]:
+            if ref < code_end:
+                # Pretend that the translation is longer and is moved to other place
+                fix_len(fn, ref, len(s), len(s) + 8, string_address + 0x100000, string_address)
+                count += 1
+    return count
+
+
+def stage_fix_df_exe(image):
+    fn = io.BytesIO(image.image)
+    with contextlib.redirect_stdout(io.StringIO()):
+        image.report = fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', image.translations)
+    return len(fn.getvalue())
+
+
+stages = [
+    ('relocation table', stage_relocation_table),
+    ('RelocationTable.build', stage_relocation_table_build),
+    ('cross references', stage_cross_references),
+    ('extract strings', stage_extract_strings),
+    ('disasm', stage_disasm),
+    ('fix_len', stage_fix_len),
+    ('fix_df_exe', stage_fix_df_exe),
+]
+
+
+def measure(func, image, memory=True):
+    """Return the result of the stage, its wall time, CPU time and peak memory (None if it is not measured)"""
+    wall_time = time.perf_counter()
+    cpu_time = time.process_time()
+    result = func(image)
+    cpu_time = time.process_time() - cpu_time
+    wall_time = time.perf_counter() - wall_time
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func(image)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return result, wall_time, cpu_time, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the stages of patching on a synthetic executable')
+    parser.add_argument('--strings', type=int, default=20000, help='number of strings')
+    parser.add_argument('--pointers', type=int, default=300000, help='number of pointers in the data section')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="don't measure peak memory")
+    args = parser.parse_args()
+
+    image = Image(*build_pe(args.strings, pointer_count=args.pointers, seed=args.seed))
+    print('%d bytes, %d strings, %d relocations, %d cross-references' %
+          (len(image.image), len(image.strings), len(image.relocs), len(image.xrefs)))
+
+    print('%-24s %10s %10s %10s %12s' % ('stage', 'wall, ms', 'cpu, ms', 'peak, KiB', 'items'))
+    for title, func in stages:
+        result, wall_time, cpu_time, peak = measure(func, image, args.memory)
+        print('%-24s %10.1f %10.1f %10s %12d' % (title, wall_time * 1000, cpu_time * 1000,
+                                                  '-' if peak is None else '%d' % (peak // 1024), result))
+
+    print()
+    print('Stages of fix_df_exe:')
+    print(image.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Generator of synthetic 32-bit PE images resembling the layout of Dwarf Fortress.exe.
+
+The code section refers to the strings with the patterns dfrus recognizes
+(push offset str, mov reg, offset str, string copying with rep movsd, with a pair of registers or with movups),
+the data section holds a table of pointers, which adds relocations.
+Some of the patterns make fix_df_exe() write hooks and procedures to the new section and change relocations:
+initialization of stl-strings with the capacity in edi and a call after other instructions,
+and copying of strings with movups, which is too short to be replaced with the copying of a longer translation.
+"""
+import io
+import random
+
+from array import array
+
+from dfrus.binio import to_dword
+from dfrus.disasm import align
+from dfrus.peclasses import (ImageDosHeader, ImageFileHeader, ImageOptionalHeader, DataDirectory,
+                             DataDirectoryEntry, Section, RelocationTable)
+
+image_base = 0x400000
+file_alignment = 0x200
+section_alignment = 0x1000
+
+_words = ('dwarf fortress stone wood iron copper silver gold steel bronze sword axe pick hammer shield '
+          'helm mail cloak shirt trousers boots gloves apple plump helmet goblin elf human kobold cave '
+          'river forest mountain tavern temple library hospital barracks workshop farm still kitchen '
+          'leather granite diamond crystal bag mug cap ore gem log').split()
+
+
+def make_strings(count, rng):
+    strings = []
+    seen = set()
+    while len(strings) < count:
+        n = rng.randint(1, 4)
+        s = ' '.join(rng.choice(_words) for _ in range(n))
+        if rng.random() < 0.5:
+            s = s.capitalize()
+        if s not in seen:
+            seen.add(s)
+            strings.append(s)
+    return strings
+
+
+class _CodeBuilder:
+    def __init__(self, rva):
+        self.rva = rva
+        self.code = bytearray()
+        self.relocs = []  # rvas of absolute references
+
+    def emit(self, *parts):
+        for part in parts:
+            if isinstance(part, int):
+                self.code.append(part)
+            else:
+                self.code += part
+
+    def emit_abs(self, prefix, address):
+        self.emit(prefix)
+        self.relocs.append(self.rva + len(self.code))
+        self.emit(to_dword(address))
+
+    def emit_call(self, target_rva):
+        self.emit(0xE8)
+        disp = target_rva - (self.rva + len(self.code) + 4)
+        self.emit(to_dword(disp, signed=True))
+
+    def pad(self, gap=0):
+        self.emit(0xC3)  # retn
+        self.emit(b'\xCC' * gap)
+        while len(self.code) % 16:
+            self.emit(0xCC)
+
+
+def build_pe(string_count=1000, pointer_count=0, seed=0, code_gap=0):
+    """
+    Build a synthetic executable image, return a pair of the image and the list of its strings.
+    pointer_count is the number of entries of the table of pointers in the data section.
+    code_gap is the number of bytes put between the pieces of code which use the strings.
+    """
+    rng = random.Random(seed)
+    strings = make_strings(string_count, rng)
+
+    text_rva = 0x1000
+    headers_size = 0x400
+
+    # .rdata: strings, each aligned to 4 bytes
+    rdata = bytearray()
+    # Unicode charmap table like the one DF uses to render cp437 characters
+    charmap = [ord(c) for c in bytes(range(256)).decode('cp437')]
+    charmap[:8] = [0x20, 0x263A, 0x263B, 0x2665, 0x2666, 0x2663, 0x2660, 0x2022]
+    rdata += array('I', charmap).tobytes()
+    string_offsets = []
+    for s in strings:
+        string_offsets.append(len(rdata))
+        rdata += s.encode('cp437') + b'\0'
+        rdata += bytes(align(len(rdata)) - len(rdata))
+
+    # Estimate code size to place .rdata after .text
+    code_estimate = 0x100 + (48 + code_gap) * string_count
+    rdata_rva = align(text_rva + code_estimate, section_alignment)
+    rdata_size = len(rdata)
+    data_rva = align(rdata_rva + rdata_size, section_alignment)
+
+    code = _CodeBuilder(text_rva)
+    # A few target functions
+    funcs = []
+    for _ in range(8):
+        funcs.append(text_rva + len(code.code))
+        code.emit(0x55, 0x8B, 0xEC, 0x5D)  # push ebp; mov ebp, esp; pop ebp
+        code.pad()
+
+    for k, s in enumerate(strings):
+        address = image_base + rdata_rva + string_offsets[k]
+        n = len(s)
+        func = funcs[k % len(funcs)]
+        pattern = k % 6
+        if n + 1 == 8:
+            # Copy the string with a pair of registers:
+            # mov ecx, [str+4]; mov esi, eax; mov eax, [str]; mov [esp+20h], eax; mov [esp+24h], ecx
+            code.emit_abs(bytes((0x8B, 0x0D)), address + 4)
+            code.emit(0x8B, 0xF0)
+            code.emit_abs(0xA1, address)
+            code.emit(0x89, 0x44, 0x24, 0x20)
+            code.emit(0x89, 0x4C, 0x24, 0x24)
+            code.emit_call(func)
+        elif n + 1 == 16 and pattern != 2:
+            # Copy the string with an xmm register: movups xmm0, [str]; movups [esp+20h], xmm0; call func
+            code.emit_abs(bytes((0x0F, 0x10, 0x05)), address)
+            code.emit(0x0F, 0x11, 0x44, 0x24, 0x20)
+            code.emit_call(func)
+        elif pattern == 0:
+            # push len; push offset str; call func
+            code.emit(0x6A, n & 0xFF)
+            code.emit_abs(0x68, address)
+            code.emit_call(func)
+        elif pattern == 1:
+            # mov eax, offset str; push len; call func
+            code.emit_abs(0xB8, address)
+            code.emit(0x6A, n & 0xFF)
+            code.emit_call(func)
+        elif pattern == 2 and n in {15, 16}:
+            # Initialization of an stl-string with the capacity in edi:
+            # mov edi, len; mov eax, offset str; lea esi, [esp+40h]; mov [esp+54h], edi;
+            # mov dword ptr [esp+50h], 0; mov byte ptr [esp+40h], 0; call func
+            code.emit(0xBF, to_dword(n))
+            code.emit_abs(0xB8, address)
+            code.emit(0x8D, 0x74, 0x24, 0x40)
+            code.emit(0x89, 0x7C, 0x24, 0x54)
+            code.emit(0xC7, 0x44, 0x24, 0x50, to_dword(0))
+            code.emit(0xC6, 0x44, 0x24, 0x40, 0x00)
+            code.emit_call(func)
+        elif pattern == 2:
+            # mov edi, len; mov eax, offset str; call func
+            code.emit(0xBF, to_dword(n))
+            code.emit_abs(0xB8, address)
+            code.emit_call(func)
+        elif pattern == 3:
+            # mov ecx, dword_count; mov esi, offset str; lea edi, [esp+10h]; rep movsd; movsw; movsb
+            code.emit(0xB9, to_dword((n + 1) // 4))
+            code.emit_abs(0xBE, address)
+            code.emit(0x8D, 0x7C, 0x24, 0x10)
+            code.emit(0xF3, 0xA5)
+            r = (n + 1) % 4
+            if r & 2:
+                code.emit(0x66, 0xA5)
+            if r & 1:
+                code.emit(0xA4)
+        else:
+            # push offset str; call func
+            code.emit_abs(0x68, address)
+            code.emit_call(func)
+        code.pad(code_gap)
+
+    assert len(code.code) <= code_estimate, (len(code.code), code_estimate)
+
+    # .data: a table of pointers to the strings and to the code
+    data = bytearray()
+    data_relocs = []
+    for k in range(pointer_count):
+        data_relocs.append(data_rva + len(data))
+        if k % 2:
+            data += to_dword(image_base + rdata_rva + string_offsets[k % string_count])
+        else:
+            data += to_dword(image_base + funcs[k % len(funcs)])
+    # A reference to the charmap table
+    data_relocs.append(data_rva + len(data))
+    data += to_dword(image_base + rdata_rva)
+    data += bytes(16)
+
+    relocs = code.relocs + data_relocs
+    reloc_table = RelocationTable.build(relocs)
+    reloc_rva = align(data_rva + len(data), section_alignment)
+
+    raw_sections = [
+        (b'.text', text_rva, bytes(code.code),
+         Section.IMAGE_SCN_CNT_CODE | Section.IMAGE_SCN_MEM_EXECUTE | Section.IMAGE_SCN_MEM_READ),
+        (b'.rdata', rdata_rva, bytes(rdata),
+         Section.IMAGE_SCN_CNT_INITIALIZED_DATA | Section.IMAGE_SCN_MEM_READ),
+        (b'.data', data_rva, bytes(data),
+         Section.IMAGE_SCN_CNT_INITIALIZED_DATA | Section.IMAGE_SCN_MEM_READ | Section.IMAGE_SCN_MEM_WRITE),
+    ]
+
+    with io.BytesIO() as buffer:
+        reloc_table.to_file(buffer)
+        reloc_data = buffer.getvalue()
+
+    # Reserve some room for the relocation table to grow
+    raw_sections.append((b'.reloc', reloc_rva, reloc_data + bytes(0x1000),
+                         Section.IMAGE_SCN_CNT_INITIALIZED_DATA | Section.IMAGE_SCN_MEM_READ |
+                         Section.IMAGE_SCN_MEM_DISCARDABLE))
+
+    sections = []
+    body = bytearray()
+    offset = headers_size
+    for name, rva, content, flags in raw_sections:
+        physical_size = align(len(content), file_alignment)
+        sections.append(Section(name=name, virtual_size=len(content), rva=rva, physical_size=physical_size,
+                                physical_offset=offset, flags=flags))
+        body += content.ljust(physical_size, b'\0')
+        offset += physical_size
+
+    last = sections[-1]
+    size_of_image = align(last.rva + last.virtual_size, section_alignment)
+
+    dos_header = ImageDosHeader(b'MZ', *([0] * 15), 0x40)
+    file_header = ImageFileHeader(0x014C, len(sections), 0, 0, 0,
+                                  ImageOptionalHeader.sizeof() + DataDirectory.sizeof(), 0x0102)
+    optional_header = ImageOptionalHeader(
+        0x10B, 14, 0, sections[0].physical_size,
+        sum(x.physical_size for x in sections[1:]), 0, text_rva, text_rva,
+        rdata_rva, image_base, section_alignment, file_alignment,
+        5, 1,
+        0, 0,
+        5, 1,
+        0, size_of_image, headers_size, 0,
+        2, 0, 0x100000, 0x1000,
+        0x100000, 0x1000, 0, 16
+    )
+    entries = [DataDirectoryEntry(0, 0) for _ in DataDirectory._field_names]
+    basereloc_index = DataDirectory._field_names.index('basereloc')
+    entries[basereloc_index] = DataDirectoryEntry(reloc_rva, len(reloc_data))
+    data_directory = DataDirectory(*entries)
+
+    headers = bytearray(bytes(dos_header))
+    headers += b'PE\0\0' + bytes(file_header) + bytes(optional_header) + bytes(data_directory)
+    for section in sections:
+        headers += bytes(section)
+    assert len(headers) <= headers_size
+
+    image = bytes(headers.ljust(headers_size, b'\0')) + bytes(body)
+    return image, strings
+
+
+def make_translations(strings, seed=0):
+    """Make a dictionary with shorter and longer translations for 80% of the strings"""
+    rng = random.Random(seed)
+    table = dict()
+    for s in strings:
+        r = rng.random()
+        if r < 0.4:
+            table[s] = s.upper()[:max(1, len(s) - rng.randint(0, 3))]
+        elif r < 0.8:
+            table[s] = s.upper() + ' ' + ' '.join(rng.choice(_words) for _ in range(rng.randint(1, 3)))
+    return table
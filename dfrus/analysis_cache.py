@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import zlib
+
+from base64 import b64decode, b64encode
+
+from . import __version__
+from .patchdf import Fix, Metadata
+from .serialization import encode, decode
+
+_suffix = '.dfrus-cache'
+
+
+def file_digest(path, block_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def cache_key(digest):
+    return '%s-%s' % (digest, __version__)
+
+
+def _pack(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _unpack(stored):
+    # Values set in this process are kept pickled, values loaded from a file are kept as JSON texts.
+    # A JSON text is never unpickled.
+    if isinstance(stored, bytes):
+        return pickle.loads(stored)
+    return decode(json.loads(stored))
+
+
+def _to_json(stored):
+    if isinstance(stored, bytes):
+        return json.dumps(encode(pickle.loads(stored)))
+    return stored
+
+
+_plain_types = {str, int, bool, float}
+
+
+def _attributes_to_row(obj, exclude=None):
+    return {name: value if type(value) in _plain_types else encode(value)
+            for name, value in vars(obj).items() if value is not None and name != exclude}
+
+
+def _writes_to_row(writes):
+    return [[offset, b64encode(data).decode('ascii')] for offset, data in writes]
+
+
+def _pieces_to_row(pieces):
+    return [[offset, size, b64encode(digest).decode('ascii')] for offset, size, digest in pieces]
+
+
+def fix_to_row(fix):
+    """
+    Convert a Fix object to a flat JSON-compatible row: [attributes of the fix, attributes of its metadata].
+    Only the attributes which are not None are kept.
+    The row is restored much faster than the output of encode(), as most of the attributes are plain values.
+    """
+    if fix is None:
+        return [None, None]
+
+    fix_attributes = _attributes_to_row(fix, exclude='meta')
+    meta_attributes = None if fix.meta is None else _attributes_to_row(fix.meta)
+    return [fix_attributes, meta_attributes]
+
+
+def _fix_len_result_to_row(fix, writes, pieces):
+    """
+    Convert a result of fix_len() to a flat JSON-compatible row:
+    [attributes of the Fix object, attributes of its metadata, writes, pieces] (see fix_to_row),
+    the writes are lists of [offset, base64 data] pairs,
+    the pieces are lists of [offset, size, base64 digest] (see patchdf.read_pieces).
+    """
+    return fix_to_row(fix) + [_writes_to_row(writes), _pieces_to_row(pieces)]
+
+
+def _attributes_from_row(obj, attributes):
+    known = vars(obj)
+    for name, value in attributes.items():
+        if name not in known:
+            raise ValueError('Unexpected attribute of %s: %r' % (type(obj).__name__, name))
+        # Plain values are kept as is by _attributes_to_row()
+        known[name] = decode(value) if isinstance(value, (list, dict)) else value
+    return obj
+
+
+def fix_from_row(row):
+    """Restore the Fix object from the row made by fix_to_row(), a new object is made each time"""
+    fix_attributes, meta_attributes = row[:2]
+    if fix_attributes is None:
+        return None
+    fix = _attributes_from_row(Fix(), fix_attributes)
+    if meta_attributes is not None:
+        fix.meta = _attributes_from_row(Metadata(), meta_attributes)
+    return fix
+
+
+def _fix_len_result_from_row(row):
+    """Restore the (fix, writes, pieces) result of fix_len() from the row, new objects are made each time"""
+    pieces = [(offset, size, b64decode(digest)) for offset, size, digest in row[3]]
+    writes = [(offset, b64decode(data)) for offset, data in row[2]]
+    return fix_from_row(row), writes, pieces
+
+
+class CacheEntry:
+    """
+    Analysis results of a single executable.
+    Values are stored packed, so get() returns a fresh copy of the value each time and the caller may modify it.
+    In files the values are stored as JSON texts (see serialization.encode), they are parsed only when requested.
+
+    Results of fix_len() are kept as flat JSON-compatible rows (see _fix_len_result_to_row) both in memory
+    and in files, so the whole table is parsed with the file at once and a result is restored without
+    the recursive decoding. Only the results used by the latest run are saved.
+    """
+
+    def __init__(self, key, values=None, fix_len_results=None):
+        self.key = key
+        self._values = values or dict()
+        self._fix_len_results = fix_len_results or dict()
+        self._used_fix_len_results = dict()
+        self.modified = False
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name, default=None):
+        if name not in self._values:
+            return default
+        return _unpack(self._values[name])
+
+    def set(self, name, value):
+        self._values[name] = _pack(value)
+        self.modified = True
+
+    def has_fix_len_result(self, args):
+        return args in self._fix_len_results
+
+    def get_fix_len_result(self, args):
+        """
+        Return a tuple of a Fix object, a list of (offset, data) writes made by fix_len() called with the given
+        arguments and a list of (offset, size, digest) pieces of the file it read (see patchdf.read_pieces).
+        The result is valid only if the file has the same data there.
+        """
+        row = self._fix_len_results.get(args)
+        if row is None:
+            return None
+        self._used_fix_len_results[args] = row
+        return _fix_len_result_from_row(row)
+
+    def set_fix_len_result(self, args, fix, writes, reads):
+        self._fix_len_results[args] = self._used_fix_len_results[args] = _fix_len_result_to_row(fix, writes, reads)
+        self.modified = True
+
+    @staticmethod
+    def _values_to_json(values):
+        return {name: _to_json(stored) for name, stored in values.items()}
+
+    @staticmethod
+    def _values_from_json(values):
+        if not all(isinstance(stored, str) for stored in values.values()):
+            raise TypeError('Values must be JSON texts')
+        return values
+
+    @staticmethod
+    def _fix_len_results_to_list(fix_len_results):
+        return [[list(args), row] for args, row in fix_len_results.items()]
+
+    @staticmethod
+    def _fix_len_results_from_list(items):
+        if not all(isinstance(row, list) and len(row) == 4 for _, row in items):
+            raise TypeError('Results must be rows of 4 items')
+        return {tuple(args): row for args, row in items}
+
+    def to_bytes(self):
+        # The fastest compression level: the data is stored after each run, a file of 20% larger size is not an issue
+        return zlib.compress(json.dumps({
+            'values': self._values_to_json(self._values),
+            'fix_len_results': self._fix_len_results_to_list(self._used_fix_len_results),
+        }).encode('utf-8'), 1)
+
+    @classmethod
+    def from_bytes(cls, key, data):
+        """Load the entry saved with to_bytes(), ValueError is raised if the data is broken"""
+        try:
+            data = json.loads(zlib.decompress(data).decode('utf-8'))
+            return cls(key, cls._values_from_json(data['values']),
+                       cls._fix_len_results_from_list(data['fix_len_results']))
+        except (zlib.error, KeyError, TypeError) as ex:
+            raise ValueError('Broken cache data: %r' % ex)
+
+
+class AnalysisCache:
+    """
+    Directory of zlib-compressed JSON files with analysis results of executables (see CacheEntry.to_bytes).
+    Files are keyed by SHA-256 of the original executable and the dfrus version.
+    The least recently used files are removed when the total size of the directory exceeds max_size.
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _suffix)
+
+    def entry(self, digest):
+        key = cache_key(digest)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = CacheEntry.from_bytes(key, file.read())
+        except (OSError, ValueError):
+            return CacheEntry(key)
+
+        os.utime(path)  # Mark the file as recently used
+        return entry
+
+    def store(self, entry):
+        if not entry.modified:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(entry.key)
+        # A unique temporary file, so that concurrent writers of the same entry don't collide
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(entry.to_bytes())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        entry.modified = False
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(_suffix):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            if path != keep:
+                os.remove(path)
+                total_size -= size
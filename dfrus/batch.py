@@ -0,0 +1,85 @@
+import contextlib
+import io
+import json
+import os
+import time
+import traceback
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from .compiled_dictionary import load_dictionary, closing_dictionary
+from .dfrus import run
+
+BatchJob = namedtuple('BatchJob', 'path dest dictionary codepage original_codepage')
+BatchResult = namedtuple('BatchResult', 'job elapsed report error log')
+
+executable_name = 'Dwarf Fortress.exe'
+
+
+def find_builds(directory, dictionary, codepage=None, original_codepage='cp437',
+                dest_name='Dwarf Fortress Patched.exe'):
+    """Make a job for each Dwarf Fortress.exe in the directory tree, the patched file is put next to it"""
+    jobs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if executable_name in files:
+            jobs.append(BatchJob(os.path.join(root, executable_name), os.path.join(root, dest_name),
+                                 dictionary, codepage, original_codepage))
+    return jobs
+
+
+def load_batch_manifest(path, dictionary=None, codepage=None, original_codepage='cp437'):
+    """
+    Load jobs from a JSON file with a list of objects with "path", "dest", "dictionary", "codepage"
+    and "original_codepage" keys. Relative paths are relative to the directory of the file,
+    the missing keys (except "path") are taken from the arguments.
+    """
+    with open(path, encoding='utf-8') as file:
+        items = json.load(file)
+
+    base = os.path.dirname(os.path.abspath(path))
+
+    def full_path(value):
+        return None if value is None else os.path.join(base, value)
+
+    jobs = []
+    for item in items:
+        source = full_path(item['path'])
+        dest = item.get('dest')
+        dest = full_path(dest) if dest else os.path.join(os.path.dirname(source), 'Dwarf Fortress Patched.exe')
+        jobs.append(BatchJob(source, dest, full_path(item.get('dictionary')) or dictionary,
+                             item.get('codepage', codepage), item.get('original_codepage', original_codepage)))
+    return jobs
+
+
+def run_job(job: BatchJob):
+    """Patch a single build, the messages are collected to the log, an error is returned instead of being raised"""
+    log = io.StringIO()
+    report = None
+    error = None
+    start = time.perf_counter()
+    try:
+        if not os.path.isfile(job.path):
+            # run() would take Dwarf Fortress.exe from the current directory instead
+            raise FileNotFoundError("'%s' not found" % job.path)
+
+        with contextlib.redirect_stdout(log):
+            with closing_dictionary(load_dictionary(job.dictionary)) as trans_table:
+                report = run(job.path, job.dest, trans_table, job.codepage, job.original_codepage, in_memory=True)
+    except Exception:
+        error = traceback.format_exc()
+    return BatchResult(job, time.perf_counter() - start, report, error, log.getvalue())
+
+
+def run_batch(jobs, workers=1):
+    """
+    Patch the builds in a pool of at most workers processes, yield BatchResult for each job in their order.
+    A failure of a job doesn't stop the others.
+    """
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+            yield from executor.map(run_job, jobs)
+    else:
+        for job in jobs:
+            yield run_job(job)
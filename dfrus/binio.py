@@ -1,5 +1,6 @@
 
 import collections
+import io
 
 
 def put_integer32(file_object, val):
@@ -35,23 +36,27 @@ def write_string(file_object, s: str, off=None, new_len=None, encoding=None):
     file_object.write(s.ljust(new_len, b'\0'))
 
 
+def poke_bytes(file_object, off, data):
+    file_object.seek(off)
+    file_object.write(data)
+
+
 def fpoke4(file_object, off, x):
     if isinstance(x, collections.Iterable):
-        file_object.seek(off)
-        write_dwords(file_object, x)
+        poke_bytes(file_object, off, b''.join(to_dword(item) for item in x))
     else:
-        file_object.seek(off)
-        put_integer32(file_object, x)
+        poke_bytes(file_object, off, to_dword(x))
 
 
 def fpoke(file_object, off, x):
     assert off, off
-    if isinstance(x, collections.Iterable):
-        file_object.seek(off)
-        file_object.write(bytes(to_unsigned(item, 8) for item in x))
+    if isinstance(x, (bytes, bytearray, memoryview)):
+        # Already a byte string, write it as is with a single call
+        poke_bytes(file_object, off, x)
+    elif isinstance(x, collections.Iterable):
+        poke_bytes(file_object, off, bytes(to_unsigned(item, 8) for item in x))
     else:
-        file_object.seek(off)
-        file_object.write(bytes([to_unsigned(x, 8)]))
+        poke_bytes(file_object, off, bytes([to_unsigned(x, 8)]))
 
 
 def to_signed(x, width):
@@ -77,3 +82,87 @@ def from_dword(b, signed=False, byteorder='little'):
 
 def to_dword(x, signed=False, byteorder='little'):
     return x.to_bytes(length=4, byteorder=byteorder, signed=signed)
+
+
+class RecordingFile:
+    """
+    File-like wrapper which records all the writes as a list of (offset, data) pairs
+    and all the reads as a list of (offset, size) pairs.
+    If passthrough is False, the writes are only recorded and the underlying file is left intact,
+    and if overlay is True, the following reads return the data as if the writes were made.
+    """
+
+    def __init__(self, file_object, passthrough=True, overlay=False):
+        self._file = file_object
+        self._passthrough = passthrough
+        self._overlay = overlay and not passthrough
+        self._position = 0
+        self.writes = []
+        self.reads = []
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._position = offset
+        elif whence == 1:
+            self._position += offset
+        else:
+            self._position = self._file.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        self._file.seek(self._position)
+        data = self._file.read(size)
+        self.reads.append((self._position, size if size >= 0 else len(data)))
+        if self._overlay and self.writes:
+            data = self._overlay_writes(self._position, data)
+        self._position += len(data)
+        return data
+
+    def _overlay_writes(self, offset, data):
+        data = bytearray(data)
+        end = offset + len(data)
+        for write_offset, written in self.writes:
+            start = max(offset, write_offset)
+            stop = min(end, write_offset + len(written))
+            if start < stop:
+                data[start - offset:stop - offset] = written[start - write_offset:stop - write_offset]
+        return bytes(data)
+
+    def write(self, data):
+        data = bytes(data)
+        self.writes.append((self._position, data))
+        if self._passthrough:
+            self._file.seek(self._position)
+            self._file.write(data)
+        self._position += len(data)
+        return len(data)
+
+
+def apply_writes(file_object, writes):
+    for off, data in writes:
+        poke_bytes(file_object, off, data)
+
+
+def apply_writes_at_once(file_object, writes):
+    """Same as apply_writes(), but the whole span of the writes is read, patched in memory and written back"""
+    if not writes:
+        return
+    start = min(off for off, _ in writes)
+    end = max(off + len(data) for off, data in writes)
+    file_object.seek(start)
+    span = bytearray(file_object.read(end - start))
+    span.extend(bytes(end - start - len(span)))  # The writes can extend the file
+    for off, data in writes:
+        span[off - start:off - start + len(data)] = data
+    poke_bytes(file_object, start, span)
+
+
+class ImageBuffer(io.BytesIO):
+    """
+    In-memory file with the whole image of an executable, so that it is patched without system calls.
+    read_bytes(), fpoke(), fpoke4() and apply_writes() use its seek(), read() and write() the same way as with a file,
+    io.BytesIO implements them in C. Writes beyond the end extend the image.
+    """
@@ -0,0 +1,337 @@
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, chain
+
+from .binio import read_bytes
+from .disasm import disasm, opcode_decoders, x0f_opcode_decoders, prefix_bytes, parse_prefixes
+from .opcodes import *
+
+
+class InstructionClass:
+    other = 0
+    jmp = 1
+    jcc = 2
+    call = 3
+    ret = 4
+    unknown = 5  # Not recognized by the sweep, must be disassembled as usual
+
+    rep = 0x80  # Flag of instructions with rep or repne prefix
+
+
+def _modrm_end(s, i):
+    """Get the offset after the ModR/M byte at i and the following SIB byte and displacement"""
+    modrm = s[i]
+    mode = modrm >> 6
+    regmem = modrm & 7
+    i += 1
+    if mode == 3:
+        return i
+    elif mode == 0 and regmem == 5:
+        return i + 4
+
+    if regmem == 4:
+        sib = s[i]
+        i += 1
+        if mode == 0 and sib & 7 == Reg.ebp.code:
+            return i + 4
+
+    if mode == 1:
+        return i + 1
+    elif mode == 2:
+        return i + 4
+    return i
+
+
+# Instruction length rules.
+# Each rule takes the buffer, the offset of the opcode byte and the operand size prefix flag,
+# and returns the offset after the instruction and its class, or -1 if the instruction must be disassembled as usual
+# (the disassembler would fail or show it as 'db').
+# Prefixes which are yielded as a separate 'db' line are handled by the caller.
+
+_unknown = (-1, InstructionClass.unknown)
+
+
+def _rule_noargs(s, i, size_prefix):
+    return i + 1, InstructionClass.ret if s[i] == ret_near else InstructionClass.other
+
+
+def _rule_ret_near_n(s, i, size_prefix):
+    return i + 3, InstructionClass.ret
+
+
+def _rule_call_jmp_near(s, i, size_prefix):
+    return i + 5, InstructionClass.call if s[i] == call_near else InstructionClass.jmp
+
+
+def _rule_jmp_short(s, i, size_prefix):
+    return i + 2, InstructionClass.jmp if s[i] == jmp_short else InstructionClass.jcc
+
+
+def _rule_modrm(s, i, size_prefix):
+    return _modrm_end(s, i + 1), InstructionClass.other
+
+
+def _rule_modrm_sized(s, i, size_prefix):
+    # Byte operations are not supported with the operand size prefix
+    if size_prefix and not s[i] & 1:
+        return _unknown
+    return _modrm_end(s, i + 1), InstructionClass.other
+
+
+def _rule_op_rm_imm(s, i, size_prefix):
+    flags = s[i] & 3
+    if size_prefix and flags == 0 and s[i + 1] >> 6 != 3:
+        return _unknown
+    return _modrm_end(s, i + 1) + (4 if flags == 1 else 1), InstructionClass.other
+
+
+def _rule_op_rm_reg_no_dir(s, i, size_prefix):
+    flag_size = s[i] & 1
+    if size_prefix and not flag_size:
+        return _unknown
+
+    end = _modrm_end(s, i + 1)
+    if s[i] & 0xFE == mov_rm_imm:
+        if s[i + 1] & 0x38:
+            return _unknown
+        end += 1 << (flag_size * 2 - size_prefix)
+    return end, InstructionClass.other
+
+
+def _rule_op_reg(s, i, size_prefix):
+    return i + 1, InstructionClass.other
+
+
+_op_FE_classes = (InstructionClass.other, InstructionClass.other, InstructionClass.call, InstructionClass.call,
+                  InstructionClass.jmp, InstructionClass.jmp, InstructionClass.other)
+
+
+def _rule_op_FE(s, i, size_prefix):
+    flag_size = s[i] & 1
+    op = (s[i + 1] & 0x38) >> 3
+    if op == 7 or not flag_size and (op >= 2 or size_prefix):
+        return _unknown
+    return _modrm_end(s, i + 1), _op_FE_classes[op]
+
+
+def _rule_mov_acc_mem(s, i, size_prefix):
+    if size_prefix and not s[i] & 1:
+        return _unknown
+    return i + 5, InstructionClass.other
+
+
+def _rule_push_imm(s, i, size_prefix):
+    return i + (2 if s[i] & 2 else 5), InstructionClass.other
+
+
+def _rule_op_acc_imm(s, i, size_prefix):
+    flag_size = s[i] & 1
+    if size_prefix and not flag_size:
+        return _unknown
+    return i + 1 + (1 << (flag_size * 2 - size_prefix)), InstructionClass.other
+
+
+def _rule_mov_reg_imm(s, i, size_prefix):
+    flag_size = (s[i] & 8) >> 3
+    if size_prefix and not flag_size:
+        return _unknown
+    return i + 1 + (1 << (flag_size * 2 - size_prefix)), InstructionClass.other
+
+
+def _rule_shift(s, i, size_prefix):
+    if size_prefix and not s[i] & 1:
+        return _unknown
+    end = _modrm_end(s, i + 1)
+    if s[i] & 0xFE == shift_op_rm_imm8:
+        end += 1
+    return end, InstructionClass.other
+
+
+def _rule_test_or_unary(s, i, size_prefix):
+    flag_size = s[i] & 1
+    modrm1 = (s[i + 1] & 0x38) >> 3
+    if modrm1 == 1 or size_prefix and not flag_size:
+        return _unknown
+    end = _modrm_end(s, i + 1)
+    if modrm1 == 0:
+        end += 1 << (flag_size * 2 - size_prefix)
+    return end, InstructionClass.other
+
+
+def _rule_x0f(s, i, size_prefix):
+    rule = _x0f_rules[s[i + 1]]
+    if rule is None:
+        return _unknown
+    return rule(s, i + 1, size_prefix)
+
+
+def _rule_x0f_setcc(s, i, size_prefix):
+    if s[i + 1] & 0xC0 != 0xC0:
+        return _unknown
+    return i + 2, InstructionClass.other
+
+
+def _rule_x0f_jcc_near(s, i, size_prefix):
+    return i + 5, InstructionClass.jcc
+
+
+# Rules by the kinds of the disassembler decoders (see disasm.opcode_decoders),
+# the instructions of the other kinds are left to the disassembler
+_rules_by_kind = {
+    'noargs': _rule_noargs,
+    'ret_near_n': _rule_ret_near_n,
+    'call_jmp_near': _rule_call_jmp_near,
+    'jmp_short': _rule_jmp_short,
+    'lea': _rule_modrm,
+    'op_rm_imm': _rule_op_rm_imm,
+    'op_rm_reg_no_dir': _rule_op_rm_reg_no_dir,
+    'op_rm_reg': _rule_modrm_sized,
+    'op_reg': _rule_op_reg,
+    'op_FE': _rule_op_FE,
+    'mov_acc_mem': _rule_mov_acc_mem,
+    'pop_rm': _rule_modrm,
+    'push_imm': _rule_push_imm,
+    'op_acc_imm': _rule_op_acc_imm,
+    'mov_reg_imm': _rule_mov_reg_imm,
+    'shift': _rule_shift,
+    'test_or_unary': _rule_test_or_unary,
+    'x0f': _rule_x0f,
+}
+
+_x0f_rules_by_kind = {
+    'setcc': _rule_x0f_setcc,
+    'jcc_near': _rule_x0f_jcc_near,
+    'movzx_movsx': lambda s, i, size_prefix: (_modrm_end(s, i + 1), InstructionClass.other),
+    'cmov': lambda s, i, size_prefix: (_modrm_end(s, i + 1), InstructionClass.other),
+}
+
+# Rules are taken from the disassembler dispatch tables, so that they match its choice of decoders
+_opcode_rules = [_rules_by_kind.get(decoder.kind) for decoder in opcode_decoders]
+_flushes = [decoder.flushes_prefixes for decoder in opcode_decoders]
+_x0f_rules = [_x0f_rules_by_kind.get(decoder.kind) for decoder in x0f_opcode_decoders]
+
+
+def _rule_prefixed(s, i, size_prefix):
+    opcode_pos, size_prefix, _, rep_prefix = parse_prefixes(s, i)
+    rule = _opcode_rules[s[opcode_pos]]
+    if rule is None or _flushes[s[opcode_pos]] and not (rule is _rule_noargs and rep_prefix):
+        # Prefixes which would be shown as a separate line are left to the disassembler
+        return _unknown
+
+    end, instruction_class = rule(s, opcode_pos, size_prefix)
+    if end >= 0 and rep_prefix in {Prefix.rep, Prefix.repne}:
+        instruction_class |= InstructionClass.rep
+    return end, instruction_class
+
+
+_rules = [_rule_prefixed if byte in prefix_bytes else rule for byte, rule in enumerate(_opcode_rules)]
+
+
+class CodeIndex:
+    """
+    Index of instructions of the code section made with a single linear sweep.
+
+    For every instruction the offset, the length and the class (jump, call, return etc.) are stored in arrays.
+    Disassembling from any indexed offset gives the same sequence of instructions as the index, until an instruction
+    of the unknown class, which must be disassembled as usual.
+
+    Patches made during the translation only change immediate values and displacements of instructions,
+    so the lengths and the classes stay valid, but the instructions themselves must be disassembled
+    from the actual data.
+    """
+
+    def __init__(self, starts=None, lengths=None, classes=None):
+        self.starts = starts if starts is not None else array('I')
+        self.lengths = lengths if lengths is not None else array('B')
+        self.classes = classes if classes is not None else array('B')
+
+    @classmethod
+    def from_bytes(cls, s, start_address=0):
+        index = cls()
+        starts = index.starts
+        lengths = index.lengths
+        classes = index.classes
+        size = len(s)
+        s = bytes(s) + bytes(16)  # Padding to read beyond the end safely, such instructions are marked as unknown
+        rules = _rules
+        unknown = InstructionClass.unknown
+        i = 0
+        while i < size:
+            rule = rules[s[i]]
+            if rule is None:
+                end = -1
+            else:
+                end, instruction_class = rule(s, i, False)
+
+            starts.append(start_address + i)
+            if end < 0 or end > size:
+                lengths.append(1)
+                classes.append(unknown)
+                i += 1
+            else:
+                lengths.append(end - i)
+                classes.append(instruction_class)
+                i = end
+
+        return index
+
+    @classmethod
+    def from_section(cls, fn, section):
+        return cls.from_bytes(read_bytes(fn, section.physical_offset, section.physical_size),
+                              section.physical_offset)
+
+    def __getstate__(self):
+        # Offsets are not stored, they are restored from the lengths
+        start_address = self.starts[0] if self.starts else 0
+        return start_address, self.lengths.tobytes(), self.classes.tobytes()
+
+    def __setstate__(self, state):
+        start_address, lengths, classes = state
+        self.lengths = array('B', lengths)
+        self.classes = array('B', classes)
+        self.starts = array('I', accumulate(chain([start_address], self.lengths[:-1])))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, offset):
+        """Get position of the instruction at the offset in the index or None if the offset is not indexed"""
+        k = bisect_left(self.starts, offset)
+        if k < len(self.starts) and self.starts[k] == offset:
+            return k
+        return None
+
+    def significant_lines(self, s, start_address, counter=None):
+        """
+        Same as disasm(s, start_address), but instructions of the 'other' class are skipped without being disassembled,
+        only jumps, calls, returns, rep-prefixed and not recognized instructions are yielded.
+        The disassembled instructions are counted with the counter (DisasmCounter) if it is given.
+        """
+        k = self.find(start_address)
+        if k is None:
+            yield from disasm(s, start_address, counter)
+            return
+
+        starts = self.starts
+        lengths = self.lengths
+        classes = self.classes
+        end_address = start_address + len(s)
+        address = start_address
+        other = InstructionClass.other
+        unknown = InstructionClass.unknown
+        while k < len(starts):
+            instruction_class = classes[k]
+            next_address = address + lengths[k]
+            if instruction_class == unknown or next_address > end_address:
+                break
+
+            if instruction_class != other:
+                local_offset = address - start_address
+                yield next(disasm(s[local_offset:local_offset + lengths[k]], address, counter))
+
+            address = next_address
+            k += 1
+
+        # The rest is disassembled as usual
+        local_offset = address - start_address
+        yield from disasm(s[local_offset:], address, counter)
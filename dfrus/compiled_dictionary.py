@@ -0,0 +1,161 @@
+import mmap
+import struct
+import sys
+import zlib
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from .patchdf import load_trans_file
+
+_magic = b'DFRUSDCT'
+_version = 1
+_header = struct.Struct('<8sII')  # magic, version, number of entries
+_entry_size = 4  # key offset, key size, value offset, value size
+
+
+def _to_little_endian(items: array):
+    if sys.byteorder != 'little':
+        items.byteswap()
+    return items
+
+
+def compile_dictionary(pairs, path):
+    """
+    Write (string, translation) pairs to a compiled dictionary file.
+    As with dict(pairs), the last translation of a repeated string is kept.
+
+    The file consists of a header, CRC-32 hashes of the strings (UTF-8) in the ascending order,
+    the numbers of the entries with these hashes, the entries (offsets and sizes of the string and the translation
+    in the blob) in the order of the first occurrence of the strings, and the blob of UTF-8 encoded texts.
+    """
+    translations = OrderedDict(pairs)
+    entries = array('I')
+    blob = bytearray()
+    hashes = []
+    for i, (string, translation) in enumerate(translations.items()):
+        key = string.encode('utf-8')
+        value = translation.encode('utf-8')
+        entries.extend([len(blob), len(key), len(blob) + len(key), len(value)])
+        blob += key + value
+        hashes.append((zlib.crc32(key), i))
+
+    hashes.sort()
+    with open(path, 'wb') as file:
+        file.write(_header.pack(_magic, _version, len(translations)))
+        file.write(_to_little_endian(array('I', (crc for crc, _ in hashes))).tobytes())
+        file.write(_to_little_endian(array('I', (i for _, i in hashes))).tobytes())
+        file.write(_to_little_endian(entries).tobytes())
+        file.write(blob)
+
+
+def is_compiled_dictionary(path):
+    with open(path, 'rb') as file:
+        return file.read(len(_magic)) == _magic
+
+
+class CompiledDictionary(Mapping):
+    """
+    Read-only mapping of strings to translations stored in a compiled dictionary file (see compile_dictionary).
+    The file is mapped into memory and nothing is parsed in advance, the entries are found by the hashes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._count = _header.unpack_from(self._data)
+        if magic != _magic or version != _version:
+            self.close()
+            raise ValueError("'%s' is not a compiled dictionary of version %d" % (path, _version))
+
+        size = self._count * 4
+        tables_offset = _header.size
+        tables = memoryview(self._data)[tables_offset:tables_offset + size * (2 + _entry_size)]
+        if sys.byteorder == 'little':
+            tables = tables.cast('I')
+        else:
+            tables = _to_little_endian(array('I', tables.tobytes()))
+
+        self._hashes = tables[:self._count]
+        self._order = tables[self._count:self._count * 2]
+        self._entries = tables[self._count * 2:]
+        self._blob_offset = tables_offset + size * (2 + _entry_size)
+
+    def close(self):
+        self._hashes = self._order = self._entries = None
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __reduce__(self):
+        # The mapping is opened anew when it is passed to other process
+        return type(self), (self.path,)
+
+    def _read(self, offset, size):
+        start = self._blob_offset + offset
+        return self._data[start:start + size]
+
+    def _entry(self, i):
+        return self._entries[i * _entry_size:(i + 1) * _entry_size]
+
+    def _find(self, string):
+        """Return the number of the entry of the string or None"""
+        if not isinstance(string, str):
+            return None
+
+        key = string.encode('utf-8')
+        crc = zlib.crc32(key)
+        i = bisect_left(self._hashes, crc)
+        while i < self._count and self._hashes[i] == crc:
+            entry = self._order[i]
+            key_offset, key_size, _, _ = self._entry(entry)
+            if key_size == len(key) and self._read(key_offset, key_size) == key:
+                return entry
+            i += 1
+        return None
+
+    def __getitem__(self, string):
+        entry = self._find(string)
+        if entry is None:
+            raise KeyError(string)
+        _, _, value_offset, value_size = self._entry(entry)
+        return self._read(value_offset, value_size).decode('utf-8')
+
+    def __contains__(self, string):
+        return self._find(string) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            key_offset, key_size, _, _ = self._entry(i)
+            yield self._read(key_offset, key_size).decode('utf-8')
+
+
+def load_dictionary(path):
+    """Open a compiled dictionary or load a list of (string, translation) pairs from a csv dictionary"""
+    if is_compiled_dictionary(path):
+        return CompiledDictionary(path)
+
+    with open(path, encoding='utf-8') as file:
+        return list(load_trans_file(file))
+
+
+@contextmanager
+def closing_dictionary(dictionary):
+    """Give the dictionary loaded with load_dictionary() and close it on exit if it is a compiled one"""
+    try:
+        yield dictionary
+    finally:
+        if isinstance(dictionary, CompiledDictionary):
+            dictionary.close()
@@ -1,6 +1,12 @@
+import sys
+
+from array import array
+from bisect import bisect
 from collections import defaultdict
+from itertools import repeat
+from operator import add, sub
 
-from dfrus.binio import read_bytes, from_dword
+from dfrus.binio import read_bytes
 
 code, rdata, data = range(3)
 
@@ -12,14 +18,32 @@ def get_cross_references(fn, relocs, sections, image_base):
     base_offset = sections[code].physical_offset
     size = sections[-1].physical_offset + sections[-1].physical_size - base_offset
     buffer = read_bytes(fn, base_offset, size)
-    for reloc in relocs:
-        reloc_off = sections.rva_to_offset(reloc)
-        local_off = reloc_off - base_offset
-        obj_rva = from_dword(buffer[local_off:local_off+4]) - image_base
-        reloc += sections[code].physical_offset
+
+    # Work with whole lists of values instead of converting relocations one by one.
+    # The order of the relocations is preserved in the lists of references.
+    relocs = list(relocs)
+    section_rvas = [section.rva for section in sections]
+    # The first item is a placeholder for addresses which are below the first section
+    deltas = [None] + [section.physical_offset - section.rva for section in sections]
+    section_ends = [0] + [section.rva + section.virtual_size for section in sections]
+
+    # Convert rvas of the relocations to file offsets section by section
+    reloc_sections = list(map(bisect, repeat(section_rvas), relocs))
+    reloc_offsets = list(map(add, relocs, map(deltas.__getitem__, reloc_sections)))
+
+    # Gather all the relocated dwords at once
+    local_offsets = list(map(sub, reloc_offsets, repeat(base_offset)))
+    dwords = array('I')
+    dwords.frombytes(b''.join(map(buffer.__getitem__,
+                                  map(slice, local_offsets, map(add, local_offsets, repeat(4))))))
+    if sys.byteorder != 'little':
+        dwords.byteswap()
+
+    obj_rvas = map(sub, dwords, repeat(image_base))
+    for reloc_off, obj_rva in zip(reloc_offsets, obj_rvas):
         if code_upper_bound <= obj_rva:
-            obj_off = sections.rva_to_offset(obj_rva)
-            if obj_off is not None:
-                xrefs[obj_off].append(reloc_off)
+            i = bisect(section_rvas, obj_rva)
+            assert obj_rva < section_ends[i]
+            xrefs[obj_rva + deltas[i]].append(reloc_off)
 
     return xrefs
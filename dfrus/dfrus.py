@@ -3,11 +3,17 @@ import os.path
 import sys
 import warnings
 
+from collections.abc import Mapping
 from shutil import copy
 from contextlib import contextmanager
 
-from .patchdf import fix_df_exe, load_trans_file
+from .analysis_cache import AnalysisCache, file_digest
+from .binio import ImageBuffer
+from .compiled_dictionary import compile_dictionary, load_dictionary, closing_dictionary
+from .patch_manifest import PatchManifest
+from .patchdf import fix_df_exe
 from .peclasses import PortableExecutable
+from .profiling import profile_call, write_hot_functions_report
 
 
 def init_argparser():
@@ -22,11 +28,31 @@ def init_argparser():
                         default='Dwarf Fortress Patched.exe',
                         help='name of the patched DF executable, default="Dwarf Fortress Patched.exe"')
     parser.add_argument('-d', '--dict', default='dict.txt', dest='dictionary',
-                        help='path to the dictionary file, default=dict.txt')
+                        help='path to the dictionary file (csv or compiled), default=dict.txt')
+    parser.add_argument('--compile-dict', dest='compiled_dictionary', metavar='OUTPUT',
+                        help='compile the dictionary given with --dict to a binary file, which loads faster, and exit')
     parser.add_argument('--debug', action='store_true', help='enable debugging mode')
     parser.add_argument('-c', '--codepage', help='enable given codepage by name')
     parser.add_argument('-oc', '--original_codepage', default='cp437',
                         help='specify original codepage of strings in the executable')
+    parser.add_argument('--in-memory', action='store_true', dest='in_memory',
+                        help='load the whole executable into memory, patch it there '
+                             'and write the result with a single write')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='directory to keep analysis results of executables between runs')
+    parser.add_argument('-m', '--manifest',
+                        help='manifest file of the previous patch; if the executable is the same, '
+                             'only changed translations are processed, the manifest is updated after patching')
+    parser.add_argument('-j', '--jobs', dest='workers', type=int, default=1,
+                        help='number of processes to analyse string references, default=1')
+    parser.add_argument('--report', dest='report_path',
+                        help='write timings and counters of the patching to the given JSON file')
+    parser.add_argument('--profile', nargs='?', const=True, metavar='STATS_FILE',
+                        help='profile the patching and print the statistics of the hot functions; '
+                             'if a file name is given, the full profile is also saved to it (see pstats module)')
+    parser.add_argument('--batch', metavar='PATH',
+                        help='patch many builds: PATH is a directory which is searched for Dwarf Fortress.exe files '
+                             'or a JSON file with a list of jobs; the builds are patched in --jobs processes')
     parser.add_argument('-s', '--slice', help='slice the original dictionary, eg. 0:100',
                         type=lambda s: tuple(int(x) for x in s.split(':')))
 
@@ -34,7 +60,7 @@ def init_argparser():
 
 
 def slice_translation(trans_table, bounds):
-    if isinstance(trans_table, dict):
+    if isinstance(trans_table, Mapping):
         trans_table = list(trans_table.items())
     else:
         trans_table = list(trans_table)
@@ -84,8 +110,24 @@ def destination_file_context(src, dest):
         raise ex
 
 
+@contextmanager
+def destination_image_context(src, dest):
+    print("Loading '{}' into memory...".format(src))
+    with open(src, 'rb') as src_file:
+        image = ImageBuffer(src_file.read())
+
+    yield image
+
+    # Write the patched image only if patching succeeded
+    print("Writing '{}'...".format(dest))
+    with open(dest, 'wb') as dest_file:
+        dest_file.write(image.getbuffer())
+
+
 def run(path: str, dest: str, trans_table: iter, codepage, original_codepage='cp437',
-        dict_slice=None, debug=False, stdout=None, stderr=None):
+        dict_slice=None, debug=False, stdout=None, stderr=None, in_memory=False, cache_dir=None,
+        manifest_path=None, workers=1, report_path=None):
+    """Patch the executable, return a PatchReport with timings and counters of the patching"""
     if not debug:
         warnings.simplefilter('ignore')
     
@@ -116,37 +158,121 @@ def run(path: str, dest: str, trans_table: iter, codepage, original_codepage='cp
     df2 = os.path.join(dest_path, dest_name)
 
     if not debug:
-        trans_table = dict(trans_table)
+        if not isinstance(trans_table, Mapping):
+            trans_table = dict(trans_table)
     else:
         trans_table = slice_translation(trans_table, dict_slice)
 
+    digest = file_digest(df1) if cache_dir or manifest_path else None
+
+    if cache_dir:
+        analysis_cache = AnalysisCache(cache_dir)
+        cache = analysis_cache.entry(digest)
+    else:
+        analysis_cache = None
+        cache = None
+
+    if manifest_path:
+        manifest = PatchManifest.load(manifest_path, digest)
+    else:
+        manifest = None
+
     # --------------------------------------------------------
-    with destination_file_context(df1, df2):
-        with open(df2, "r+b") as fn:
-            try:
-                pe = PortableExecutable(fn)
-            except ValueError:
-                raise ValueError("'{}' is broken".format(df2))
-            
-            if pe.file_header['machine'] != 0x014C:
-                raise ValueError("Only 32-bit versions are supported.")
-            
-            fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug)
+    if in_memory:
+        with destination_image_context(df1, df2) as fn:
+            report = patch_file(fn, df1, codepage, original_codepage, trans_table, debug, cache, manifest,
+                                workers)
+    else:
+        with destination_file_context(df1, df2):
+            with open(df2, "r+b") as fn:
+                report = patch_file(fn, df2, codepage, original_codepage, trans_table, debug, cache, manifest,
+                                    workers)
+
+    if analysis_cache is not None:
+        analysis_cache.store(cache)
+
+    if manifest_path:
+        manifest.save(manifest_path)
+
+    if report_path:
+        report.save(report_path)
+
+    return report
+
+
+def patch_file(fn, name, codepage, original_codepage, trans_table, debug=False, cache=None, manifest=None,
+               workers=1):
+    try:
+        pe = PortableExecutable(fn)
+    except ValueError:
+        raise ValueError("'{}' is broken".format(name))
+
+    if pe.file_header['machine'] != 0x014C:
+        raise ValueError("Only 32-bit versions are supported.")
+
+    return fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug, cache, manifest, workers)
+
+
+def run_batch_mode(args):
+    from .batch import find_builds, load_batch_manifest, run_batch
+
+    if os.path.isdir(args.batch):
+        jobs = find_builds(args.batch, args.dictionary, args.codepage, args.original_codepage, args.dest)
+    else:
+        jobs = load_batch_manifest(args.batch, args.dictionary, args.codepage, args.original_codepage)
+
+    print('Patching %d builds in %d processes...' % (len(jobs), args.workers))
+    failed = 0
+    for result in run_batch(jobs, args.workers):
+        if result.error is None:
+            print('OK      %8.2f s  %s' % (result.elapsed, result.job.path))
+        else:
+            failed += 1
+            print('FAILED  %8.2f s  %s: %s' % (result.elapsed, result.job.path,
+                                               result.error.strip().splitlines()[-1]))
+            if args.debug:
+                print(result.log)
+                print(result.error)
+
+    print('%d of %d builds patched.' % (len(jobs) - failed, len(jobs)))
+    return failed == 0
 
 
 def _main():
     parser = init_argparser()
     args = parser.parse_args(sys.argv[1:])
 
+    if args.batch:
+        if not run_batch_mode(args):
+            sys.exit(1)
+        return
+
     print("Loading translation file...")
 
     try:
-        with open(args.dictionary, encoding='utf-8') as trans:
-            trans_table = list(load_trans_file(trans))
+        trans_table = load_dictionary(args.dictionary)
     except FileNotFoundError:
         print('Error: "%s" file not found.' % args.dictionary)
     else:
-        run(args.path, args.dest, trans_table, args.codepage, args.original_codepage, args.slice, args.debug)
+        with closing_dictionary(trans_table):
+            if args.compiled_dictionary:
+                compile_dictionary(trans_table.items() if isinstance(trans_table, Mapping) else trans_table,
+                                   args.compiled_dictionary)
+                print('Dictionary is compiled to "%s".' % args.compiled_dictionary)
+                return
+
+            run_args = (args.path, args.dest, trans_table, args.codepage, args.original_codepage, args.slice,
+                        args.debug)
+            run_kwargs = dict(in_memory=args.in_memory, cache_dir=args.cache_dir,
+                              manifest_path=args.manifest, workers=args.workers, report_path=args.report_path)
+            if not args.profile:
+                run(*run_args, **run_kwargs)
+            else:
+                _, stats = profile_call(run, *run_args, **run_kwargs)
+                print()
+                write_hot_functions_report(stats, sys.stdout)
+                if args.profile is not True:
+                    stats.dump_stats(args.profile)
 
 
 if __name__ == "__main__":
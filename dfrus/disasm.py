@@ -102,8 +102,13 @@ seg_prefixes = {Prefix.seg_es: Reg.es, Prefix.seg_cs: Reg.cs, Prefix.seg_ss: Reg
 
 op_sizes = {1: "byte", 2: "word", 4: "dword", 8: "qword", 16: "dqword"}
 
+# Faster equivalent of Reg((RegType.general, code, size)) for the decoders
+_general_regs = {(reg.code, reg.size): reg for reg in Reg if reg.type == RegType.general}
+
 
 class Operand:
+    __slots__ = ('value', 'reg', 'base_reg', '_data_size', 'index_reg', 'scale', 'disp', 'seg_prefix')
+
     def __init__(self, value=None, reg=None, base_reg=None, index_reg=None, scale=None, disp=0, data_size=None,
                  seg_prefix=None):
         self.value = value
@@ -215,11 +220,11 @@ def unify_operands(x, size=None):
     if size is None:
         op1 = modrm.reg
     else:
-        op1 = Operand(reg=Reg((RegType.general, modrm.reg, size)))
+        op1 = Operand(reg=_general_regs[modrm.reg, size])
 
     if modrm.mode == 3:
         # Register addressing
-        op2 = Operand(reg=Reg((RegType.general, modrm.regmem, 4)))
+        op2 = Operand(reg=_general_regs[modrm.regmem, 4])
     else:
         if modrm.mode == 0 and modrm.regmem == 5:
             # Direct addressing
@@ -227,7 +232,7 @@ def unify_operands(x, size=None):
         else:
             if modrm.regmem != 4:
                 # Without SIB-byte
-                op2 = Operand(base_reg=Reg((RegType.general, modrm.regmem, 4)))
+                op2 = Operand(base_reg=_general_regs[modrm.regmem, 4])
             else:
                 # Use the SIB, Luke
                 sib = x['sib']
@@ -236,8 +241,8 @@ def unify_operands(x, size=None):
                 index_reg = sib.index_reg if sib.index_reg != 4 else None
                 
                 op2 = Operand(scale=sib.scale,
-                              index_reg=None if index_reg is None else Reg((RegType.general, index_reg, 4)),
-                              base_reg=None if base_reg is None else Reg((RegType.general, base_reg, 4)))
+                              index_reg=None if index_reg is None else _general_regs[index_reg, 4],
+                              base_reg=None if base_reg is None else _general_regs[base_reg, 4])
 
             op2.disp = x.get('disp', 0)
 
@@ -300,23 +305,47 @@ def asmhex(n):
 
 
 class DisasmLine:
-    __slots__ = ('address', 'data', 'mnemonic', 'operands', '__str', 'prefix')
+    """
+    Disassembled instruction.
+    If a decoder is given instead of the operands, the operands are decoded from the instruction data on first access.
+    """
+    __slots__ = ('address', 'data', 'mnemonic', '_operands', '_decoder', '__str', 'prefix')
 
-    def __init__(self, address, data, mnemonic, operands=None, prefix: Prefix = None):
+    def __init__(self, address, data, mnemonic, operands=None, prefix: Prefix = None, decoder=None):
         self.address = address
         self.data = data
         self.mnemonic = mnemonic
         assert operands is None or all(isinstance(op, Operand) for op in operands)
-        self.operands = operands
+        self._operands = operands
+        self._decoder = decoder
         self.prefix = prefix
         self.__str = None
 
+    @property
+    def operands(self):
+        if self._operands is None and self._decoder is not None:
+            self._operands = _decode_operands(self._decoder, self.data, self.address)
+            self._decoder = None
+        return self._operands
+
+    @operands.setter
+    def operands(self, operands):
+        self._operands = operands
+        self._decoder = None
+        self.__str = None
+
+    @property
+    def has_rep_prefix(self):
+        """Same as str(line).startswith('rep'), but doesn't decode the operands"""
+        return self.prefix is not None and self.prefix.name.startswith('rep')
+
     def __str__(self):
         if not self.__str:
-            if not self.operands:
+            operands = self.operands
+            if not operands:
                 self.__str = self.mnemonic
             else:
-                self.__str = self.mnemonic + ' ' + ', '.join(str(item) for item in self.operands)
+                self.__str = self.mnemonic + ' ' + ', '.join(str(item) for item in operands)
 
             if self.prefix is not None:
                 self.__str = self.prefix.name + ' ' + self.__str
@@ -328,332 +357,617 @@ class DisasmLine:
 
 
 class BytesLine(DisasmLine):
+    __slots__ = ()
+
     def __init__(self, address, data):
-        super().__init__(address, data, mnemonic='db', operands=[Operand(value=n) for n in data])
+        super().__init__(address, data, mnemonic='db')
+
+    @property
+    def operands(self):
+        if self._operands is None:
+            self._operands = [Operand(value=n) for n in self.data]
+        return self._operands
+
+
+def parse_prefixes(s, i):
+    """Return the offset of the opcode after the prefixes at i and the operand size, segment and rep prefixes"""
+    size_prefix = False
+    seg_prefix = None
+    rep_prefix = None
+    if s[i] in seg_prefixes:
+        seg_prefix = seg_prefixes[s[i]]
+        i += 1
 
+    if s[i] == Prefix.operand_size:
+        size_prefix = True
+        i += 1
+
+    if s[i] in _rep_prefixes:
+        rep_prefix = Prefix(s[i])
+        i += 1
+
+    return i, size_prefix, seg_prefix, rep_prefix
+
+
+def _decode_operands(decoder, s, address):
+    """Decode the instruction once more, this time with the operands"""
+    i, size_prefix, seg_prefix, rep_prefix = parse_prefixes(s, 0)
+    line, _ = decoder(s, i, 0, address, size_prefix, seg_prefix, rep_prefix, make_operands=True)
+    return line.operands
+
+
+# Decoders of single instructions.
+# Each decoder takes the buffer, the offset of the opcode byte, the offset of the instruction start (with prefixes),
+# the start address and the prefixes, and returns the decoded line (or None if the instruction is not recognized)
+# and the offset after the decoded part.
+# Operands are made only if make_operands is set, otherwise they are decoded by the line on first access.
+# Everything which may fail on a malformed instruction is checked in both cases.
+
+def _decode_noargs(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    mnemonic = op_1byte_nomask_noargs[s[i]]
+    if i > j and size_prefix and mnemonic == 'movsd':
+        mnemonic = 'movsw'
+    line = DisasmLine(start_address+j, data=s[j:i+1], mnemonic=mnemonic, prefix=rep_prefix)
+    return line, i+1
+
+
+def _decode_ret_near_n(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    i += 1
+    immediate = int.from_bytes(bytes(s[i:i+2]), byteorder='little')
+    i += 2
+    operands = [Operand(value=immediate)] if make_operands else None
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='retn',
+                      operands=operands, prefix=rep_prefix, decoder=_decode_ret_near_n)
+    return line, i
 
-def disasm(s, start_address=0):
+
+def _decode_call_jmp_near(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    i += 1
+    immediate = start_address+i+4+int.from_bytes(s[i:i+4], byteorder='little', signed=True)
+    i += 4
+    operands = [Operand(value=immediate)] if make_operands else None
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=op_nomask[s[j]],
+                      operands=operands, prefix=rep_prefix, decoder=_decode_call_jmp_near)
+    return line, i
+
+
+def _decode_jmp_short(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    immediate = start_address+i+2+to_signed(s[i+1], 8)
+    if s[i] == jmp_short:
+        mnemonic = "jmp short"
+    else:
+        mnemonic = 'j%s short' % Cond(s[i] & 0x0F).name
+    operands = [Operand(value=immediate)] if make_operands else None
+    line = DisasmLine(start_address+j, data=s[i:i+2], mnemonic=mnemonic,
+                      operands=operands, prefix=rep_prefix, decoder=_decode_jmp_short)
+    return line, i+2
+
+
+def _decode_lea(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    x, i = analyse_modrm(s, i+1)
+    operands = unify_operands(x, size=4) if make_operands else None
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='lea', operands=operands, prefix=rep_prefix,
+                      decoder=_decode_lea)
+    return line, i
+
+
+def _decode_op_rm_imm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    flags = s[i] & 3
+    mnemonics = ("add", "or", "adc", "sbb", "and", "sub", "xor", "cmp")
+    x, i = analyse_modrm(s, i+1)
+    mnemonic = mnemonics[x['modrm'][1]]
+    if x['modrm'].mode != 3:
+        data_size = 1 << (2*bool(flags)-size_prefix)
+    if flags == 1:
+        immediate = int.from_bytes(s[i:i+4], byteorder='little')
+        i += 4
+    else:  # flags == 0 or flags == 3
+        immediate = s[i]
+        i += 1
+
+    operands = None
+    if make_operands:
+        _, op = unify_operands(x)
+        if op.reg is None:
+            op.data_size = data_size
+        operands = [op, Operand(value=immediate)]
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_op_rm_imm)
+    return line, i
+
+
+def _decode_op_rm_reg_no_dir(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    # Operation between register and register/memory without direction flag (xchg or test)
+    # or move immediate value to memory
+    si = s[i]
+    if si & 0xFE == mov_rm_imm and (s[i+1] & 0x38) != 0:
+        return None, i
+
+    mnemonic = op_FE_width_REG_RM.get(si & 0xFE, 'mov')
+    flag_size = si & 1
+    x, i = analyse_modrm(s, i+1)
+    size = 1 << (flag_size*2-size_prefix)
+    operands = None
+    if (si & 0xFE) == mov_rm_imm:
+        immediate = int.from_bytes(s[i:i + size], byteorder='little')
+        i += size
+        if make_operands:
+            _, op = unify_operands(x)
+            op.data_size = size
+            operands = [op, Operand(value=immediate)]
+    elif make_operands:
+        reg_code, op2 = unify_operands(x)
+        op1 = Operand(reg=_general_regs[reg_code, size])
+        operands = [op1, op2]
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_op_rm_reg_no_dir)
+    return line, i
+
+
+def _decode_op_rm_reg(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    # Operation between a register and register/memory with direction flag
+    mnemonic = op_FC_dir_width_REG_RM[s[i] & 0xFC]
+    dir_flag = s[i] & 2
+    flag_size = s[i] & 1
+    x, i = analyse_modrm(s, i+1)
+    size = 1 << (flag_size*2-size_prefix)
+    operands = None
+    if make_operands:
+        reg_code, op2 = unify_operands(x)
+        op1 = Operand(reg=_general_regs[reg_code, size])
+        if op2.reg is not None:
+            op2.data_size = size
+        if seg_prefix is not None:  # redundant check
+            op2.seg_prefix = seg_prefix
+        if not dir_flag:
+            op1, op2 = op2, op1
+        operands = [op1, op2]
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_op_rm_reg)
+    return line, i
+
+
+def _decode_op_reg(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    mnemonic = op_F8_reg[s[i] & 0xF8]
+    reg = s[i] & 7
+    size = 2 - size_prefix
+    operands = [Operand(reg=_general_regs[reg, 1 << size])] if make_operands else None
+    i += 1
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_op_reg)
+    return line, i
+
+
+def _decode_op_FE(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    flag_size = s[i] & 1
+    i += 1
+    op = (s[i] & 0x38) >> 3
+    if op == 7:
+        return None, i
+
+    x, i = analyse_modrm(s, i)
+    mnemonics = ["inc", "dec", "call", "call far", "jmp dword", "jmp far", "push dword"]
+    mnemonic = mnemonics[op]
+    if op < 2:
+        size = flag_size*2-size_prefix
+        data_size = 1 << size
+    elif not flag_size:
+        return None, i
+
+    operands = None
+    if make_operands:
+        _, op1 = unify_operands(x)
+        if op < 2:
+            op1.data_size = data_size
+        elif seg_prefix:
+            op1.seg_prefix = seg_prefix
+        operands = [op1]
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_op_FE)
+    return line, i
+
+
+def _decode_mov_acc_mem(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    dir_flag = s[i] & 2
+    size_flag = s[i] & 1
+    size = size_flag*2 - size_prefix
+    reg_size = 1 << size
+    i += 1
+    imm_size = 4  # 4 bytes in 32-bit mode
+    immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
+    i += imm_size
+    operands = None
+    if make_operands:
+        op1 = Operand(reg=_general_regs[Reg.eax.code, reg_size])
+        op2 = Operand(disp=immediate)
+        if seg_prefix:
+            op2.seg_prefix = seg_prefix
+        if dir_flag:
+            op1, op2 = op2, op1
+        operands = [op1, op2]
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='mov', operands=operands, prefix=rep_prefix,
+                      decoder=_decode_mov_acc_mem)
+    return line, i
+
+
+def _decode_mov_rm_seg(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    # Operands are made right away to check the segment register code
+    dir_flag = s[i] & 2
+    x, i = analyse_modrm(s, i+1)
+    reg_code, op2 = unify_operands(x)
+    op1 = Operand(reg=Reg((RegType.segment, reg_code, 2)))
+    if not dir_flag:
+        op1, op2 = op2, op1
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='mov', operands=[op1, op2], prefix=rep_prefix)
+    return line, i
+
+
+def _decode_pop_rm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    x, i = analyse_modrm(s, i+1)
+    operands = None
+    if make_operands:
+        _, op = unify_operands(x)
+        op.data_size = 1 << (2-size_prefix)
+        operands = [op]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='pop', operands=operands, prefix=rep_prefix,
+                      decoder=_decode_pop_rm)
+    return line, i
+
+
+def _decode_push_imm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    size_flag = s[i] & 2
+    i += 1
+    if size_flag:
+        immediate = s[i] | (s[i] >> 7) * 0xFFFFFF00  # 6A FF -> push 0FFFFFFFFh
+        i += 1
+    else:
+        immediate = int.from_bytes(s[i:i+4], byteorder='little')
+        i += 4
+    operands = [Operand(value=immediate)] if make_operands else None
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='push',
+                      operands=operands, prefix=rep_prefix, decoder=_decode_push_imm)
+    return line, i
+
+
+def _decode_op_acc_imm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    mnemonic = op_FE_width_acc_imm[s[i] & 0xFE]
+    flag_size = s[i] & 1
+    i += 1
+    size = flag_size*2 - size_prefix
+    imm_size = 1 << size
+    immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
+    i += imm_size
+    operands = None
+    if make_operands:
+        op1 = Operand(reg=_general_regs[Reg.eax.code, 1 << size])
+        op2 = Operand(value=immediate)
+        operands = [op1, op2]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_op_acc_imm)
+    return line, i
+
+
+def _decode_mov_reg_imm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    flag_size = (s[i] & 8) >> 3
+    reg = s[i] & 7
+    i += 1
+    size = flag_size*2 - size_prefix
+    imm_size = 1 << size
+    immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
+    i += imm_size
+    operands = None
+    if make_operands:
+        op1 = Operand(reg=_general_regs[reg, 1 << size])
+        op2 = Operand(value=immediate)
+        operands = [op1, op2]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='mov', operands=operands, prefix=rep_prefix,
+                      decoder=_decode_mov_reg_imm)
+    return line, i
+
+
+def _decode_shift(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    opcode = s[i] & 0xFE
+    flag_size = s[i] & 1
+    x, i = analyse_modrm(s, i+1)
+    mnemonic = op_shifts_rolls[x['modrm'][1]]
+    data_size = 1 << (flag_size*2 - size_prefix)
+    if opcode == shift_op_rm_imm8:
+        immediate = s[i]
+        i += 1
+
+    operands = None
+    if make_operands:
+        _, op1 = unify_operands(x)
+        op1.data_size = data_size
+        if opcode == shift_op_rm_1:
+            op2 = Operand(value=1)
+        elif opcode == shift_op_rm_cl:
+            op2 = Operand(reg=Reg.cl)
+        else:
+            op2 = Operand(value=immediate)
+        operands = [op1, op2]
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_shift)
+    return line, i
+
+
+def _decode_test_or_unary(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    flag_size = s[i] & 1
+    x, i = analyse_modrm(s, i+1)
+    modrm1 = x['modrm'][1]
+    if modrm1 == 1:
+        return None, i
+
+    size = flag_size*2 - size_prefix
+    data_size = 1 << size
+    operands = None
+    if make_operands:
+        _, op1 = unify_operands(x)
+        op1.data_size = data_size
+
+    if modrm1 >= 2:
+        # unary operations: not, neg, mul, imul etc.
+        mnemonics = ("not", "neg", "mul", "imul", "div", "idiv")
+        mnemonic = mnemonics[modrm1-2]
+        if make_operands:
+            operands = (op1,)
+    else:
+        # test r/m, imm
+        mnemonic = 'test'
+        immediate = int.from_bytes(s[i:i+data_size], byteorder='little')
+        i += data_size
+        if make_operands:
+            operands = (op1, Operand(value=immediate))
+
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_test_or_unary)
+    return line, i
+
+
+def _decode_x0f(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    i += 1
+    decoder = _x0f_decoders[s[i]]
+    if decoder is None:
+        return None, i
+    return decoder(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands)
+
+
+def _decode_x0f_setcc(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    if s[i+1] & 0xC0 != 0xC0:
+        return None, i
+
+    condition = s[i] & 0x0F
+    mnemonic = "set%s" % Cond(condition).name
+    operands = [Operand(reg=_general_regs[s[i+1] & 7, 1])] if make_operands else None
+    i += 2
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_x0f)
+    return line, i
+
+
+def _decode_x0f_jcc_near(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    condition = s[i] & 0x0F
+    mnemonic = "j%s near" % Cond(condition).name
+    i += 1
+    immediate = start_address+i+4+int.from_bytes(s[i:i+4], byteorder='little', signed=True)
+    i += 4
+    operands = [Operand(value=immediate)] if make_operands else None
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
+                      operands=operands, prefix=rep_prefix, decoder=_decode_x0f)
+    return line, i
+
+
+def _decode_x0f_movzx_movsx(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    op = s[i] & 0xFE
+    mnemonic = 'movzx' if op == x0f_movzx else 'movsx'
+    flag_size = s[i] & 1
+    x, i = analyse_modrm(s, i+1)
+    operands = None
+    if make_operands:
+        dest, src = unify_operands(x, size=1 << (flag_size+1))
+        src.data_size = 1 << flag_size
+        operands = [dest, src]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_x0f)
+    return line, i
+
+
+def _decode_x0f_movups_movaps(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    op = s[i] & 0xFE
+    mnemonic = 'movups' if op == x0f_movups else 'movaps'
+    dir_flag = s[i] & 1
+    x, i = analyse_modrm(s, i+1)
+    operands = None
+    if make_operands:
+        op1, op2 = unify_operands(x)
+        op1 = Operand(reg=Reg['xmm' + str(op1)])
+        if dir_flag:
+            op1, op2 = op2, op1
+        operands = [op1, op2]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_x0f)
+    return line, i
+
+
+def _decode_x0f_movd_mm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    opcode = s[i]
+    size_flag = s[i] & 0x01
+    dir_flag = s[i] & 0x10
+    mnemonic = 'movq' if size_flag else 'movd'
+    x, i = analyse_modrm(s, i + 1)
+    operands = None
+    if make_operands or x['modrm'].mode == 3:
+        # Size of a register operand may be invalid, so the operands are made right away in this case
+        op1, op2 = unify_operands(x)
+    if rep_prefix is Prefix.rep and opcode == x0f_movd_mm | 0x10:
+        mnemonic = 'movq'
+        rep_prefix = None
+        if make_operands or x['modrm'].mode == 3:
+            op1 = Operand(reg=Reg['xmm' + str(op1)])
+            op2.data_size = 8  # qword
+            operands = [op1, op2]
+    elif make_operands or x['modrm'].mode == 3:
+        op2.data_size = 4 << size_flag
+        op1 = Operand(reg=Reg['mm' + str(op1)])
+        if dir_flag:
+            op1, op2 = op2, op1
+        operands = [op1, op2]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_x0f)
+    return line, i
+
+
+def _decode_x0f_movq_rm_xmm(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    if not size_prefix:
+        return None, i
+
+    mnemonic = 'movq'
+    x, i = analyse_modrm(s, i + 1)
+    operands = None
+    if make_operands or x['modrm'].mode == 3:
+        # Size of a register operand may be invalid, so the operands are made right away in this case
+        op1, op2 = unify_operands(x)
+        op1 = Operand(reg=Reg['xmm' + str(op1)])
+        op2.data_size = 8  # qword
+        operands = [op2, op1]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_x0f)
+    return line, i
+
+
+def _decode_x0f_cmov(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix, make_operands=False):
+    condition = s[i] & 0x0F
+    mnemonic = 'cmov' + Cond(condition).name
+    size = 4 >> size_prefix
+    x, i = analyse_modrm(s, i + 1)
+    operands = None
+    if make_operands:
+        op1, op2 = unify_operands(x)
+        op1 = Operand(reg=_general_regs[op1, size])
+        operands = [op1, op2]
+    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=operands, prefix=rep_prefix,
+                      decoder=_decode_x0f)
+    return line, i
+
+
+# Prefixes of the instructions marked with these values are yielded as a separate 'db' line:
+_flush_never, _flush_always, _flush_if_no_rep = range(3)
+
+
+def _build_dispatch_table(rules):
+    """
+    Make a 256-item table mapping an opcode byte to the first rule which matches it.
+    Rules are (predicate, kind, decoder, prefix flush mode) tuples, the order of rules matters.
+    Items of the table are (kind, decoder, prefix flush mode) triples.
+    """
+    table = [(None, None, _flush_never)] * 256
+    for byte in reversed(range(256)):
+        for predicate, kind, decoder, flush in rules:
+            if predicate(byte):
+                table[byte] = (kind, decoder, flush)
+                break
+    return table
+
+
+_dispatch_table = _build_dispatch_table([
+    (lambda x: x in op_1byte_nomask_noargs, 'noargs', _decode_noargs, _flush_if_no_rep),
+    (lambda x: x == ret_near_n, 'ret_near_n', _decode_ret_near_n, _flush_always),
+    (lambda x: x in {call_near, jmp_near}, 'call_jmp_near', _decode_call_jmp_near, _flush_always),
+    (lambda x: x == jmp_short or x & 0xF0 == jcc_short, 'jmp_short', _decode_jmp_short, _flush_always),
+    (lambda x: x == lea, 'lea', _decode_lea, _flush_always),
+    (lambda x: x & 0xFC == op_rm_imm and x & 3 != 2, 'op_rm_imm', _decode_op_rm_imm, _flush_never),
+    (lambda x: x & 0xFE in op_FE_width_REG_RM or x & 0xFE == mov_rm_imm, 'op_rm_reg_no_dir', _decode_op_rm_reg_no_dir,
+     _flush_never),
+    (lambda x: x & 0xFC in op_FC_dir_width_REG_RM, 'op_rm_reg', _decode_op_rm_reg, _flush_never),
+    (lambda x: x & 0xF8 in op_F8_reg, 'op_reg', _decode_op_reg, _flush_never),
+    (lambda x: x & 0xFE == 0xFE, 'op_FE', _decode_op_FE, _flush_never),
+    (lambda x: x & 0xFC == mov_acc_mem, 'mov_acc_mem', _decode_mov_acc_mem, _flush_never),
+    (lambda x: x & 0xFD == mov_rm_seg, 'mov_rm_seg', _decode_mov_rm_seg, _flush_never),
+    (lambda x: x == pop_rm, 'pop_rm', _decode_pop_rm, _flush_never),
+    (lambda x: x & 0xFD == push_imm32, 'push_imm', _decode_push_imm, _flush_never),
+    (lambda x: x & 0xFE in op_FE_width_acc_imm, 'op_acc_imm', _decode_op_acc_imm, _flush_never),
+    (lambda x: x & 0xF0 == mov_reg_imm, 'mov_reg_imm', _decode_mov_reg_imm, _flush_never),
+    (lambda x: x & 0xFE in {shift_op_rm_1, shift_op_rm_cl, shift_op_rm_imm8}, 'shift', _decode_shift,
+     _flush_never),
+    (lambda x: x & 0xFE == test_or_unary_rm, 'test_or_unary', _decode_test_or_unary, _flush_never),
+    (lambda x: x == 0x0F, 'x0f', _decode_x0f, _flush_never),
+])
+
+# Decoders of the second byte of the 0x0F-prefixed instructions
+_x0f_dispatch_table = _build_dispatch_table([
+    (lambda x: x & 0xF0 == x0f_setcc, 'setcc', _decode_x0f_setcc, _flush_never),
+    (lambda x: x & 0xF0 == x0f_jcc_near, 'jcc_near', _decode_x0f_jcc_near, _flush_never),
+    (lambda x: x & 0xFE in {x0f_movzx, x0f_movsx}, 'movzx_movsx', _decode_x0f_movzx_movsx, _flush_never),
+    (lambda x: x & 0xFE in {x0f_movups, x0f_movaps}, 'movups_movaps', _decode_x0f_movups_movaps, _flush_never),
+    (lambda x: x & 0xEE == x0f_movd_mm, 'movd_mm', _decode_x0f_movd_mm, _flush_never),
+    (lambda x: x == x0f_movq_rm_xmm, 'movq_rm_xmm', _decode_x0f_movq_rm_xmm, _flush_never),
+    (lambda x: x & 0xF0 == x0f_cmov, 'cmov', _decode_x0f_cmov, _flush_never),
+])
+
+_decoders = [(decoder, flush) for _, decoder, flush in _dispatch_table]
+_x0f_decoders = [decoder for _, decoder, _ in _x0f_dispatch_table]
+
+# Kinds of the decoders chosen for each opcode byte, for the code which must follow the choice of the disassembler
+# without depending on the decoders themselves (eg. the code index).
+# flushes_prefixes tells if the prefixes of the instruction may be yielded as a separate 'db' line.
+OpcodeDecoder = namedtuple('OpcodeDecoder', 'kind flushes_prefixes')
+opcode_decoders = [OpcodeDecoder(kind, flush != _flush_never) for kind, _, flush in _dispatch_table]
+x0f_opcode_decoders = [OpcodeDecoder(kind, flush != _flush_never) for kind, _, flush in _x0f_dispatch_table]
+
+prefix_bytes = frozenset(seg_prefixes) | {Prefix.operand_size, Prefix.rep, Prefix.repne, Prefix.lock}
+_rep_prefixes = frozenset({Prefix.rep.value, Prefix.repne.value, Prefix.lock.value})
+
+
+class DisasmCounter:
+    """Number of the lines and the bytes of code yielded by disasm()"""
+    __slots__ = ('lines', 'bytes')
+
+    def __init__(self, lines=0, bytes_=0):
+        self.lines = lines
+        self.bytes = bytes_
+
+    def add(self, other):
+        self.lines += other.lines
+        self.bytes += other.bytes
+
+
+def disasm(s, start_address=0, counter: DisasmCounter = None):
     i = 0
     while i < len(s):
         j = i
         size_prefix = False
         seg_prefix = None
         rep_prefix = None
-        line = None
-        if s[i] in seg_prefixes:
-            seg_prefix = seg_prefixes[s[i]]
-            i += 1
-
-        if s[i] == Prefix.operand_size:
-            size_prefix = True
-            i += 1
-
-        if s[i] in {Prefix.rep.value, Prefix.repne.value, Prefix.lock.value}:
-            rep_prefix = Prefix(s[i])
-            i += 1
-
-        if s[i] in op_1byte_nomask_noargs:
-            mnemonic = op_1byte_nomask_noargs[s[i]]
-            if i > j:  # Are there any prefixes?
-                if size_prefix and mnemonic == 'movsd':
-                    mnemonic = 'movsw'
-                elif rep_prefix is None:
-                    yield BytesLine(start_address+j, data=s[j:i])
-                    j = i
-            line = DisasmLine(start_address+j, data=s[j:i+1], mnemonic=mnemonic, prefix=rep_prefix)
-            i += 1
-        elif s[i] == ret_near_n:
-            if i > j:
-                yield BytesLine(start_address+j, data=s[j:i])
-                j = i
-            i += 1
-            immediate = int.from_bytes(bytes(s[i:i+2]), byteorder='little')
-            i += 2
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='retn',
-                              operands=[Operand(value=immediate)], prefix=rep_prefix)
-        elif s[i] in {call_near, jmp_near}:
-            if i > j:
-                yield BytesLine(start_address+j, data=s[j:i])
-                j = i
-            i += 1
-            immediate = start_address+i+4+int.from_bytes(s[i:i+4], byteorder='little', signed=True)
-            i += 4
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic=op_nomask[s[j]],
-                              operands=[Operand(value=immediate)], prefix=rep_prefix)
-        elif s[i] == jmp_short or s[i] & 0xF0 == jcc_short:
-            if i > j:
-                yield BytesLine(start_address+j, data=s[j:i])
-                j = i
-            immediate = start_address+i+2+to_signed(s[i+1], 8)
-            if s[i] == jmp_short:
-                mnemonic = "jmp short"
-            else:
-                mnemonic = 'j%s short' % Cond(s[i] & 0x0F).name
-            line = DisasmLine(start_address+j, data=s[i:i+2], mnemonic=mnemonic,
-                              operands=[Operand(value=immediate)], prefix=rep_prefix)
-            i += 2
-        elif s[i] == lea:
-            if i > j:
-                yield BytesLine(start_address+j, data=s[j:i])
-                j = i
-            x, i = analyse_modrm(s, i+1)
-            operands = unify_operands(x, size=4)
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='lea', operands=operands, prefix=rep_prefix)
-        elif (s[i] & 0xFC) == op_rm_imm and (s[i] & 3) != 2:
-            flags = s[i] & 3
-            mnemonics = ("add", "or", "adc", "sbb", "and", "sub", "xor", "cmp")
-            x, i = analyse_modrm(s, i+1)
-            mnemonic = mnemonics[x['modrm'][1]]
-            _, op = unify_operands(x)
-            if op.reg is None:
-                op.data_size = 1 << (2*bool(flags)-size_prefix)
-            if flags == 1:
-                immediate = int.from_bytes(s[i:i+4], byteorder='little')
-                i += 4
-            else:  # flags == 0 or flags == 3
-                immediate = s[i]
-                i += 1
-            op2 = Operand(value=immediate)
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=[op, op2], prefix=rep_prefix)
-        elif (s[i] & 0xFE) in op_FE_width_REG_RM or (s[i] & 0xFE == mov_rm_imm and (s[i+1] & 0x38) == 0):
-            # Operation between register and register/memory without direction flag (xchg or test)
-            # or move immediate value to memory
-            si = s[i]
-            mnemonic = op_FE_width_REG_RM.get(si & 0xFE, 'mov')
-            flag_size = si & 1
-            x, i = analyse_modrm(s, i+1)
-            reg_code, op2 = unify_operands(x)
-            if (si & 0xFE) == mov_rm_imm:
-                op = op2
-                op.data_size = 1 << (flag_size*2-size_prefix)
-                imm_size = op.data_size
-                immediate = Operand(value=int.from_bytes(s[i:i + imm_size], byteorder='little'))
-                i += imm_size
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[op, immediate], prefix=rep_prefix)
-            else:
-                op1 = Operand(reg=Reg((RegType.general, reg_code, 1 << (flag_size*2-size_prefix))))
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[op1, op2], prefix=rep_prefix)
-        elif (s[i] & 0xFC) in op_FC_dir_width_REG_RM:
-            # Operation between a register and register/memory with direction flag
-            mnemonic = op_FC_dir_width_REG_RM[s[i] & 0xFC]
-            dir_flag = s[i] & 2
-            flag_size = s[i] & 1
-            x, i = analyse_modrm(s, i+1)
-            reg_code, op2 = unify_operands(x)
-            size = 1 << (flag_size*2-size_prefix)
-            op1 = Operand(reg=Reg((RegType.general, reg_code, size)))
-            if op2.reg is not None:
-                op2.data_size = size
-            if seg_prefix is not None:  # redundant check
-                op2.seg_prefix = seg_prefix
-            if not dir_flag:
-                op1, op2 = op2, op1
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=[op1, op2], prefix=rep_prefix)
-        elif s[i] & 0xF8 in op_F8_reg:
-            mnemonic = op_F8_reg[s[i] & 0xF8]
-            reg = s[i] & 7
-            size = 2 - size_prefix
-            op = Operand(reg=Reg((RegType.general, reg, 1 << size)))
-            i += 1
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=[op], prefix=rep_prefix)
-        elif s[i] & 0xFE == 0xFE:
-            flag_size = s[i] & 1
-            i += 1
-            op = (s[i] & 0x38) >> 3
-            if op != 7:
-                x, i = analyse_modrm(s, i)
-                mnemonics = ["inc", "dec", "call", "call far", "jmp dword", "jmp far", "push dword"]
-                mnemonic = mnemonics[op]
-                _, op1 = unify_operands(x)
-                if op < 2:
-                    size = flag_size*2-size_prefix
-                    op1.data_size = 1 << size
-                    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                      operands=[op1], prefix=rep_prefix)
-                elif flag_size:
-                    if seg_prefix:
-                        op1.seg_prefix = seg_prefix
-                    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                      operands=[op1], prefix=rep_prefix)
-        elif s[i] & 0xFC == mov_acc_mem:
-            dir_flag = s[i] & 2
-            size_flag = s[i] & 1
-            size = size_flag*2 - size_prefix
-            i += 1
-            imm_size = 4  # 4 bytes in 32-bit mode
-            immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
-            i += imm_size
-            op1 = Operand(reg=Reg((RegType.general, Reg.eax.code, 1 << size)))
-            op2 = Operand(disp=immediate)
-            if seg_prefix:
-                op2.seg_prefix = seg_prefix
-            if dir_flag:
-                op1, op2 = op2, op1
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='mov', operands=[op1, op2], prefix=rep_prefix)
-        elif s[i] & 0xFD == mov_rm_seg:
-            dir_flag = s[i] & 2
-            x, i = analyse_modrm(s, i+1)
-            reg_code, op2 = unify_operands(x)
-            op1 = Operand(reg=Reg((RegType.segment, reg_code, 2)))
-            if not dir_flag:
-                op1, op2 = op2, op1
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='mov', operands=[op1, op2], prefix=rep_prefix)
-        elif s[i] == pop_rm:
-            x, i = analyse_modrm(s, i+1)
-            _, op = unify_operands(x)
-            op.data_size = 1 << (2-size_prefix)
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='pop', operands=[op], prefix=rep_prefix)
-        elif s[i] & 0xFD == push_imm32:
-            size_flag = s[i] & 2
-            i += 1
-            if size_flag:
-                immediate = s[i] | (s[i] >> 7) * 0xFFFFFF00  # 6A FF -> push 0FFFFFFFFh
-                i += 1
-            else:
-                immediate = int.from_bytes(s[i:i+4], byteorder='little')
-                i += 4
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='push',
-                              operands=[Operand(value=immediate)], prefix=rep_prefix)
-        elif s[i] & 0xFE in op_FE_width_acc_imm:
-            mnemonic = op_FE_width_acc_imm[s[i] & 0xFE]
-            flag_size = s[i] & 1
-            i += 1
-            size = flag_size*2 - size_prefix
-            imm_size = 1 << size
-            immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
-            i += imm_size
-            op1 = Operand(reg=Reg((RegType.general, Reg.eax.code, 1 << size)))
-            op2 = Operand(value=immediate)
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=[op1, op2], prefix=rep_prefix)
-        elif s[i] & 0xF0 == mov_reg_imm:
-            flag_size = (s[i] & 8) >> 3
-            reg = s[i] & 7
-            i += 1
-            size = flag_size*2 - size_prefix
-            imm_size = 1 << size
-            immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
-            i += imm_size
-            op1 = Operand(reg=Reg((RegType.general, reg, 1 << size)))
-            op2 = Operand(value=immediate)
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic='mov', operands=[op1, op2], prefix=rep_prefix)
-        elif s[i] & 0xFE in {shift_op_rm_1, shift_op_rm_cl, shift_op_rm_imm8}:
-            opcode = s[i] & 0xFE
-            flag_size = s[i] & 1
-            x, i = analyse_modrm(s, i+1)
-            mnemonic = op_shifts_rolls[x['modrm'][1]]
-            _, op1 = unify_operands(x)
-            op1.data_size = 1 << (flag_size*2 - size_prefix)
-            if opcode == shift_op_rm_1:
-                op2 = Operand(value=1)
-            elif opcode == shift_op_rm_cl:
-                op2 = Operand(reg=Reg.cl)
-            else:
-                immediate = s[i]
-                i += 1
-                op2 = Operand(value=immediate)
-            line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=[op1, op2], prefix=rep_prefix)
-        elif s[i] & 0xFE == test_or_unary_rm:
-            flag_size = s[i] & 1
-            x, i = analyse_modrm(s, i+1)
-            modrm1 = x['modrm'][1]
-            if modrm1 != 1:
-                _, op1 = unify_operands(x)
-                size = flag_size*2 - size_prefix
-                op1.data_size = 1 << size
-                if modrm1 >= 2:
-                    # unary operations: not, neg, mul, imul etc.
-                    mnemonics = ("not", "neg", "mul", "imul", "div", "idiv")
-                    mnemonic = mnemonics[modrm1-2]
-                    line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                      operands=(op1,), prefix=rep_prefix)
-                elif modrm1 == 0:
-                    # test r/m, imm
-                    imm_size = 1 << size
-                    immediate = int.from_bytes(s[i:i+imm_size], byteorder='little')
-                    i += imm_size
-                    op2 = Operand(value=immediate)
-                    line = DisasmLine(start_address+j, data=s[j:i], mnemonic='test',
-                                      operands=(op1, op2), prefix=rep_prefix)
-        elif s[i] == 0x0F:
-            i += 1
-            if s[i] & 0xF0 == x0f_setcc and s[i+1] & 0xC0 == 0xC0:
-                condition = s[i] & 0x0F
-                mnemonic = "set%s" % Cond(condition).name
-                reg = Operand(reg=Reg((RegType.general, s[i+1] & 7, 1)))
-                i += 2
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic, operands=[reg], prefix=rep_prefix)
-            elif s[i] & 0xF0 == x0f_jcc_near:
-                condition = s[i] & 0x0F
-                mnemonic = "j%s near" % Cond(condition).name
-                i += 1
-                immediate = start_address+i+4+int.from_bytes(s[i:i+4], byteorder='little', signed=True)
-                i += 4
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[Operand(value=immediate)], prefix=rep_prefix)
-            elif s[i] & 0xFE in {x0f_movzx, x0f_movsx}:
-                op = s[i] & 0xFE
-                mnemonic = 'movzx' if op == x0f_movzx else 'movsx'
-                flag_size = s[i] & 1
-                x, i = analyse_modrm(s, i+1)
-                dest, src = unify_operands(x, size=1 << (flag_size+1))
-                src.data_size = 1 << flag_size
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[dest, src], prefix=rep_prefix)
-            elif s[i] & 0xFE in {x0f_movups, x0f_movaps}:
-                op = s[i] & 0xFE
-                mnemonic = 'movups' if op == x0f_movups else 'movaps'
-                dir_flag = s[i] & 1
-                x, i = analyse_modrm(s, i+1)
-                op1, op2 = unify_operands(x)
-                op1 = Operand(reg=Reg['xmm' + str(op1)])
-                if dir_flag:
-                    op1, op2 = op2, op1
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[op1, op2], prefix=rep_prefix)
-            elif s[i] & 0xEE == x0f_movd_mm:
-                opcode = s[i]
-                size_flag = s[i] & 0x01
-                dir_flag = s[i] & 0x10
-                mnemonic = 'movq' if size_flag else 'movd'
-                x, i = analyse_modrm(s, i + 1)
-                op1, op2 = unify_operands(x)
-                if rep_prefix is Prefix.rep and opcode == x0f_movd_mm | 0x10:
-                    mnemonic = 'movq'
-                    op1 = Operand(reg=Reg['xmm' + str(op1)])
-                    rep_prefix = None
-                    op2.data_size = 8  # qword
-                else:
-                    op2.data_size = 4 << size_flag
-                    op1 = Operand(reg=Reg['mm' + str(op1)])
-                    if dir_flag:
-                        op1, op2 = op2, op1
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[op1, op2], prefix=rep_prefix)
-            elif s[i] == x0f_movq_rm_xmm and size_prefix:
-                mnemonic = 'movq'
-                x, i = analyse_modrm(s, i + 1)
-                op1, op2 = unify_operands(x)
-                op1 = Operand(reg=Reg['xmm' + str(op1)])
-                op2.data_size = 8  # qword
-                op1, op2 = op2, op1
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[op1, op2], prefix=rep_prefix)
-            elif s[i] & 0xF0 == x0f_cmov:
-                condition = s[i] & 0x0F
-                mnemonic = 'cmov' + Cond(condition).name
-                size = 4 >> size_prefix
-                x, i = analyse_modrm(s, i + 1)
-                op1, op2 = unify_operands(x)
-                op1 = Operand(reg=Reg((RegType.general, op1, size)))
-                line = DisasmLine(start_address+j, data=s[j:i], mnemonic=mnemonic,
-                                  operands=[op1, op2], prefix=rep_prefix)
+        if s[i] in prefix_bytes:
+            i, size_prefix, seg_prefix, rep_prefix = parse_prefixes(s, i)
+
+        decoder, flush = _decoders[s[i]]
+        if i > j and (flush == _flush_always or
+                      flush == _flush_if_no_rep and rep_prefix is None and not (size_prefix and s[i] == movsd)):
+            if counter is not None:
+                counter.lines += 1
+                counter.bytes += i - j
+            yield BytesLine(start_address+j, data=s[j:i])
+            j = i
+
+        if decoder is None:
+            line = None
+        else:
+            line, i = decoder(s, i, j, start_address, size_prefix, seg_prefix, rep_prefix)
 
         if not line:
             i += 1
             line = BytesLine(start_address+j, data=s[j:i])
 
+        if counter is not None:
+            counter.lines += 1
+            counter.bytes += len(line.data)
         yield line
 
 
@@ -57,7 +57,8 @@ def main():
             sections = peobj.section_table
             reloc_rva, reloc_size = data_directory.basereloc
             reloc_off = sections.rva_to_offset(reloc_rva)
-            relocs = set(peobj.relocation_table)
+            fn.seek(reloc_off)
+            relocs = set(RelocationTable.iter_relocs(fn, reloc_size))
 
             for op, items in args:
                 if op == '+':
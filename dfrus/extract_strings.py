@@ -1,6 +1,13 @@
+import mmap
+import os
+import pickle
+import re
 import sys
+import tempfile
 
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from .cross_references import get_cross_references
 from .peclasses import PortableExecutable
@@ -24,45 +31,102 @@ def possible_to_decode(c, encoding):
         return True
 
 
-def check_string(buf, encoding):
-    s_len = None
-    letters = 0
-    for i, c in enumerate(buf):
-        if c == 0:
-            s_len = i
-            break
-        
-        if not is_allowed(c) or not possible_to_decode(buf[i:i+1], encoding):
-            break
-        elif buf[i:i+1].isalpha():
-            letters += 1
+letter_bytes = bytes(c for c in range(0x100) if bytes((c,)).isalpha())
+
+
+class ByteClasses:
+    """
+    Classification of byte values for the validation of strings in some codepage.
+
+    decodable: bytes which can be decoded on their own,
+    valid: decodable bytes which are allowed in strings (NUL is not included),
+    letters: bytes which are counted as letters,
+    one_char_per_byte: each decodable byte is decoded to a single character,
+    so a decoded string has the same length as its bytes.
+    """
+
+    def __init__(self, decodable, letters=letter_bytes, one_char_per_byte=True):
+        self.decodable = bytes(sorted(set(decodable)))
+        self.one_char_per_byte = one_char_per_byte
+        self.valid = bytes(c for c in self.decodable if c and is_allowed(c))
+        self.letters = bytes(letters)
+        self._valid = frozenset(self.valid)
+        if self.valid:
+            char_class = b'[' + b''.join(re.escape(bytes((c,))) for c in self.valid) + b']'
+        else:
+            char_class = b'(?!)'
+        # A valid string followed by its NUL terminator and padding
+        self.string_array_item = re.compile(b'(' + char_class + b'+)\0+')
+
+    @classmethod
+    def from_encoding(cls, encoding):
+        decodable = [c for c in range(0x100) if possible_to_decode(bytes((c,)), encoding)]
+        one_char_per_byte = all(len(bytes((c,)).decode(encoding)) == 1 for c in decodable)
+        return cls(decodable, one_char_per_byte=one_char_per_byte)
+
+    def is_valid(self, c):
+        return c in self._valid
+
+    def is_valid_string(self, s):
+        return not s.translate(None, self.valid)
+
+    def count_letters(self, s):
+        return len(s) - len(s.translate(None, self.letters))
+
+
+_byte_classes = dict()
+
+
+def register_byte_classes(encoding, byte_classes: ByteClasses):
+    """Set the byte classification for an encoding, eg. for a codepage which is not a registered codec"""
+    _byte_classes[encoding] = byte_classes
+
+
+def get_byte_classes(encoding) -> ByteClasses:
+    """Get the byte classification for an encoding, it is built once for each encoding"""
+    byte_classes = _byte_classes.get(encoding)
+    if byte_classes is None:
+        byte_classes = ByteClasses.from_encoding(encoding)
+        register_byte_classes(encoding, byte_classes)
+    return byte_classes
+
+
+def check_string(buf, encoding, start=0, end=None):
+    """
+    Check the NUL-terminated string at buf[start:end],
+    return its length (None if it is not a valid string) and the number of letters in it
+    """
+    if end is None:
+        end = len(buf)
+    
+    s_len = buf.find(b'\0', start, end)
+    if s_len < 0:
+        return None, 0
+    
+    byte_classes = get_byte_classes(encoding)
+    s = buf[start:s_len]
+    if not byte_classes.is_valid_string(s):
+        return None, 0  # there are forbidden or undecodable bytes before the terminator
     
-    return s_len, letters
+    return s_len - start, byte_classes.count_letters(s)
+
+
+_first_string_array_item = re.compile(b'([^\0]+)\0+')
 
 
 def check_string_array(buf, offset, encoding='cp437'):
-    start = None
-    end = None
-    for i, c in enumerate(buf):
-        if c:
-            if end:
-                yield offset + start, buf[start:end], i - start - 1
-                start = None
-                end = None
-            
-            if not is_allowed(c) or not possible_to_decode(buf[i:i+1], encoding):
-                if start:
-                    start = None
-                continue
-            
-            if start is None:
-                start = i
-                end = None
-        elif start is not None and not end:
-            end = i
+    byte_classes = get_byte_classes(encoding)
+    pos = 0
+    if buf and byte_classes.is_valid(buf[0]):
+        # A string at the beginning of the buffer is taken up to its terminator whatever bytes it contains
+        match = _first_string_array_item.match(buf)
+        if match:
+            yield offset, match.group(1), match.end() - 1
+            pos = match.end()
     
-    if end:
-        yield offset + start, buf[start:end], len(buf) - start - 1
+    for match in byte_classes.string_array_item.finditer(buf, pos):
+        start = match.start()
+        yield offset + start, match.group(1), match.end() - start - 1
 
 
 def count_zeros(buf):
@@ -86,42 +150,145 @@ def find_next_string_xref(s_xrefs, i, obj_off):
     return s_xrefs[i]
 
 
-def extract_strings(fn, xrefs, blocksize=4096, encoding='cp437', arrays=False):
-    prev_string = None
-    current_string = None
+def strings_at_xref(data, base, s_xrefs, i, blocksize=4096, encoding='cp437', arrays=False, decode=True):
+    """
+    Get the list of strings which start at the i-th of the sorted references,
+    data is the contents of the file from the base offset.
+    With decode=False the strings are left as bytes, it is valid only for encodings with one character per byte.
+    """
+    def decoded(s):
+        return s.decode(encoding=encoding) if decode else s
+
+    obj_off = s_xrefs[i]
+    start = obj_off - base
+    end = min(start + blocksize, len(data))
+    s_len, letters = check_string(data, encoding, start, end)
+    if not s_len or letters == 0:
+        return []
+    
+    if not arrays:
+        s = decoded(data[start:start + s_len])
+        return [(obj_off, s, align(len(s) + 1))]
+    
+    upper_bound = find_next_string_xref(s_xrefs, i, obj_off + s_len) - obj_off
+    block = range(start, max(start, end))[:upper_bound]
+    buf = data[block.start:block.stop]
+    
+    string_array = list(check_string_array(buf, obj_off, encoding))
+    if not all(cap_len == string_array[0][2] for _, _, cap_len in string_array):
+        # cap_len = align(len(s) + 1)
+        s = decoded(buf[:s_len])
+        return [(obj_off, s, align(len(s) + 1))]
+    
+    return [(off, decoded(s), cap_len) for off, s, cap_len in string_array]
+
+
+_worker_state = None  # Data of a worker process of extract_strings()
+
+# With fewer references the pool of worker processes doesn't pay off (see benchmarks/bench_pool.py):
+# it takes 15-45 ms to start, and the strings at a reference are got in about 10 us in a single process,
+# so it pays off with 4000-9000 references depending on the number of workers
+min_parallel_xrefs = 10000
+
+
+def _extract_strings_worker(directory, shard, blocksize, encoding, arrays, decode):
+    """Get the strings at each reference of the shard (a range of indices of the sorted references)"""
+    global _worker_state
+    if _worker_state is None or _worker_state[0] != directory:
+        with open(os.path.join(directory, 'data'), 'rb') as file:
+            if os.fstat(file.fileno()).st_size:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = b''  # an empty file can't be mapped
+
+        with open(os.path.join(directory, 'xrefs'), 'rb') as file:
+            s_xrefs = pickle.load(file)
+
+        _worker_state = [directory, data, s_xrefs]
+
+    _, data, s_xrefs = _worker_state
+    return [strings_at_xref(data, s_xrefs[0], s_xrefs, i, blocksize, encoding, arrays, decode) for i in shard]
+
+
+def _strings_at_xrefs_parallel(data, s_xrefs, workers, blocksize, encoding, arrays, decode):
+    """Get the strings at each of the sorted references in a pool of worker processes"""
+    shard_count = workers * 4
+    shard_size = -(-len(s_xrefs) // shard_count)
+    shards = [range(i, min(i + shard_size, len(s_xrefs))) for i in range(0, len(s_xrefs), shard_size)]
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'data'), 'wb') as file:
+            file.write(data)
+
+        with open(os.path.join(directory, 'xrefs'), 'wb') as file:
+            pickle.dump(s_xrefs, file, pickle.HIGHEST_PROTOCOL)
+
+        with ProcessPoolExecutor(workers) as executor:
+            for shard_results in executor.map(_extract_strings_worker, repeat(directory), shards, repeat(blocksize),
+                                              repeat(encoding), repeat(arrays), repeat(decode)):
+                yield from shard_results
+
+
+def encode_keys(strings, encoding):
+    """Encode the strings to match them with extract_strings(), the strings which can't be encoded are skipped"""
+    keys = set()
+    for s in strings:
+        try:
+            keys.add(s.encode(encoding=encoding))
+        except UnicodeEncodeError:
+            pass
+    return keys
+
+
+def extract_strings(fn, xrefs, blocksize=4096, encoding='cp437', arrays=False, workers=1, keys=None):
+    """
+    Extract strings at the references.
+
+    If keys (a set of encoded strings) is given, only the strings with these bytes are yielded,
+    and the other strings are not decoded at all (if the encoding has one character per byte).
+
+    With workers > 1 the sorted references are split into shards which are processed in a pool of worker processes.
+    Workers look for strings at every reference of a shard, then the references which point inside
+    of the previous string are skipped in order, the same way as it is done in a single process.
+    """
     s_xrefs = sorted(xrefs)
+    if not s_xrefs:
+        return
+    
+    # Read all the referenced data at once, strings are looked for in blocksize bytes after each reference
+    base = s_xrefs[0]
+    fn.seek(base)
+    data = fn.read(s_xrefs[-1] + blocksize - base)
+    
+    # Strings are matched with the keys before decoding
+    decode = keys is None or not get_byte_classes(encoding).one_char_per_byte
+    
+    if workers > 1:
+        strings_at_xrefs = _strings_at_xrefs_parallel(data, s_xrefs, workers, blocksize, encoding, arrays, decode)
+    else:
+        strings_at_xrefs = None
+    
+    prev_string = None
     for i, obj_off in enumerate(s_xrefs):
+        strings = next(strings_at_xrefs) if strings_at_xrefs is not None else None
         if prev_string is not None and obj_off <= prev_string[0]+len(prev_string[1]):
             continue  # it's not the beginning of the string
         
-        fn.seek(obj_off)
-        buf = fn.read(blocksize)
+        if strings is None:
+            strings = strings_at_xref(data, base, s_xrefs, i, blocksize, encoding, arrays, decode)
         
-        s_len, letters = check_string(buf, encoding)
+        if keys is None:
+            yield from strings
+        elif not decode:
+            for off, s, cap_len in strings:
+                if s in keys:
+                    yield off, s.decode(encoding=encoding), cap_len
+        else:
+            for off, s, cap_len in strings:
+                if s.encode(encoding=encoding) in keys:
+                    yield off, s, cap_len
         
-        if s_len and letters > 0:
-            if not arrays:
-                s = buf[:s_len].decode(encoding=encoding)
-                cap_len = align(len(s) + 1)
-                current_string = (obj_off, s, cap_len)
-                yield current_string
-            else:
-                upper_bound = find_next_string_xref(s_xrefs, i, obj_off + s_len) - obj_off
-                buf = buf[:upper_bound]
-                
-                string_array = list(check_string_array(buf, obj_off, encoding))
-                if not all(cap_len == string_array[0][2] for _, _, cap_len in string_array):
-                    # cap_len = align(len(s) + 1)
-                    s = buf[:s_len].decode(encoding=encoding)
-                    cap_len = align(len(s) + 1)
-                    current_string = (obj_off, s, cap_len)
-                    yield current_string
-                else:
-                    for off, s, cap_len in string_array:
-                        current_string = (off, s.decode(encoding=encoding), cap_len)
-                        yield current_string
-            
-            prev_string = current_string
+        if strings:
+            prev_string = strings[-1]
 
 
 def myrepr(s):
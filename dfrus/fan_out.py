@@ -0,0 +1,47 @@
+import contextlib
+import io
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from .analysis_cache import CacheEntry
+from .patchdf import analyse_executable, fix_df_exe
+from .peclasses import PortableExecutable
+
+PatchTarget = namedtuple('PatchTarget', 'trans_table codepage')
+PatchResult = namedtuple('PatchResult', 'image report log')
+
+
+def _patch_image(image, cache, original_codepage, target):
+    """Patch a copy of the image for the target, messages of fix_df_exe() are collected to the log"""
+    fn = io.BytesIO(image)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        report = fix_df_exe(fn, PortableExecutable(fn), target.codepage, original_codepage, target.trans_table,
+                            cache=cache)
+    return PatchResult(fn.getvalue(), report, log.getvalue())
+
+
+def patch_image_for_targets(image, targets, original_codepage='cp437', workers=1, cache=None):
+    """
+    Make patched copies of the original executable image for several (dictionary, codepage) targets,
+    return the list of PatchResult in the order of the targets.
+
+    The executable is analysed once, the results of the analysis are shared by all the targets with the cache
+    (a new CacheEntry if it is not given, it is filled but not stored anywhere).
+    With workers > 1 the targets are patched in a pool of worker processes.
+    """
+    if cache is None:
+        cache = CacheEntry('fan-out')
+
+    fn = io.BytesIO(image)
+    analyse_executable(fn, PortableExecutable(fn), cache, original_codepage, workers)
+
+    targets = [PatchTarget(*target) for target in targets]
+    if workers > 1 and len(targets) > 1:
+        with ProcessPoolExecutor(min(workers, len(targets))) as executor:
+            return list(executor.map(_patch_image, repeat(image), repeat(cache), repeat(original_codepage),
+                                     targets))
+    else:
+        return [_patch_image(image, cache, original_codepage, target) for target in targets]
@@ -0,0 +1,54 @@
+from collections import defaultdict
+
+from .binio import fpoke
+from .disasm import align
+from .opcodes import int3
+
+
+class HookLinker:
+    """
+    Linker of hooks in the new section.
+
+    A hook is given as a function which builds its code and relocations (relative to the hook) for the given address,
+    because the code of a hook depends on its address (eg. jumps back to the patched code are relative).
+    Hooks which are built into the same code with the same relocations at the same address are interchangeable,
+    so each distinct hook is written once, and its address is shared by all the patched places which use it.
+
+    Only whole hooks are shared, eg. the strlen hooks added before the calls of the same function.
+    Common parts of different hooks (the mach_strlen loop, the mach_memcpy code) are not moved to shared procedures:
+    a call would shift the stack which the hook code accesses (eg. mov [esp+8], ecx after the strlen loop).
+    """
+
+    def __init__(self, fn, offset, offset_to_rva, alignment=4, padding_byte=int3):
+        self._fn = fn
+        self._offset_to_rva = offset_to_rva
+        self._alignment = alignment
+        self._padding_byte = padding_byte
+        self._hooks = defaultdict(list)  # code and relocations built at zero address -> list of linked hooks
+        self.offset = offset  # Offset of the free space after the linked hooks
+        self.relocations = set()  # Addresses of the relocations of the linked hooks
+        self.linked = 0
+        self.shared = 0
+
+    def link(self, build):
+        """Write the hook built by build(address) to the new section or find the same one, return its address"""
+        code, relocations = build(0)
+        candidates = self._hooks[code, frozenset(relocations)]
+        for hook_rva, hook_code, hook_relocations in candidates:
+            code, relocations = build(hook_rva)
+            if code == hook_code and set(relocations) == hook_relocations:
+                self.shared += 1
+                return hook_rva
+
+        hook_rva = self._offset_to_rva(self.offset)
+        code, relocations = build(hook_rva)
+        relocations = set(relocations)
+        candidates.append((hook_rva, code, relocations))
+
+        end = align(self.offset + len(code), self._alignment)
+        fpoke(self._fn, self.offset, code.ljust(end - self.offset, bytes((self._padding_byte,))))
+        self.offset = end
+
+        self.relocations.update(hook_rva + item for item in relocations)
+        self.linked += 1
+        return hook_rva
@@ -1,3 +1,4 @@
+import codecs
 import unicodedata
 from typing import Callable, Tuple, Optional
 
@@ -46,6 +47,13 @@ _additional_codepages = {
         0xF0: map(ord_utf16, 'đựòóôõỏọụùúũủýợỮ')
     }
 }
+
+# Sequences of characters are kept as lists, so that they can be iterated more than once
+for _codepage_data in _additional_codepages.values():
+    for _char_code, _value in _codepage_data.items():
+        if not isinstance(_value, int):
+            _codepage_data[_char_code] = list(_value)
+
 _codepages = dict()
 
 
@@ -93,29 +101,74 @@ def search_charmap(fn, sections, xref_table):
     return None
 
 
+def codepage_chars(codepage_data):
+    """Iterate over (byte, UTF-16 code of its character) pairs of a codepage patch"""
+    for char_code, value in codepage_data.items():
+        if isinstance(value, int):
+            yield char_code, value
+        else:
+            for i, char in enumerate(value):
+                yield char_code + i, char
+
+
 class Encoder:
+    """
+    Codec of a codepage which is cp437 with a patched part.
+    Characters of cp437 which are replaced by the patch are still encoded to their cp437 codes.
+    Encoding and decoding are done by codecs.charmap_encode() and codecs.charmap_decode().
+    """
+
     def __init__(self, codepage_data):
-        self.lookup_table = dict()
+        decoding_table = list(bytes(range(0x100)).decode('cp437'))
+        self.encoding_map = {ord(char): char_code for char_code, char in enumerate(decoding_table)}
+        for char_code, value in codepage_chars(codepage_data):
+            decoding_table[char_code] = chr_utf16(value)
+            self.encoding_map[value] = char_code
 
-        for char_code, value in codepage_data.items():
-            if isinstance(value, int):
-                self.lookup_table[chr_utf16(value)] = char_code
-            else:
-                for i, char in enumerate(value):
-                    self.lookup_table[chr_utf16(char)] = char_code + i
+        self.decoding_table = ''.join(decoding_table)
 
     def encode(self, input_string: str, errors='strict') -> Tuple[bytes, int]:
-        array = []
-        for char in unicodedata.normalize('NFC', input_string):
-            if char in self.lookup_table:
-                array.append(self.lookup_table[char])
-            else:
-                array.append(char.encode('cp437', errors=errors)[0])
+        encoded, _ = codecs.charmap_encode(unicodedata.normalize('NFC', input_string), errors, self.encoding_map)
+        return encoded, len(encoded)
+
+    def decode(self, data: bytes, errors='strict') -> Tuple[str, int]:
+        return codecs.charmap_decode(data, errors, self.decoding_table)
+
+    def codec_info(self, name):
+        encoder = self
+
+        class IncrementalEncoder(codecs.IncrementalEncoder):
+            def encode(self, input_string, final=False):
+                return encoder.encode(input_string, self.errors)[0]
+
+        class IncrementalDecoder(codecs.IncrementalDecoder):
+            def decode(self, data, final=False):
+                return encoder.decode(data, self.errors)[0]
+
+        return codecs.CodecInfo(name=name, encode=self.encode, decode=self.decode,
+                                incrementalencoder=IncrementalEncoder, incrementaldecoder=IncrementalDecoder)
+
+
+def _is_codec(name):
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return False
+    else:
+        return True
+
+
+# Codecs for the codepages which Python doesn't know
+_encoders = {name: Encoder(codepage_data) for name, codepage_data in _additional_codepages.items()
+             if not _is_codec(name)}
+
 
-        return bytes(array), len(array)
+def _search_codec(name):
+    encoder = _encoders.get(name)
+    return None if encoder is None else encoder.codec_info(name)
 
 
-_encoders = {'viscii': Encoder(_additional_codepages['viscii'])}
+codecs.register(_search_codec)
 
 
 def get_encoder(encoding: str):
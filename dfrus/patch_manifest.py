@@ -0,0 +1,155 @@
+import json
+import zlib
+from base64 import b64decode, b64encode
+from collections import namedtuple
+
+from .analysis_cache import CacheEntry, cache_key, fix_from_row, fix_to_row
+from .disasm import align
+
+# Record of the patching of a translated string:
+# state - the lengths, the checksum and the placement of the translation (see fix_df_exe),
+# writes - (offset, data) pairs written to the file while the references to the string were fixed,
+# reads - [offset, size] ranges of the file read then,
+# fixes - (reference offset, Fix) pairs for the references from the code, as they were returned by fix_len()
+StringRecord = namedtuple('StringRecord', 'state writes reads fixes')
+
+
+class PatchManifest(CacheEntry):
+    """
+    Record of a patch applied to an executable.
+
+    Besides the analysis results it keeps the placement of the translations in the new section
+    and the record of the patching of each translated string (see StringRecord),
+    so that the next run with a slightly changed dictionary keeps translations of unchanged strings
+    at the same addresses and copies the bytes written for them instead of fixing their references again
+    (only if the bytes the fixes read were not changed, see fix_df_exe).
+    Only the placements and the string records used by the latest run are saved. The manifest is stored as JSON.
+    """
+
+    def __init__(self, key, values=None, placements=None, string_records=None):
+        super().__init__(key, values)
+        # string offset -> (offset in the new section, capacity) or (offset, size, checksum of the data)
+        # for translations which share their bytes with other translations (see StringPool)
+        self.placements = placements or dict()
+        self._new_placements = dict()
+        # string offset -> [state, writes, reads, fixes] row (see StringRecord)
+        self.string_records = string_records or dict()
+        self._used_string_records = dict()
+
+    @property
+    def strings_area_size(self):
+        """Size of the part of the new section occupied by the translations of the previous run"""
+        return max((placement[0] + placement[1] for placement in self.placements.values()), default=0)
+
+    def find_place(self, string_offset, size, checksum=None):
+        """
+        Return the previous offset of the translation in the new section if the new translation fits there.
+        A shared place is reused only by the same translation (with the same checksum).
+        """
+        placement = self.placements.get(string_offset)
+        if placement is None:
+            return None
+        elif len(placement) > 2:
+            if placement[2] != checksum:
+                return None
+        elif placement[1] < size:
+            return None
+        self._new_placements[string_offset] = placement
+        return placement[0]
+
+    def set_place(self, string_offset, offset, size, checksum=None):
+        """Record the place of the translation, the checksum is given if its bytes are shared"""
+        if checksum is None:
+            self._new_placements[string_offset] = (offset, align(size))
+        else:
+            self._new_placements[string_offset] = (offset, size, checksum)
+        self.modified = True
+
+    @staticmethod
+    def _string_record_from_row(row):
+        state, (sizes, data), reads, fixes = row
+        # The written data are kept together, as most of the writes are pointers of 4 bytes
+        data = b64decode(data)
+        writes = []
+        position = 0
+        for offset, size in sizes:
+            writes.append((offset, data[position:position + size]))
+            position += size
+        return StringRecord(state, writes, reads, [(offset, fix_from_row(fix)) for offset, fix in fixes])
+
+    def get_string_record(self, string_offset):
+        """Return the StringRecord of the previous patching of the string or None, the record is kept if it is used"""
+        row = self.string_records.get(string_offset)
+        if row is None:
+            return None
+        self._used_string_records[string_offset] = row
+        return self._string_record_from_row(row)
+
+    @staticmethod
+    def fix_row(fix):
+        """
+        Convert the fix of a reference for set_string_record(),
+        it must be done at once, as the fixes are changed when they are applied.
+        """
+        return fix_to_row(fix)
+
+    def set_string_record(self, string_offset, state, writes, reads, fixes):
+        """Record the patching of the string, fixes are (reference offset, row made by fix_row()) pairs"""
+        sizes = [[offset, len(data)] for offset, data in writes]
+        self._used_string_records[string_offset] = [
+            state,
+            [sizes, b64encode(b''.join(data for _, data in writes)).decode('ascii')],
+            [list(piece) for piece in reads],
+            [list(item) for item in fixes],
+        ]
+        self.modified = True
+
+    def other_string_records(self, string_offsets):
+        """Return the records of the strings which are not in string_offsets (e.g. not translated anymore)"""
+        return [self._string_record_from_row(row) for string_offset, row in self.string_records.items()
+                if string_offset not in string_offsets]
+
+    def to_bytes(self):
+        return zlib.compress(json.dumps({
+            'values': self._values_to_json(self._values),
+            'placements': [[offset, list(placement)] for offset, placement in self._new_placements.items()],
+            'strings': [[offset, row] for offset, row in self._used_string_records.items()],
+        }).encode('utf-8'), 1)
+
+    @classmethod
+    def from_bytes(cls, key, data):
+        """Load the manifest saved with to_bytes(), ValueError is raised if the data is broken"""
+        try:
+            data = json.loads(zlib.decompress(data).decode('utf-8'))
+            placements = {offset: tuple(placement) for offset, placement in data['placements']}
+            string_records = dict()
+            for offset, row in data['strings']:
+                if not isinstance(row, list) or len(row) != len(StringRecord._fields):
+                    raise ValueError('Broken string record: %r' % row)
+                string_records[offset] = row
+            return cls(key, cls._values_from_json(data['values']), placements, string_records)
+        except (zlib.error, KeyError, TypeError) as ex:
+            raise ValueError('Broken manifest data: %r' % ex)
+
+    @classmethod
+    def load(cls, path, digest):
+        """
+        Load the manifest of the previous patch of the executable with the given digest.
+        If the file doesn't exist or it was made for another executable, an empty manifest is returned.
+        """
+        key = cache_key(digest)
+        try:
+            with open(path, 'rb') as file:
+                manifest = cls.from_bytes(key, file.read())
+                if manifest.get('key') == key:
+                    return manifest
+        except (OSError, ValueError, TypeError):
+            pass
+
+        manifest = cls(key)
+        manifest.set('key', key)
+        return manifest
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
@@ -0,0 +1,59 @@
+import json
+import time
+
+from collections import Counter, OrderedDict
+
+
+class PatchReport:
+    """
+    Timings and counters of patching of an executable, filled by fix_df_exe().
+
+    Stages are measured one after another: starting a stage finishes the previous one.
+    CPU time is the time of the current process, the time of worker processes is not included.
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()  # stage name -> [wall time, CPU time] in seconds
+        self.counters = OrderedDict()
+        self.fix_len_outcomes = Counter()  # Metadata.fixed of each reference from the code -> count
+        self.not_fixed_causes = Counter()  # Metadata.cause of references which length wasn't fixed -> count
+        self._stage = None
+        self._started = None
+
+    def stage(self, name):
+        """Finish the current stage and start the named one"""
+        self.finish()
+        self._stage = name
+        self._started = time.perf_counter(), time.process_time()
+
+    def finish(self):
+        """Finish the current stage"""
+        if self._stage is not None:
+            wall_time, cpu_time = self.stages.setdefault(self._stage, [0.0, 0.0])
+            self.stages[self._stage] = [wall_time + time.perf_counter() - self._started[0],
+                                        cpu_time + time.process_time() - self._started[1]]
+            self._stage = None
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        return OrderedDict([
+            ('stages', OrderedDict((name, OrderedDict([('wall_time', wall_time), ('cpu_time', cpu_time)]))
+                                   for name, (wall_time, cpu_time) in self.stages.items())),
+            ('counters', self.counters),
+            ('fix_len_outcomes', OrderedDict(sorted(self.fix_len_outcomes.items()))),
+            ('not_fixed_causes', OrderedDict(sorted(self.not_fixed_causes.items()))),
+        ])
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.as_dict(), file, indent=2)
+
+    def __str__(self):
+        lines = ['%-24s %9.3f s (CPU %.3f s)' % (name, wall_time, cpu_time)
+                 for name, (wall_time, cpu_time) in self.stages.items()]
+        lines.extend('%-24s %d' % (name.replace('_', ' '), value) for name, value in self.counters.items())
+        lines.extend('%-24s %d' % ('fixed: %s' % outcome, value)
+                     for outcome, value in sorted(self.fix_len_outcomes.items()))
+        return '\n'.join(lines)
@@ -1,24 +1,37 @@
 import codecs
 import csv
+import hashlib
 import io
+import mmap
+import os
 import sys
+import tempfile
 import textwrap
+import zlib
 
 from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 from warnings import warn
 from binascii import hexlify
+from bisect import bisect_left, bisect_right
 from typing import Dict, Tuple
 
-from .binio import read_bytes, fpoke4, fpoke, from_dword, to_dword
+from .binio import read_bytes, fpoke4, fpoke, from_dword, to_dword, RecordingFile, apply_writes, apply_writes_at_once
+from .code_index import CodeIndex
 from .cross_references import get_cross_references
 from .disasm import *
 from .machine_code_utils import mach_strlen, match_mov_reg_imm32, get_start, mach_memcpy
 from .machine_code import MachineCode, Reference
 from .opcodes import *
-from .extract_strings import extract_strings
+from .extract_strings import extract_strings, encode_keys, min_parallel_xrefs
+from .hook_linker import HookLinker
 from .patch_charmap import search_charmap, patch_unicode_table, get_codepages, get_encoder
-from .peclasses import Section, RelocationTable
-from .trace_machine_code import which_func
+from .patch_report import PatchReport
+from .peclasses import Section
+from .string_pool import StringPool
+from .trace_machine_code import which_func, TraceCache
 
 
 def load_trans_file(fn):
@@ -195,7 +208,24 @@ count_after = 0x100
 count_after_for_get_length = 0x2000
 
 
-def fix_len(fn, offset, old_len, new_len, string_address, original_string_address) -> Fix:
+@lru_cache(maxsize=None)
+def stop_at_register_use(reg):
+    """
+    Make a stop condition for which_func() which stops at an instruction using the register.
+    The same function is returned for the same register, so that the trace results can be cached.
+    """
+    def stop_func(disasm_line: DisasmLine):
+        return disasm_line.operands and (
+                (disasm_line.operands[0].type == 'reg gen' and disasm_line.operands[0].reg == reg) or
+                (len(disasm_line.operands) > 1 and disasm_line.operands[1].type == 'ref rel' and
+                 disasm_line.operands[1].base_reg == reg)
+        )
+
+    return stop_func
+
+
+def fix_len(fn, offset, old_len, new_len, string_address, original_string_address, code_index=None,
+            trace_cache=None, counter=None) -> Fix:
     next_off = offset + 4
 
     pre = read_bytes(fn, offset - count_before, count_before)
@@ -224,19 +254,11 @@ def fix_len(fn, offset, old_len, new_len, string_address, original_string_addres
             meta.len = 'push before'
             meta.fixed = 'yes'
 
-        meta.func = which_func(fn, old_next)
+        meta.func = which_func(fn, old_next, code_index=code_index, cache=trace_cache, counter=counter)
     elif pre[-1] & 0xF8 == (mov_reg_imm | 8):
         # mov reg32, offset str
         reg = pre[-1] & 7
-
-        def stop_func(disasm_line: DisasmLine):
-            return disasm_line.operands and (
-                    (disasm_line.operands[0].type == 'reg gen' and disasm_line.operands[0].reg == reg) or
-                    (len(disasm_line.operands) > 1 and disasm_line.operands[1].type == 'ref rel' and
-                     disasm_line.operands[1].base_reg == reg)
-            )
-
-        func = which_func(fn, old_next, stop_cond=stop_func)
+        func = which_func(fn, old_next, stop_cond=stop_at_register_use(reg), cache=trace_cache, counter=counter)
 
         if isinstance(func, tuple):
             meta.func = func
@@ -263,7 +285,7 @@ def fix_len(fn, offset, old_len, new_len, string_address, original_string_addres
 
                         mov_esp_edi = False
 
-                        for line in disasm(aft, next_off):
+                        for line in disasm(aft, next_off, counter):
                             assert (line.mnemonic != 'db')
                             str_line = str(line)
                             if str_line.startswith('mov [esp') and str_line.endswith('], edi'):
@@ -439,7 +461,7 @@ def fix_len(fn, offset, old_len, new_len, string_address, original_string_addres
                     meta.fixed = 'no'
                     return Fix(meta=meta)
                 elif aft:
-                    for line in disasm(aft, start_address=next_off):
+                    for line in disasm(aft, next_off, counter):
                         if line.mnemonic != 'db':
                             break
                         offset = line.address
@@ -494,7 +516,7 @@ def fix_len(fn, offset, old_len, new_len, string_address, original_string_addres
         next_off = offset - get_start(pre)
         aft = read_bytes(fn, next_off, count_after_for_get_length)
         try:
-            get_length_info = get_length(aft, old_len, original_string_address)
+            get_length_info = get_length(aft, old_len, original_string_address, counter=counter)
         except (ValueError, IndexError) as err:
             meta.fixed = 'no'
             meta.cause = repr(err)
@@ -510,18 +532,24 @@ def fix_len(fn, offset, old_len, new_len, string_address, original_string_addres
         else:
             fix = Fix(**get_fix_for_moves(get_length_info, new_len, string_address, meta))
 
-            if fix['fixed'] == 'yes':
+            if meta.fixed == 'yes':
                 # Make deleted relocs offsets relative to the given offset
                 fix['deleted_relocs'] = [next_off + ref - offset for ref in fix['deleted_relocs']]
 
                 if 'fix' in fix:
-                    fix['fix'].src_off = next_off + 1
+                    # The copying code is moved to a procedure in the new section and is called from here,
+                    # new relocations belong to the procedure
+                    proc_fix = fix['fix']
+                    proc_fix.src_off = next_off + 1
+                    proc_fix.added_relocs = fix['added_relocs']
+                    proc_fix.pokes = {next_off + off: b for off, b in proc_fix.pokes.items()}
+                    fix['added_relocs'] = None
                 else:
                     # Make new relocations relative to the given offset (only if they not belong to a procedure)
                     fix['added_relocs'] = [next_off + ref - offset for ref in fix['added_relocs']]
 
                 if 'pokes' in fix:
-                    fix['pokes'] = {next_off + off: b for off, b in fix['pokes'].items()}
+                    fix['pokes'] = {next_off + off - offset: b for off, b in fix['pokes'].items()}
 
             return fix
     elif pre[-2] == mov_reg_rm and pre[-1] & 0xC0 == 0x80:
@@ -547,7 +575,234 @@ def fix_len(fn, offset, old_len, new_len, string_address, original_string_addres
     return Fix(meta=meta)
 
 
-def get_length(s: bytes, oldlen, original_string_address=None, reg_state=None, dest=None):
+def fix_len_cached(fn, caches, offset, old_len, new_len, string_address, original_string_address,
+                   code_index=None, trace_cache=None, analysed=None, counter=None) -> Fix:
+    """
+    Call fix_len() or take its result from one of the analysis caches or from the parallel analysis,
+    replaying the writes it made to the file.
+    analysed is a pair of the result of the parallel analysis (a Fix object and a list of writes)
+    and a list of (offset, size, digest) pieces of the data it read, which must be already checked.
+
+    A cached result is used only if the file has the same data, which fix_len() read when the result was got,
+    otherwise fix_len() is called again.
+    """
+    caches = [cache for cache in caches if cache is not None]
+    if not caches and analysed is None:
+        return fix_len(fn, offset, old_len, new_len, string_address, original_string_address, code_index,
+                       trace_cache, counter)
+
+    args = (offset, old_len, new_len, string_address, original_string_address)
+    result = None
+    missed = []
+    for cache in caches:
+        result = cache.get_fix_len_result(args)
+        if result is not None:
+            if pieces_unchanged(fn, result[2]):
+                break
+            # The code was changed since then, eg. by fixes of other references
+            result = None
+        missed.append(cache)
+
+    if result is None and analysed is not None:
+        (fix, writes), pieces = analysed
+        result = fix, writes, pieces
+
+    if result is None:
+        # The writes are applied after the call, so that the data read by fix_len() can be saved as it was
+        recorder = RecordingFile(fn, passthrough=False, overlay=True)
+        fix = fix_len(recorder, *args, code_index=code_index, trace_cache=trace_cache, counter=counter)
+        writes = recorder.writes
+        pieces = read_pieces(fn, merge_ranges(recorder.reads))
+    else:
+        fix, writes, pieces = result
+
+    apply_writes(fn, writes)
+
+    for cache in missed:
+        cache.set_fix_len_result(args, fix, writes, pieces)
+    return fix
+
+
+def data_digest(data):
+    """Digest of a piece of the file, so that the cached results of fix_len() don't keep the code it read"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def read_pieces(fn, ranges):
+    """Read the data of the file in the (offset, size) ranges, return a list of (offset, size, digest) pieces"""
+    pieces = []
+    for offset, size in ranges:
+        fn.seek(offset)
+        pieces.append((offset, size, data_digest(fn.read(size))))
+    return pieces
+
+
+def pieces_unchanged(fn, pieces):
+    """Check if the file has the same data as in the (offset, size, digest) pieces"""
+    for offset, size, digest in pieces:
+        fn.seek(offset)
+        if data_digest(fn.read(size)) != digest:
+            return False
+    return True
+
+
+_worker_state = None  # Data of a worker process of analyse_references()
+
+# With fewer isolated references the pool of worker processes doesn't pay off (see benchmarks/bench_pool.py):
+# it takes 30-90 ms to start, a reference is analysed in 70-80 us in a single process, a worker spends 30 us more
+# on recording and pickling the result, and the main process spends 15-20 us to load and check it.
+# With 4 and 8 workers it pays off with 1300-1900 references, with 2 workers it saves only a few percent.
+min_parallel_references = 2000
+
+
+def isolated_references(refs, distance=count_before + count_after):
+    """
+    Return a set of the references which have no other ones of refs closer than distance.
+    fix_len() reads and writes the code around the reference, so the fixes of the other references
+    don't change the code read for an isolated one, and it is analysed independently of them.
+    """
+    refs = sorted(refs)
+    isolated = set()
+    for i, ref in enumerate(refs):
+        if (i == 0 or ref - refs[i - 1] >= distance) and (i + 1 == len(refs) or refs[i + 1] - ref >= distance):
+            isolated.add(ref)
+    return isolated
+
+
+def parallel_workers(workers, count, min_count):
+    """
+    Number of the worker processes to handle count items with, 1 if they should be handled serially.
+    With fewer than min_count items the time of starting a pool isn't paid off.
+    """
+    workers = min(workers, os.cpu_count() or 1)
+    if count < min_count:
+        return 1
+    return workers
+
+
+def _fix_len_worker(directory, jobs):
+    """
+    Call fix_len() with each of the arguments of the jobs in a worker process, the writes are only recorded.
+    Return a list of the results and a DisasmCounter of the code disassembled for them.
+    Each result is a pair of the result of fix_len() (a Fix object and a list of writes)
+    and a list of (offset, size, digest) pieces of the data it read (see read_pieces), or None on an error.
+    """
+    global _worker_state
+    if _worker_state is None or _worker_state[0] != directory:
+        with open(os.path.join(directory, 'image'), 'rb') as file:
+            image = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        _worker_state = [directory, image, TraceCache()]
+
+    _, image, trace_cache = _worker_state
+    results = []
+    counter = DisasmCounter()
+    for args in jobs:
+        recorder = RecordingFile(image, passthrough=False, overlay=True)
+        try:
+            fix = fix_len(recorder, *args, trace_cache=trace_cache, counter=counter)
+        except Exception:
+            # The reference will be analysed once more in the main process, where the error is reported
+            results.append(None)
+        else:
+            # The data are digested as they were before the writes of fix_len(), the same way as fix_len_cached() does
+            results.append(((fix, recorder.writes), read_pieces(image, merge_ranges(recorder.reads))))
+    return results, counter
+
+
+def merge_ranges(ranges):
+    """Merge overlapping and adjacent (offset, size) ranges"""
+    merged = []
+    for offset, size in sorted(ranges):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_size = merged[-1]
+            merged[-1] = (last_offset, max(last_size, offset + size - last_offset))
+        else:
+            merged.append((offset, size))
+    return merged
+
+
+class RangeSet:
+    """Set of offsets kept as sorted merged ranges, added and checked by (offset, size) ranges"""
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+
+    def add(self, offset, size):
+        end = offset + size
+        # Ranges which overlap or touch the new one are merged with it
+        first = bisect_left(self._ends, offset)
+        last = bisect_right(self._starts, end)
+        if first < last:
+            offset = min(offset, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        self._starts[first:last] = [offset]
+        self._ends[first:last] = [end]
+
+    def overlaps(self, offset, size):
+        i = bisect_right(self._starts, offset)
+        if i > 0 and self._ends[i - 1] > offset:
+            return True
+        return i < len(self._starts) and self._starts[i] < offset + size
+
+    def overlaps_any(self, ranges):
+        return bool(self._starts) and any(self.overlaps(offset, size) for offset, size in ranges)
+
+
+def analyse_references(image, jobs, workers, counter=None):
+    """
+    Call fix_len() with each of the arguments of the jobs in a pool of worker processes.
+    Workers map the image of the executable read-only, the writes made by fix_len() are only recorded.
+    The code index isn't passed to the workers, as it takes longer to load it than the analysis saves with it.
+
+    Return a dict which maps the reference to a pair of the result (a Fix object and a list of writes)
+    and a list of (offset, size, digest) pieces of the data read by fix_len() (see read_pieces).
+    The references are patched one after another, so the result is valid only if the file still has the same data
+    in these pieces when the reference is fixed (see pieces_unchanged), otherwise fix_len() is called again.
+
+    The code disassembled by the workers is counted with the counter (DisasmCounter) if it is given.
+    """
+    results = dict()
+    chunk_count = workers * 4
+    chunk_size = -(-len(jobs) // chunk_count)
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'image'), 'wb') as file:
+            file.write(image)
+
+        with ProcessPoolExecutor(workers) as executor:
+            for chunk, (chunk_results, chunk_counter) in zip(chunks, executor.map(_fix_len_worker, repeat(directory),
+                                                                                  chunks)):
+                if counter is not None:
+                    counter.add(chunk_counter)
+                for args, result in zip(chunk, chunk_results):
+                    if result is not None:
+                        results[args[0]] = result
+    return results
+
+
+def cached(caches, name, func):
+    """
+    Take the value from one of the caches or calculate it with func() and put it to the caches
+    """
+    caches = [cache for cache in caches if cache is not None]
+    missed = []
+    for cache in caches:
+        if name in cache:
+            value = cache.get(name)
+            break
+        missed.append(cache)
+    else:
+        value = func()
+
+    for cache in missed:
+        cache.set(name, value)
+    return value
+
+
+def get_length(s: bytes, oldlen, original_string_address=None, reg_state=None, dest=None, counter=None):
+    """The disassembled instructions are counted with the counter (DisasmCounter) if it is given"""
     def belongs_to_the_string(ref_value):
         osa = original_string_address
         return osa is None or 0 <= ref_value - osa < oldlen
@@ -581,7 +836,7 @@ def get_length(s: bytes, oldlen, original_string_address=None, reg_state=None, d
 
     nops = dict()
     length = None
-    for line in disasm(s):
+    for line in disasm(s, counter=counter):
         offset = line.address
         assert copied_len <= oldlen
         if copied_len == oldlen:
@@ -687,7 +942,7 @@ def get_length(s: bytes, oldlen, original_string_address=None, reg_state=None, d
                     raise ValueError('Cannot jump: jump destination not included in the passed machinecode.')
 
                 x = get_length(data_after_jump, oldlen - copied_len - 1,
-                               original_string_address, reg_state, dest)
+                               original_string_address, reg_state, dest, counter)
                 dest = x['dest']
                 if 'short' in line.mnemonic:
                     disp = line.data[1] + x['length']
@@ -699,7 +954,7 @@ def get_length(s: bytes, oldlen, original_string_address=None, reg_state=None, d
             else:
                 raise ValueError('Conditional jump encountered at offset 0x%02x' % line.address)
         else:
-            if str(line).startswith('rep'):
+            if line.has_rep_prefix:
                 reg_state[Reg.ecx] = None  # Mark ecx as unoccupied
             if line.mnemonic.startswith('movs'):
                 reg_state[Reg.esi] = None
@@ -764,30 +1019,127 @@ def get_length(s: bytes, oldlen, original_string_address=None, reg_state=None, d
 
 
 def add_to_new_section(fn, new_section_offset, s: bytes, alignment=4, padding_byte=b'\0'):
-    aligned = align(len(s), alignment)
-    s = s.ljust(aligned, padding_byte)
+    # Padded up to an aligned offset, so that a string placed into a tail of another one (see StringPool)
+    # doesn't overwrite the following data
+    end = align(new_section_offset + len(s), alignment)
+    s = s.ljust(end - new_section_offset, padding_byte)
     fpoke(fn, new_section_offset, s)
-    return new_section_offset + aligned
+    return end
+
+
+def analyse_executable(fn, pe, cache, original_codepage='cp437', workers=1):
+    """
+    Put the results of the analysis which don't depend on the dictionary and the target codepage to the cache,
+    so that fix_df_exe() called with this cache for any dictionary doesn't repeat it
+    """
+    image_base = pe.optional_header.image_base
+    sections = pe.section_table
+    caches = [cache]
+    relocs = cached(caches, 'relocation_table', lambda: pe.relocation_table)
+    xref_table = cached(caches, 'xref_table', lambda: get_cross_references(fn, relocs, sections, image_base))
+    cached(caches, 'code_index', lambda: CodeIndex.from_section(fn, sections[code]))
+    cached(caches, 'charmap', lambda: search_charmap(fn, sections, xref_table))
+    workers = parallel_workers(workers, len(xref_table), min_parallel_xrefs)
+    cached(caches, 'strings:' + original_codepage,
+           lambda: list(extract_strings(fn, xref_table, encoding=original_codepage, arrays=True, workers=workers)))
+
+
+def encode_translations(encoder_function, translations):
+    """
+    Encode the translations with a single call of the encoder function.
+    Return None if some of them can't be encoded or some translation is not encoded one byte per character
+    (eg. the encoder normalizes it), then they should be encoded one by one.
+    """
+    if not translations:
+        return []
+
+    if any('\0' in translation for translation in translations):
+        return None
+
+    try:
+        encoded = encoder_function('\0'.join(translations))[0]
+    except UnicodeEncodeError:
+        return None
 
+    # Each piece is checked, a shorter piece may be compensated by a longer one in the total length
+    encoded_translations = encoded.split(b'\0')
+    if len(encoded_translations) != len(translations):
+        return None
 
-def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
+    for translation, encoded_translation in zip(translations, encoded_translations):
+        if len(encoded_translation) != len(translation):
+            return None
+    return encoded_translations
+
+
+def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False, cache=None, manifest=None,
+               workers=1, report=None):
+    """Patch the executable, return a PatchReport with timings and counters of the patching"""
+    if report is None:
+        report = PatchReport()
+
+    report.stage('cross-references')
     print("Finding cross-references...")
 
     image_base = pe.optional_header.image_base
     sections = pe.section_table
 
+    # Results of the analysis can be taken from the manifest of the previous patch or from the analysis cache
+    caches = [manifest, cache]
+
     # Getting addresses of all relocatable entries
-    relocs = set(pe.relocation_table)
+    relocs = cached(caches, 'relocation_table', lambda: pe.relocation_table)
     relocs_to_add = set()
     relocs_to_remove = set()
 
     # Getting cross-references:
-    xref_table = get_cross_references(fn, relocs, sections, image_base)
+    xref_table = cached(caches, 'xref_table', lambda: get_cross_references(fn, relocs, sections, image_base))
+
+    # Instruction boundaries of the code section, used to skip plain instructions while tracing the code
+    def index_code():
+        # Counted only when the index is built, not when it is taken from the caches
+        report.count('code_bytes_indexed', sections[code].physical_size)
+        return CodeIndex.from_section(fn, sections[code])
+
+    report.stage('code index')
+    code_index = cached(caches, 'code_index', index_code)
+
+    # Many references lead to the same code, so the results of code tracing are reused
+    trace_cache = TraceCache()
+
+    # Code actually disassembled while fixing the references, not counting the reused results
+    disasm_counter = DisasmCounter()
+
+    # Strings are extracted before the charmap table is patched, so that they are the same as the ones
+    # put to the cache by analyse_executable()
+    report.stage('extract strings')
+    extract_workers = parallel_workers(workers, len(xref_table), min_parallel_xrefs)
+    if any(cache is not None for cache in caches):
+        # All the strings are kept in the caches, so that they are reused with any dictionary
+        strings = cached(caches, 'strings:' + original_codepage,
+                         lambda: list(extract_strings(fn, xref_table, encoding=original_codepage, arrays=True,
+                                                      workers=extract_workers)))
+    else:
+        # Strings are matched with the dictionary by their bytes, the strings without translations aren't decoded
+        strings = list(extract_strings(fn, xref_table, encoding=original_codepage, arrays=True, workers=extract_workers,
+                                       keys=encode_keys(trans_table, original_codepage)))
+
+    if debug:
+        print("%d strings extracted." % len(strings))
+
+        print("Leaving only strings, which have translations.")
+        strings = [x for x in strings if x[1] in trans_table]
+        print("%d strings remaining." % len(strings))
+        if 0 < len(strings) <= 16:
+            print('All remaining strings:')
+            for meta in strings:
+                print("0x{:x} : {!r}".format(*meta[:2]))
 
     # --------------------------------------------------------
     if codepage:
+        report.stage('charmap')
         print("Searching for charmap table...")
-        needle = search_charmap(fn, sections, xref_table)
+        needle = cached(caches, 'charmap', lambda: search_charmap(fn, sections, xref_table))
 
         if needle is None:
             print("Warning: charmap table not found. Skipping.")
@@ -810,7 +1162,8 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
 
     if last_section.name == b'.new':
         print("There is '.new' section in the file already.")
-        return
+        report.finish()
+        return report
 
     file_alignment = pe.optional_header.file_alignment
     section_alignment = pe.optional_header.section_alignment
@@ -829,22 +1182,13 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
 
     new_section_offset = new_section.physical_offset
 
+    if manifest is not None:
+        # Keep the translations placed by the previous patch, put the new ones after them
+        new_section_offset += manifest.strings_area_size
+
     # --------------------------------------------------------
     print("Translating...")
 
-    strings = list(extract_strings(fn, xref_table, encoding=original_codepage, arrays=True))
-
-    if debug:
-        print("%d strings extracted." % len(strings))
-
-        print("Leaving only strings, which have translations.")
-        strings = [x for x in strings if x[1] in trans_table]
-        print("%d strings remaining." % len(strings))
-        if 0 < len(strings) <= 16:
-            print('All remaining strings:')
-            for meta in strings:
-                print("0x{:x} : {!r}".format(*meta[:2]))
-
     fixes = defaultdict(Fix)
     metadata = OrderedDict()  # type: Dict[Tuple, Fix]
     delayed_pokes = dict()
@@ -859,22 +1203,32 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
         else:
             raise ex
 
-    for off, string, cap_len in strings:
-        if string in trans_table:
-            translation = trans_table[string]
-
-            if string == translation:
-                continue
-
-            if off in xref_table:
-                # Find the earliest reference to the string (even if it is a reference to the middle of the string)
-                refs = find_earliest_midrefs(off, xref_table, len(string))
-            else:
-                refs = []
+    # Place the translations and find the references to fix
+    report.stage('place translations')
+    translations = []
+    string_pool = StringPool()
+    translated = [(off, string, cap_len, trans_table[string]) for off, string, cap_len in strings
+                  if string in trans_table]
+    # Without the caches only these strings are extracted, so the other ones are not counted in any case
+    report.count('strings_matched', len(translated))
+    translated = [item for item in translated if item[1] != item[3]]
+
+    # All the translations are encoded at once if it is possible
+    encoded_translations = encode_translations(encoder_function, [item[3] for item in translated])
+
+    for i, (off, string, cap_len, translation) in enumerate(translated):
+        if off in xref_table:
+            # Find the earliest reference to the string (even if it is a reference to the middle of the string)
+            refs = find_earliest_midrefs(off, xref_table, len(string))
+        else:
+            refs = []
 
-            is_long = cap_len < len(translation) + 1
-            original_string_address = sections.offset_to_rva(off) + image_base
+        is_long = cap_len < len(translation) + 1
+        original_string_address = sections.offset_to_rva(off) + image_base
 
+        if encoded_translations is not None:
+            encoded_translation = encoded_translations[i] + b'\0'
+        else:
             try:
                 encoded_translation = encoder_function(translation)[0] + b'\0'
             except UnicodeEncodeError:
@@ -883,61 +1237,233 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
                       "they will be replaced with ? marks.".format(encoding))
                 print("{!r}: {!r}".format(string, encoded_translation))
 
-            if not is_long or off not in xref_table:
-                # Overwrite the string with the translation in-place
-                fpoke(fn, off, encoded_translation.ljust(cap_len, b'\0'))
-                string_address = original_string_address
-            else:
-                # Add the translation to the separate section
-                str_off = new_section_offset
-                string_address = new_section.offset_to_rva(str_off) + image_base
-                new_section_offset = add_to_new_section(fn, new_section_offset, encoded_translation)
-
-            # Fix string length for each reference
+        if not is_long or off not in xref_table:
+            # The translation will overwrite the string in-place
+            str_off = None
+            string_address = original_string_address
+        else:
+            # The translation will be added to the separate section
+            str_off = None
+            string_address = None
+            if manifest is not None:
+                local_offset = manifest.find_place(off, len(encoded_translation), zlib.crc32(encoded_translation))
+                if local_offset is not None:
+                    # Translation fits into its previous place
+                    str_off = new_section.physical_offset + local_offset
+                    string_address = new_section.offset_to_rva(str_off) + image_base
+
+            if str_off is None:
+                # The place will be taken from the string pool
+                string_pool.add(encoded_translation)
+
+        translations.append((off, string, cap_len, translation, encoded_translation, refs, is_long, str_off,
+                             string_address, original_string_address))
+
+    # Identical translations and translations which are tails of other ones are stored once
+    pool_offsets = string_pool.layout(new_section_offset)
+    new_section_offset += string_pool.size
+    for i, (off, string, cap_len, translation, encoded_translation, refs, is_long, str_off, string_address,
+            original_string_address) in enumerate(translations):
+        if string_address is None:
+            str_off = pool_offsets[encoded_translation]
+            string_address = new_section.offset_to_rva(str_off) + image_base
+            if manifest is not None:
+                checksum = zlib.crc32(encoded_translation) if string_pool.is_shared(encoded_translation) else None
+                manifest.set_place(off, str_off - new_section.physical_offset, len(encoded_translation), checksum)
+
+            translations[i] = (off, string, cap_len, translation, encoded_translation, refs, is_long, str_off,
+                               string_address, original_string_address)
+
+    if debug and string_pool:
+        print("%d translations are added to the new section, %d bytes are taken by them" %
+              (len(string_pool), string_pool.size))
+
+    def fix_len_args(ref, string, translation, string_address, original_string_address):
+        return ref, len(string), len(translation), string_address, original_string_address
+
+    code_offset, code_size = sections[code].physical_offset, sections[code].physical_size
+
+    def in_code(ref):
+        return 0 <= ref - code_offset < code_size
+
+    # The manifest keeps a record of the patching of each string (see PatchManifest).
+    # If the string is translated and placed the same way and the bytes it read then are not changed
+    # by the strings patched differently, the bytes written for it are copied and its fixes are taken from the record.
+    records = dict()
+    changed_ranges = RangeSet()  # Bytes which may differ from the ones the previous patch had at the same point
+    if manifest is not None:
+        if manifest.get('codepages') == [codepage, original_codepage]:
+            for off, *_ in translations:
+                record = manifest.get_string_record(off)
+                if record is not None:
+                    records[off] = record
+
+            # The strings which are not translated anymore don't write their bytes
+            for record in manifest.other_string_records({item[0] for item in translations}):
+                for offset, data in record.writes:
+                    changed_ranges.add(offset, len(data))
+        else:
+            manifest.set('codepages', [codepage, original_codepage])
+
+    def string_state(string, cap_len, translation, encoded_translation, str_off, string_address):
+        return [cap_len, len(string), len(translation), len(encoded_translation), zlib.crc32(encoded_translation),
+                str_off, string_address]
+
+    analysed = dict()
+    # The references are collected only if there may be enough of them for the pool
+    if parallel_workers(workers, sum(len(item[5]) for item in translations), min_parallel_references) > 1:
+        # The isolated references are analysed in parallel with the image as it is before the loop below,
+        # the results which read the data changed by the loop anyway are not used
+        jobs = []
+        code_refs = []
+        for (off, string, cap_len, translation, encoded_translation, refs, is_long, str_off, string_address,
+             original_string_address) in translations:
+            record = records.get(off)
+            # If the record is reused, probably the recorded bytes will be copied (see below)
+            reused = record is not None and record.state == string_state(string, cap_len, translation,
+                                                                         encoded_translation, str_off, string_address)
             for ref in refs:
-                ref_rva = sections.offset_to_rva(ref)
-                if 0 <= (ref - sections[code].physical_offset) < sections[code].physical_size:
-                    try:
-                        fix = fix_len(fn, offset=ref, old_len=len(string), new_len=len(translation),
-                                      string_address=string_address,
-                                      original_string_address=original_string_address)
-                    except Exception:
-                        print('Catched %s exception on string %r at reference 0x%x' %
-                              (sys.exc_info()[0], string, ref_rva + image_base))
-                        raise
-                else:
-                    fix = Fix(meta=Metadata(fixed='not needed'))
+                if in_code(ref):
+                    code_refs.append(ref)
+                    if not reused:
+                        args = fix_len_args(ref, string, translation, string_address, original_string_address)
+                        if cache is None or not cache.has_fix_len_result(args):
+                            jobs.append(args)
+
+        isolated = isolated_references(code_refs)
+        jobs = [args for args in jobs if args[0] in isolated]
+        pool_size = parallel_workers(workers, len(jobs), min_parallel_references)
+        if pool_size > 1:
+            report.stage('parallel analysis')
+            print("Analysing %d references in %d processes..." % (len(jobs), pool_size))
+            fn.seek(0)
+            image = fn.read()
+            analysed = analyse_references(image, jobs, pool_size, counter=disasm_counter)
+
+    # Only the references from the code are fixed, so their rvas are got without looking for the section
+    code_rva_delta = sections[code].rva - sections[code].physical_offset
+
+    def keep_fix(string, ref, fix):
+        """
+        Keep the fix of the reference from the code for the hooks, the relocations and the delayed pokes.
+        Return True if the reference itself must be pointed to the translation.
+        """
+        meta = fix.meta
+        if meta.str == 'cmp reg':
+            # This is probably a bound of an array, not a string reference
+            return False
 
-                meta = fix.meta
-                if meta.str == 'cmp reg':
-                    # This is probably a bound of an array, not a string reference
-                    continue
-                elif 'new_code' in fix:
-                    new_code = fix['new_code']
-                    assert isinstance(new_code, (bytes, bytearray, MachineCode))
-                    src_off = fix['src_off']
+        ref_rva = ref + code_rva_delta
+        if 'new_code' in fix:
+            new_code = fix['new_code']
+            assert isinstance(new_code, (bytes, bytearray, MachineCode))
+            src_off = fix['src_off']
 
-                    fixes[src_off].add_fix(fix)
-                else:
-                    if 'added_relocs' in fix:
-                        # Add relocations of new references of moved items
-                        relocs_to_add.update(item + ref_rva for item in fix['added_relocs'])
+            fixes[src_off].add_fix(fix)
+        else:
+            if 'fix' in fix:
+                # A procedure to be written to the new section
+                fixes[fix['fix'].src_off].add_fix(fix['fix'])
 
-                    if 'pokes' in fix:
-                        delayed_pokes.update({off + ref: val for off, val in fix['pokes'].items()})
+            if 'added_relocs' in fix:
+                # Add relocations of new references of moved items
+                relocs_to_add.update(item + ref_rva for item in fix['added_relocs'])
+
+            if 'pokes' in fix:
+                delayed_pokes.update({off + ref: val for off, val in fix['pokes'].items()})
+
+        metadata[(string, ref_rva + image_base)] = fix
+
+        # Remove relocations of the overwritten references
+        if 'deleted_relocs' in fix and fix['deleted_relocs']:
+            relocs_to_remove.update(item + ref_rva for item in fix['deleted_relocs'])
+            return False
+        return True
+
+    report.stage('fix references')
+    report.count('strings_translated', len(translations))
+    data_references = 0  # Their length needs no fixing, so they are not kept in metadata
+    copied_writes = []  # The bytes of the reused records are written at once before the next string is patched
+    for (off, string, cap_len, translation, encoded_translation, refs, is_long, str_off, string_address,
+         original_string_address) in translations:
+        report.count('references', len(refs))
+        file = fn
+        if manifest is not None:
+            state = string_state(string, cap_len, translation, encoded_translation, str_off, string_address)
+            record = records.get(off)
+            if record is not None and record.state == state and not changed_ranges.overlaps_any(record.reads):
+                # The string is patched the same way as before, its references are not walked
+                report.count('strings_reused')
+                copied_writes.extend(record.writes)
+                for ref, fix in record.fixes:
+                    keep_fix(string, ref, fix)
+                data_references += len(refs) - len(record.fixes)
+                continue
+
+            apply_writes_at_once(fn, copied_writes)
+            copied_writes = []
 
-                # Remove relocations of the overwritten references
-                if 'deleted_relocs' in fix and fix['deleted_relocs']:
-                    relocs_to_remove.update(item + ref_rva for item in fix['deleted_relocs'])
-                elif is_long and string_address:
-                    fpoke4(fn, ref, string_address)
+            # All the data written and read while the string is patched are recorded
+            file = RecordingFile(fn)
+            code_fixes = []
 
-                metadata[(string, ref_rva + image_base)] = fix
+        if str_off is None:
+            # Overwrite the string with the translation in-place
+            fpoke(file, off, encoded_translation.ljust(cap_len, b'\0'))
+        else:
+            # Add the translation to the separate section
+            add_to_new_section(file, str_off, encoded_translation)
+
+        # Fix string length for each reference
+        for ref in refs:
+            if in_code(ref):
+                args = fix_len_args(ref, string, translation, string_address, original_string_address)
+
+                # A result of the parallel analysis is valid only if the data it depends on
+                # weren't changed by the fixes of the previous references
+                analysis = analysed.pop(ref, None)
+                if analysis is not None and not pieces_unchanged(file, analysis[1]):
+                    analysis = None
+
+                report.count('references_analysed')
+                try:
+                    fix = fix_len_cached(file, [cache], *args, code_index=code_index, trace_cache=trace_cache,
+                                         analysed=analysis, counter=disasm_counter)
+                except Exception:
+                    print('Catched %s exception on string %r at reference 0x%x' %
+                          (sys.exc_info()[0], string, sections.offset_to_rva(ref) + image_base))
+                    raise
+
+                if manifest is not None:
+                    code_fixes.append((ref, manifest.fix_row(fix)))
+
+                if not keep_fix(string, ref, fix):
+                    continue
+            else:
+                data_references += 1
+
+            if is_long and string_address:
+                fpoke4(file, ref, string_address)
+
+        if manifest is not None:
+            manifest.set_string_record(off, state, file.writes, merge_ranges(file.reads), code_fixes)
+            if records and (record is None or record.state != state or record.writes != file.writes):
+                # The following strings which read these bytes must be patched again
+                for offset, data in (record.writes if record is not None else []) + file.writes:
+                    changed_ranges.add(offset, len(data))
+
+    apply_writes_at_once(fn, copied_writes)
 
     for offset, b in delayed_pokes.items():
         # print(hex(offset), b)
         fpoke(fn, offset, b)
 
+    report.count('code_bytes_disassembled', disasm_counter.bytes)
+
+    if debug:
+        trace_cache_info = trace_cache.info()
+        print('Code traces: %d reused, %d traced' % (trace_cache_info.hits, trace_cache_info.misses))
+
     # Extract information of functions parameters
     functions = defaultdict(Metadata)
     for fix in metadata.values():
@@ -1014,41 +1540,50 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
         for ref, (string, meta) in sorted(status_unknown.items(), key=lambda x: x[0]):
             print('Status unknown: %s (reference from 0x%x)' % (myrepr(string), ref), meta)
 
+    report.fix_len_outcomes['not needed'] += data_references
+    for fix in metadata.values():
+        report.fix_len_outcomes[fix.meta.fixed or 'unknown'] += 1
+        if fix.meta.fixed == 'no' and fix.meta.cause:
+            report.not_fixed_causes[fix.meta.cause] += 1
+
     # Delayed fix
+    report.stage('hooks')
+    hook_linker = HookLinker(fn, new_section_offset, new_section.offset_to_rva)
     for fix in fixes.values():
         src_off = fix['src_off']
         mach = fix['new_code']
 
-        hook_rva = new_section.offset_to_rva(new_section_offset)
-
         dest_off = mach.fields.get('dest', None) if isinstance(mach, MachineCode) else fix.get('dest_off', None)
 
         if isinstance(mach, MachineCode):
             for field, value in mach.fields.items():
                 if value is not None:
                     mach.fields[field] = sections[code].offset_to_rva(value)
-            mach.origin_address = hook_rva
 
-        if dest_off is not None:
-            dest_rva = sections[code].offset_to_rva(dest_off)
+        dest_rva = sections[code].offset_to_rva(dest_off) if dest_off is not None else None
+
+        def build_hook(hook_rva, mach=mach, fix=fix, dest_rva=dest_rva):
             if isinstance(mach, MachineCode):
-                mach.fields['dest'] = dest_rva
-            else:
+                mach.origin_address = hook_rva
+                if dest_rva is not None:
+                    mach.fields['dest'] = dest_rva
+            elif dest_rva is not None:
                 disp = dest_rva - (hook_rva + len(mach) + 5)  # 5 is a size of jmp near + displacement
                 # Add jump from the hook
-                mach += bytes((jmp_near,)) + to_dword(disp, signed=True)
+                mach = mach + bytes((jmp_near,)) + to_dword(disp, signed=True)
 
-        # Write the hook to the new section
-        new_section_offset = add_to_new_section(fn, new_section_offset, bytes(mach), padding_byte=int3)
+            # If there are absolute references in the code, add them to relocation table
+            new_refs = set()
+            if 'added_relocs' in fix or isinstance(mach, MachineCode) and list(mach.absolute_references):
+                new_refs = set(mach.absolute_references) if isinstance(mach, MachineCode) else set()
 
-        # If there are absolute references in the code, add them to relocation table
-        if 'added_relocs' in fix or isinstance(mach, MachineCode) and list(mach.absolute_references):
-            new_refs = set(mach.absolute_references) if isinstance(mach, MachineCode) else set()
+                if 'added_relocs' in fix:
+                    new_refs.update(fix['added_relocs'])
 
-            if 'added_relocs' in fix:
-                new_refs.update(fix['added_relocs'])
+            return bytes(mach), new_refs
 
-            relocs_to_add.update(hook_rva + item for item in new_refs)
+        # Write the hook to the new section, identical hooks are written once
+        hook_rva = hook_linker.link(build_hook)
 
         if 'pokes' in fix:
             for off, b in fix['pokes'].items():
@@ -1058,22 +1593,32 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
         disp = hook_rva - (src_rva + 4)  # 4 is a size of a displacement itself
         fpoke(fn, src_off, to_dword(disp, signed=True))
 
+    new_section_offset = hook_linker.offset
+    relocs_to_add.update(hook_linker.relocations)
+    report.count('hooks', hook_linker.linked)
+    report.count('hooks_shared', hook_linker.shared)
+
+    if debug and fixes:
+        print("%d hooks are written, %d patched places share them" % (hook_linker.linked, hook_linker.shared))
+
     # Write relocation table to the executable
+    report.stage('relocations')
+    report.count('relocations_added', len(relocs_to_add))
+    report.count('relocations_removed', len(relocs_to_remove))
     if relocs_to_add or relocs_to_remove:
-        if relocs_to_remove - relocs:
+        missing_relocs = [item for item in relocs_to_remove if item not in relocs]
+        if missing_relocs:
             warn("Trying to remove some relocations which weren't in the original list: " +
-                 int_list_to_hex_str(item + image_base for item in (relocs_to_remove - relocs)))
+                 int_list_to_hex_str(item + image_base for item in missing_relocs))
 
-        relocs -= relocs_to_remove
-        relocs |= relocs_to_add
+        relocs = relocs.updated(added=relocs_to_add, removed=relocs_to_remove)
         if debug:
             print("\nRemoved relocations:")
             print("[%s]" % '\n'.join(textwrap.wrap(int_list_to_hex_str(relocs_to_remove), 80)))
             print("\nAdded relocations:")
             print("[%s]" % '\n'.join(textwrap.wrap(int_list_to_hex_str(relocs_to_add), 80)))
 
-        reloc_table = RelocationTable.build(relocs)
-        new_size = reloc_table.size
+        new_size = relocs.size
         data_directory = pe.data_directory
         relocation_table_offset = sections.rva_to_offset(data_directory.basereloc.virtual_address)
         relocation_table_size = data_directory.basereloc.size
@@ -1081,7 +1626,7 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
 
         if new_size <= relocation_section.physical_size:
             fn.seek(relocation_table_offset)
-            reloc_table.to_file(fn)
+            relocs.to_file(fn)
 
             if new_size < relocation_table_size:
                 # Clear empty bytes after the relocation table
@@ -1094,7 +1639,7 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
         else:
             # Write relocation table to the new section
             with io.BytesIO() as buffer:
-                reloc_table.to_file(buffer)
+                relocs.to_file(buffer)
 
                 data_directory.basereloc.size = new_size
                 data_directory.basereloc.virtual_address = new_section.offset_to_rva(new_section_offset)
@@ -1102,6 +1647,8 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
                 new_section_offset = add_to_new_section(fn, new_section_offset, buffer.getvalue())
 
     # Add new section to the executable
+    report.stage('new section')
+    report.count('new_section_bytes', new_section_offset - new_section.physical_offset)
     if new_section_offset > new_section.physical_offset:
         file_size = align(new_section_offset, file_alignment)
         new_section.physical_size = file_size - new_section.physical_offset
@@ -1129,11 +1676,17 @@ def fix_df_exe(fn, pe, codepage, original_codepage, trans_table, debug=False):
         pe.optional_header.rewrite()
 
     # Check if the patched file is not broken
+    report.stage('final check')
     print("Final check...")
     pe.reread()
-    assert set(pe.relocation_table) == relocs, "Error: relocation table is broken"
+    assert pe.relocation_table == relocs, "Error: relocation table is broken"
+    report.finish()
+
+    if debug:
+        print(report)
 
     print('Done.')
+    return report
 
 
 def int_list_to_hex_str(s):
@@ -1,10 +1,12 @@
 #! python3
+import mmap
 import struct
 import bisect
+from contextlib import contextmanager
 from typing import Iterable
 from collections import OrderedDict
 from array import array
-from itertools import zip_longest
+from itertools import zip_longest, repeat, chain
 
 from .disasm import align
 
@@ -28,6 +30,7 @@ class Structure:
             self._raw = None
             self._offset = None
             self._file = None
+            self._buffer = None
             self._items = OrderedDict(zip(self._field_names, args))
         elif len(kwargs) > 0:
             assert all(field in kwargs for field in self._field_names)
@@ -35,6 +38,7 @@ class Structure:
             self._raw = None
             self._offset = None
             self._file = None
+            self._buffer = None
             self._items = OrderedDict(zip(self._field_names, (kwargs[key] for key in self._field_names)))
 
     @classmethod
@@ -56,6 +60,14 @@ class Structure:
         new_obj._offset = offset
         return new_obj
 
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        """Unpack the structure directly from a buffer (eg. mmap object) without copying it"""
+        new_obj = cls(*cls._struct.unpack_from(buffer, offset))
+        new_obj._buffer = buffer
+        new_obj._offset = offset
+        return new_obj
+
     def __getattr__(self, attr):
         if attr.startswith('_'):
             return super().__getattribute__(attr)
@@ -88,6 +100,9 @@ class Structure:
     def rewrite(self):
         if self._file is not None and self._offset is not None:
             self.write(self._file, self._offset)
+        elif self._buffer is not None and self._offset is not None:
+            raw = bytes(self)
+            self._buffer[self._offset:self._offset + len(raw)] = raw
         else:
             raise ValueError('The structure was not read from a file')
 
@@ -191,6 +206,16 @@ class DataDirectory(Structure):
         obj._offset = offset
         return obj
 
+    @classmethod
+    def from_buffer(cls, buffer, offset=0):
+        entry_size = DataDirectoryEntry.sizeof()
+        entries = [DataDirectoryEntry(*DataDirectoryEntry._struct.unpack_from(buffer, offset + i * entry_size))
+                   for i in range(cls._number_of_directory_entries - 1)]
+        obj = cls(*entries)
+        obj._buffer = buffer
+        obj._offset = offset
+        return obj
+
     def __bytes__(self):
         return bytes(b''.join(bytes(self._items[field]) for field in self._field_names) +
                      bytes(DataDirectoryEntry.sizeof()))
@@ -240,6 +265,21 @@ class ImageNTHeaders:
         self.optional_header = ImageOptionalHeader.read(file)
         self.data_directory = DataDirectory.read(file)
 
+    @classmethod
+    def from_buffer(cls, buffer, offset):
+        obj = cls.__new__(cls)
+        obj.offset = offset
+        obj.signature = bytes(buffer[offset:offset + cls._size_of_signature])
+        if obj.signature != b'PE\0\0':
+            raise ValueError('IMAGE_NT_HEADERS wrong signature: %r' % obj.signature)
+        offset += cls._size_of_signature
+        obj.file_header = ImageFileHeader.from_buffer(buffer, offset)
+        offset += ImageFileHeader.sizeof()
+        obj.optional_header = ImageOptionalHeader.from_buffer(buffer, offset)
+        offset += ImageOptionalHeader.sizeof()
+        obj.data_directory = DataDirectory.from_buffer(buffer, offset)
+        return obj
+
 
 class Section(Structure):
     IMAGE_SCN_CNT_CODE = 0x00000020
@@ -331,6 +371,10 @@ class SectionTable(list):
         file.seek(offset)
         return cls([Section.read(file) for _ in range(number)])
 
+    @classmethod
+    def from_buffer(cls, buffer, offset, number):
+        return cls([Section.from_buffer(buffer, offset + i * Section.sizeof()) for i in range(number)])
+
     def write(self, file, offset=None):
         if offset is not None:
             file.seek(offset)
@@ -367,29 +411,72 @@ class SectionTable(list):
 
 
 class RelocationTable:
+    """
+    Relocations of the executable (only IMAGE_REL_BASED_HIGHLOW entries) kept as a sorted array of their RVAs
+    """
+
     IMAGE_REL_BASED_ABSOLUTE = 0
     IMAGE_REL_BASED_HIGHLOW = 3
 
-    def __init__(self, table: dict):
-        if not isinstance(table, dict):
+    def __init__(self, relocs: array):
+        if not isinstance(relocs, array):
             raise ValueError
-        self._table = table
+        self._relocs = relocs
 
     def __iter__(self):
-        for page, records in self._table.items():
-            for record in records:
-                yield page | (record & 0x0FFF)
+        return iter(self._relocs)
+
+    def __len__(self):
+        return len(self._relocs)
+
+    def __contains__(self, item):
+        i = bisect.bisect_left(self._relocs, item)
+        return i < len(self._relocs) and self._relocs[i] == item
+
+    def __eq__(self, other):
+        if isinstance(other, RelocationTable):
+            return self._relocs == other._relocs
+        return NotImplemented
 
     @classmethod
     def build(cls, relocs: Iterable):
-        reloc_table = dict()
-        for item in relocs:
-            page = item & 0xFFFFF000
-            offset = item & 0x00000FFF
-            if page not in reloc_table:
-                reloc_table[page] = []
-            bisect.insort(reloc_table[page], offset)
-        return cls(reloc_table)
+        return cls(array('I', sorted(set(relocs))))
+
+    def _pages(self):
+        """Yield (page, start, end) for each page, start and end are bounds of the page relocations in the array"""
+        relocs = self._relocs
+        start = 0
+        while start < len(relocs):
+            page = relocs[start] & 0xFFFFF000
+            end = bisect.bisect_left(relocs, page + 0x1000, start)
+            yield page, start, end
+            start = end
+
+    def updated(self, added=(), removed=()):
+        """
+        Return a new table with the added relocations and without the removed ones.
+        The array is copied by slices between the changed positions, instead of building it from scratch.
+        """
+        relocs = self._relocs
+        removed = set(removed).difference(added)
+        positions = sorted(i for i in map(bisect.bisect_left, repeat(relocs), removed)
+                           if i < len(relocs) and relocs[i] in removed)
+        kept = array('I')
+        start = 0
+        for i in positions:
+            kept += relocs[start:i]
+            start = i + 1
+        kept += relocs[start:]
+
+        result = array('I')
+        start = 0
+        for item in sorted(item for item in set(added) if item not in self):
+            i = bisect.bisect_left(kept, item, start)
+            result += kept[start:i]
+            result.append(item)
+            start = i
+        result += kept[start:]
+        return type(self)(result)
 
     @staticmethod
     def iter_read(file, reloc_size):
@@ -404,24 +491,91 @@ class RelocationTable:
             yield cur_page, [x for x in relocs if x >> 12 == RelocationTable.IMAGE_REL_BASED_HIGHLOW]
             cur_off += block_size
 
+    @staticmethod
+    def iter_blocks_buffer(buffer, offset, reloc_size):
+        """
+        Yield arrays of RVAs of the relocations of each block of the relocation table data in the buffer.
+        Types of the records are checked and the RVAs are made in batch with bytes operations,
+        only blocks with records of other types than padding are filtered one record at a time.
+        """
+        cur_off = 0
+        while cur_off < reloc_size:
+            cur_page, block_size = struct.unpack_from('<2I', buffer, offset + cur_off)
+            assert (block_size > 8), block_size
+            assert ((block_size - 8) % 2 == 0)
+            start = offset + cur_off + 8
+            records = bytes(buffer[start:start + block_size - 8])
+            end = len(records)
+            while end and records[end - 2:end] == b'\0\0':
+                end -= 2  # Padding records
+
+            high_bytes = records[1:end:2]
+            if not high_bytes.translate(None, _highlow_high_bytes):
+                # Build little-endian dwords: the low byte of the record, its high byte with the type replaced
+                # with the bits of the page number, and two high bytes of the page
+                count = end // 2
+                relocs = bytearray(count * 4)
+                relocs[0::4] = records[0:end:2]
+                relocs[1::4] = high_bytes.translate(_page_nibble_tables[cur_page >> 12 & 0xF])
+                relocs[2::4] = bytes((cur_page >> 16 & 0xFF,)) * count
+                relocs[3::4] = bytes((cur_page >> 24,)) * count
+                yield array('I', relocs)
+            else:
+                words = array('H', records)
+                yield array('I', map(cur_page.__or__, map((0x0FFF).__and__, filter(_is_highlow_record, words))))
+
+            cur_off += block_size
+
+    @staticmethod
+    def iter_relocs_buffer(buffer, offset, reloc_size):
+        """Yield RVAs of the relocations from the relocation table data in the buffer"""
+        return chain.from_iterable(RelocationTable.iter_blocks_buffer(buffer, offset, reloc_size))
+
+    @staticmethod
+    def iter_relocs(file, reloc_size):
+        """Yield RVAs of the relocations from the relocation table, which is read from the file at once"""
+        return RelocationTable.iter_relocs_buffer(file.read(reloc_size), 0, reloc_size)
+
+    @classmethod
+    def from_buffer(cls, buffer, offset, reloc_size):
+        relocs = array('I')
+        for block in cls.iter_blocks_buffer(buffer, offset, reloc_size):
+            relocs += block
+
+        # Blocks are usually in order already, then sorting takes a single pass
+        return cls(array('I', sorted(relocs)))
+
     @classmethod
     def from_file(cls, file, reloc_size):
-        return cls(dict(cls.iter_read(file, reloc_size)))
+        return cls.from_buffer(file.read(reloc_size), 0, reloc_size)
 
     @property
     def size(self):
-        words = sum(align(len(val), 2) for val in self._table.values())
-        return len(self._table) * 8 + words * 2
+        pages = 0
+        words = 0
+        for _, start, end in self._pages():
+            pages += 1
+            words += align(end - start, 2)
+        return pages * 8 + words * 2
 
     def to_file(self, file):
-        for page in sorted(self._table):
-            records = [item | RelocationTable.IMAGE_REL_BASED_HIGHLOW << 12 for item in self._table[page]]
+        for page, start, end in self._pages():
+            records = array('H', [item & 0x0FFF | RelocationTable.IMAGE_REL_BASED_HIGHLOW << 12
+                                  for item in self._relocs[start:end]])
             # Padding records:
             if len(records) % 2 == 1:
                 records.append(RelocationTable.IMAGE_REL_BASED_ABSOLUTE << 12 | 0)
             block_size = 8 + 2 * len(records)  # 2 dwords + N words
             array('I', [page, block_size]).tofile(file)
-            array('H', records).tofile(file)
+            records.tofile(file)
+
+
+_highlow_high_bytes = bytes(range(RelocationTable.IMAGE_REL_BASED_HIGHLOW << 4,
+                                  (RelocationTable.IMAGE_REL_BASED_HIGHLOW + 1) << 4))  # High bytes of the records
+_is_highlow_record = range(RelocationTable.IMAGE_REL_BASED_HIGHLOW << 12,
+                           (RelocationTable.IMAGE_REL_BASED_HIGHLOW + 1) << 12).__contains__
+# For each value of the lowest nibble of the page number, a table which replaces the type in the high byte of a record
+_page_nibble_tables = [bytes(nibble << 4 | byte & 0x0F for byte in range(0x100)) for nibble in range(0x10)]
 
 
 class PortableExecutable:
@@ -472,6 +626,54 @@ class PortableExecutable:
         )
 
 
+class MappedPortableExecutable(PortableExecutable):
+    """
+    PortableExecutable which parses the headers, the section table and the relocation table
+    directly from a buffer (mmap object, bytes, bytearray, memoryview) without file operations.
+    Changed headers are written back to the buffer with rewrite() if the buffer is writable.
+    """
+
+    def __init__(self, buffer):
+        self.file = None
+        self.buffer = buffer
+        self.dos_header = ImageDosHeader.from_buffer(buffer, 0)
+        assert self.dos_header.sizeof() == 0x40
+        self.nt_headers = ImageNTHeaders.from_buffer(buffer, self.dos_header.e_lfanew)
+        self.file_header = self.nt_headers.file_header
+        self.optional_header = self.nt_headers.optional_header
+        self.data_directory = self.nt_headers.data_directory
+        self._section_table = None
+        self._relocation_table = None
+
+    @property
+    def section_table(self):
+        if self._section_table is None:
+            n = self.file_header.number_of_sections
+            offset = self.nt_headers.offset + self.nt_headers.sizeof()
+            self._section_table = SectionTable.from_buffer(self.buffer, offset, n)
+        return self._section_table
+
+    @property
+    def relocation_table(self):
+        if self._relocation_table is None:
+            rva = self.data_directory.basereloc.virtual_address
+            offset = self.section_table.rva_to_offset(rva)
+            size = self.data_directory.basereloc.size
+            self._relocation_table = RelocationTable.from_buffer(self.buffer, offset, size)
+        return self._relocation_table
+
+    def reread(self):
+        self.__init__(self.buffer)
+
+
+@contextmanager
+def mapped_portable_executable(path, writable=False):
+    """Memory-map the file and parse it as a portable executable"""
+    with open(path, 'r+b' if writable else 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ) as buffer:
+            yield MappedPortableExecutable(buffer)
+
+
 def main():
     with open(r"d:\Games\df_40_24_win_s\Dwarf Fortress.exe", 'rb') as file:
         pe = PortableExecutable(file)
@@ -0,0 +1,53 @@
+import cProfile
+import os
+import pstats
+
+# Functions of dfrus where most of the time of patching is spent
+hot_functions = [
+    'get_cross_references',
+    'extract_strings',
+    'check_string',
+    'check_string_array',
+    'fix_len',
+    'get_length',
+    'trace_code',
+    'which_func',
+    'disasm',
+    'analyse_modrm',
+]
+
+_package_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def profile_call(func, *args, **kwargs):
+    """Call the function under cProfile, return a pair of its result and the pstats.Stats of the call"""
+    profile = cProfile.Profile()
+    result = profile.runcall(func, *args, **kwargs)
+    return result, pstats.Stats(profile)
+
+
+def hot_functions_stats(stats: pstats.Stats, functions=hot_functions):
+    """
+    Collect (number of calls, own time, cumulative time) of the dfrus functions with the given names.
+    Functions which weren't called are included with zeros.
+    For generators (eg. disasm) each resumption is counted as a call.
+    """
+    collected = {name: [0, 0.0, 0.0] for name in functions}
+    for (filename, _, name), (_, calls, own_time, cumulative_time, _) in stats.stats.items():
+        if name in collected and os.path.dirname(os.path.abspath(filename)) == _package_directory:
+            item = collected[name]
+            item[0] += calls
+            item[1] += own_time
+            item[2] += cumulative_time
+    return [(name,) + tuple(collected[name]) for name in functions]
+
+
+def write_hot_functions_report(stats: pstats.Stats, file, functions=hot_functions):
+    """
+    Write the stats of the hot functions in a fixed order, one function per line,
+    so that the reports of different runs can be compared line by line
+    """
+    print('# dfrus profile: function, calls, own time (s), cumulative time (s)', file=file)
+    for name, calls, own_time, cumulative_time in hot_functions_stats(stats, functions):
+        print('%-24s %10d %10.3f %10.3f' % (name, calls, own_time, cumulative_time), file=file)
+    print('%-24s %10d %10s %10.3f' % ('total', stats.total_calls, '', stats.total_tt), file=file)
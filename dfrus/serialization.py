@@ -0,0 +1,142 @@
+"""
+Conversion of analysis results to JSON-compatible values and back.
+
+Unlike unpickling, loading the data can't execute code: besides the plain JSON types only bytes, tuples,
+sets, dicts with any keys, arrays and objects of the listed dfrus classes are restored,
+the objects are restored from their attributes without calling their constructors.
+"""
+import sys
+
+from array import array
+from base64 import b64decode, b64encode
+from collections import defaultdict
+from importlib import import_module
+
+# Classes which objects can be stored: name -> module
+_classes = {
+    'Fix': '.patchdf',
+    'Metadata': '.patchdf',
+    'MachineCode': '.machine_code',
+    'Reference': '.machine_code',
+    'CodeIndex': '.code_index',
+    'RelocationTable': '.peclasses',
+}
+
+_loaded_classes = dict()
+
+
+def _get_class(name):
+    cls = _loaded_classes.get(name)
+    if cls is None:
+        if name not in _classes:
+            raise ValueError('Objects of %r class are not allowed' % name)
+        cls = getattr(import_module(_classes[name], __package__), name)
+        _loaded_classes[name] = cls
+    return cls
+
+
+def _little_endian_bytes(items: array):
+    if sys.byteorder != 'little':
+        items = array(items.typecode, items)
+        items.byteswap()
+    return items.tobytes()
+
+
+def _bytes_to_str(data):
+    return b64encode(data).decode('ascii')
+
+
+_plain_types = {type(None), bool, int, str, float}
+
+
+def _encode_item(item):
+    # Plain values are returned as is without the call of encode()
+    return item if type(item) in _plain_types else encode(item)
+
+
+def encode(value):
+    """
+    Convert the value to a JSON-compatible value.
+    Values of other types than plain JSON ones are converted to single-key objects, eg. {"bytes": "..."}.
+    """
+    if value is None or isinstance(value, (bool, str, float)):
+        return value
+    elif isinstance(value, int):
+        return int(value)  # int subclasses (eg. IntEnum) are stored as plain integers
+    elif isinstance(value, list):
+        return [item if type(item) in _plain_types else encode(item) for item in value]
+    elif isinstance(value, tuple):
+        return {'tuple': [item if type(item) in _plain_types else encode(item) for item in value]}
+    elif isinstance(value, (set, frozenset)):
+        return {'set': [item if type(item) in _plain_types else encode(item) for item in value]}
+    elif isinstance(value, bytes):
+        return {'bytes': _bytes_to_str(value)}
+    elif isinstance(value, bytearray):
+        return {'bytearray': _bytes_to_str(value)}
+    elif isinstance(value, array):
+        return {'array': [value.typecode, _bytes_to_str(_little_endian_bytes(value))]}
+    elif isinstance(value, defaultdict) and value.default_factory is list:
+        return {'defaultdict': [[_encode_item(key), _encode_item(item)] for key, item in value.items()]}
+    elif type(value) is dict:
+        return {'dict': [[_encode_item(key), _encode_item(item)] for key, item in value.items()]}
+
+    name = type(value).__name__
+    if name not in _classes or _get_class(name) is not type(value):
+        raise TypeError("Can't store %r object" % name)
+
+    if '__getstate__' in vars(type(value)):
+        return {'state': [name, encode(value.__getstate__())]}
+    else:
+        return {'object': [name, {key: encode(item) for key, item in vars(value).items()}]}
+
+
+def _decode_item(item):
+    # Plain values are returned as is without the call of decode()
+    return decode(item) if isinstance(item, (list, dict)) else item
+
+
+def decode(value):
+    """Restore the value converted with encode(), a new object is made each time"""
+    if isinstance(value, list):
+        return [decode(item) if isinstance(item, (list, dict)) else item for item in value]
+    elif not isinstance(value, dict):
+        return value
+
+    if len(value) != 1:
+        raise ValueError('Unexpected object: %r' % value)
+
+    (kind, data), = value.items()
+    if kind == 'tuple':
+        return tuple(decode(item) if isinstance(item, (list, dict)) else item for item in data)
+    elif kind == 'set':
+        return set(decode(item) if isinstance(item, (list, dict)) else item for item in data)
+    elif kind == 'bytes':
+        return b64decode(data)
+    elif kind == 'bytearray':
+        return bytearray(b64decode(data))
+    elif kind == 'array':
+        typecode, data = data
+        items = array(typecode, b64decode(data))
+        if sys.byteorder != 'little':
+            items.byteswap()
+        return items
+    elif kind == 'defaultdict':
+        return defaultdict(list, ((_decode_item(key), _decode_item(item)) for key, item in data))
+    elif kind == 'dict':
+        return {_decode_item(key): _decode_item(item) for key, item in data}
+    elif kind == 'object':
+        name, attributes = data
+        cls = _get_class(name)
+        obj = cls.__new__(cls)
+        obj.__dict__.update((key, decode(item)) for key, item in attributes.items())
+        return obj
+    elif kind == 'state':
+        name, state = data
+        cls = _get_class(name)
+        if '__setstate__' not in vars(cls):
+            raise ValueError('Objects of %r class are not restored from a state' % name)
+        obj = cls.__new__(cls)
+        obj.__setstate__(decode(state))
+        return obj
+    else:
+        raise ValueError('Unexpected object: %r' % value)
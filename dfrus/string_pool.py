@@ -0,0 +1,65 @@
+from collections import Counter, OrderedDict
+
+from .disasm import align
+
+
+class StringPool:
+    """
+    Pool of NUL-terminated strings which are laid out together.
+
+    Identical strings are stored once, and a string which is a tail of another string
+    (eg. b'cat\\0' of b'concat\\0') is stored as a part of that string.
+    Each stored string starts at an aligned offset, tails merged into it may be not aligned.
+    """
+
+    def __init__(self, alignment=4):
+        self.alignment = alignment
+        self._counts = OrderedDict()  # string -> number of additions, in order of the first addition
+        self._hosts = None
+        self._users = None
+        self.size = 0
+
+    def add(self, s: bytes):
+        assert s.endswith(b'\0'), 'Only NUL-terminated strings can be merged'
+        self._counts[s] = self._counts.get(s, 0) + 1
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _merge_tails(self):
+        """Map each string to the string which contains it as a tail (or to itself)"""
+        hosts = dict()
+        # In the reverse lexicographical order of reversed strings,
+        # a string which is a tail of other strings goes right after one of them
+        previous = None
+        for reversed_string in sorted((s[::-1] for s in self._counts), reverse=True):
+            s = reversed_string[::-1]
+            if previous is not None and previous.startswith(reversed_string):
+                hosts[s] = hosts[previous[::-1]]
+            else:
+                hosts[s] = s
+            previous = reversed_string
+        return hosts
+
+    def layout(self, start_offset):
+        """Place the strings from the start_offset, return a dict which maps each string to its offset"""
+        hosts = self._merge_tails()
+        host_offsets = dict()
+        offset = start_offset
+        for s in self._counts:
+            host = hosts[s]
+            if host not in host_offsets:
+                host_offsets[host] = offset
+                offset = align(offset + len(host), self.alignment)
+
+        self._hosts = hosts
+        self._users = Counter()  # host string -> number of additions of strings placed in it
+        for s, count in self._counts.items():
+            self._users[hosts[s]] += count
+
+        self.size = offset - start_offset
+        return OrderedDict((s, host_offsets[hosts[s]] + len(hosts[s]) - len(s)) for s in self._counts)
+
+    def is_shared(self, s):
+        """Check if the bytes of the string are used by other added strings too (after layout())"""
+        return self._users[self._hosts[s]] > 1
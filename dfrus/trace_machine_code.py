@@ -1,4 +1,6 @@
+from collections import namedtuple, OrderedDict
 from contextlib import suppress
+from functools import lru_cache
 
 from dfrus.binio import read_bytes
 from dfrus.disasm import disasm
@@ -13,10 +15,107 @@ class Trace:
     forward_only = 3
 
 
-def trace_code(fn, offset, stop_cond, trace_jmp=Trace.follow, trace_jcc=Trace.forward_only, trace_call=Trace.stop):
+TraceCacheInfo = namedtuple('TraceCacheInfo', 'hits misses maxsize currsize')
+
+
+class TraceCache:
+    """
+    Bounded cache of trace_code() results, keyed by the offset, the stop condition and the trace policy.
+    The least recently used results are dropped when there are more than maxsize of them.
+
+    The code can be patched between the calls, so a result is reused only if the code read while tracing
+    (including the code at the followed jumps) is unchanged.
+    """
+
+    def __init__(self, maxsize=0x4000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def get(self, fn, key):
+        """Get a pair of the result and the list of the (offset, code) pairs it depends on, or None"""
+        item = self._results.get(key)
+        if item is not None:
+            if all(read_bytes(fn, offset, len(code)) == code for offset, code in item[1]):
+                self._results.move_to_end(key)
+                self.hits += 1
+                return item
+            del self._results[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result, windows):
+        self._results[key] = (result, windows)
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return TraceCacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
+
+
+def trace_code(fn, offset, stop_cond, trace_jmp=Trace.follow, trace_jcc=Trace.forward_only, trace_call=Trace.stop,
+               code_index=None, cache=None, counter=None):
+    """
+    If code_index is given, instructions which are not jumps, calls, returns or rep-prefixed are skipped
+    without being disassembled, so stop_cond must not depend on them.
+
+    If cache (TraceCache) is given, the results for the same offset, stop condition and trace policy are reused,
+    so the same stop condition must be the same object on each call.
+
+    If counter (DisasmCounter) is given, the disassembled instructions are counted with it.
+    """
+    return _cached_trace_code(fn, offset, stop_cond, trace_jmp, trace_jcc, trace_call, code_index, cache, counter,
+                              None)
+
+
+def _cached_trace_code(fn, offset, stop_cond, trace_jmp, trace_jcc, trace_call, code_index, cache, counter,
+                       windows):
+    if cache is None:
+        return _trace_code(fn, offset, stop_cond, trace_jmp, trace_jcc, trace_call, code_index, cache, counter,
+                           windows)
+
+    key = (offset, stop_cond, trace_jmp, trace_jcc, trace_call)
+    item = cache.get(fn, key)
+    if item is None:
+        own_windows = []
+        try:
+            result = _trace_code(fn, offset, stop_cond, trace_jmp, trace_jcc, trace_call, code_index, cache,
+                                 counter, own_windows)
+        finally:
+            # The caller's result depends on the code read here, even if an exception is raised
+            if windows is not None:
+                windows.extend(own_windows)
+        cache.put(key, result, own_windows)
+    else:
+        result, own_windows = item
+        if windows is not None:
+            windows.extend(own_windows)
+    return result
+
+
+def _trace_code(fn, offset, stop_cond, trace_jmp, trace_jcc, trace_call, code_index, cache, counter, windows):
+    def follow(address):
+        return _cached_trace_code(fn, address, stop_cond, trace_jmp, trace_jcc, trace_call, code_index, cache,
+                                  counter, windows)
+
     s = read_bytes(fn, offset, count_after)
+    if windows is not None:
+        windows.append((offset, s))
+
+    if code_index is None:
+        lines = disasm(s, offset, counter)
+    else:
+        lines = code_index.significant_lines(s, offset, counter)
+
     with suppress(IndexError):
-        for line in disasm(s, offset):
+        for line in lines:
             # print('%-8x\t%-16s\t%s' % (line.address, ' '.join('%02x' % x for x in line.data), line))
             if line.mnemonic == 'db':
                 return None
@@ -26,44 +125,60 @@ def trace_code(fn, offset, stop_cond, trace_jmp=Trace.follow, trace_jcc=Trace.fo
                 if trace_jmp == Trace.not_follow:
                     pass
                 elif trace_jmp == Trace.follow:
-                    return trace_code(fn, int(line.operands[0]), stop_cond, trace_jmp, trace_jcc, trace_call)
+                    return follow(int(line.operands[0]))
                 elif trace_jmp == Trace.stop:
                     return line
                 elif trace_jmp == Trace.forward_only:
                     if int(line.operands[0]) > line.address:
-                        return trace_code(fn, int(line.operands[0]), stop_cond, trace_jmp, trace_jcc, trace_call)
+                        return follow(int(line.operands[0]))
             elif line.mnemonic.startswith('j'):
                 if trace_jcc == Trace.not_follow:
                     pass
                 elif trace_jcc == Trace.follow:
-                    return trace_code(fn, int(line.operands[0]), stop_cond, trace_jmp, trace_jcc, trace_call)
+                    return follow(int(line.operands[0]))
                 elif trace_jcc == Trace.stop:
                     return line
                 elif trace_jcc == Trace.forward_only:
                     if int(line.operands[0]) > line.address:
-                        return trace_code(fn, int(line.operands[0]), stop_cond, trace_jmp, trace_jcc, trace_call)
+                        return follow(int(line.operands[0]))
             elif line.mnemonic.startswith('call'):
                 if trace_call == Trace.not_follow:
                     pass
                 elif trace_call == Trace.follow:
-                    returned = trace_code(fn, int(line.operands[0]), stop_cond, trace_jmp, trace_jcc, trace_call)
+                    returned = follow(int(line.operands[0]))
                     if returned is None or not returned.mnemonic.startswith('ret'):
                         return returned
                 elif trace_call == Trace.stop:
                     return line
                 elif trace_call == Trace.forward_only:
                     if int(line.operands[0]) > line.address:
-                        return trace_code(fn, int(line.operands[0]), stop_cond, trace_jmp, trace_jcc, trace_call)
+                        return follow(int(line.operands[0]))
             elif line.mnemonic.startswith('ret'):
                 return line
     return None
 
 
-def which_func(fn, offset, stop_cond=lambda _: False):
-    def default_stop_condition(cur_line):
-        return str(cur_line).startswith('rep') or stop_cond(cur_line)
+def _stop_at_rep(cur_line):
+    return cur_line.has_rep_prefix
+
+
+@lru_cache(maxsize=64)
+def _stop_at_rep_or(stop_cond):
+    # The same function is returned for the same stop_cond, so that trace results can be cached
+    def stop(cur_line):
+        return cur_line.has_rep_prefix or stop_cond(cur_line)
+
+    return stop
+
+
+def which_func(fn, offset, stop_cond=None, code_index=None, cache=None, counter=None):
+    if stop_cond is None:
+        disasm_line = trace_code(fn, offset, stop_cond=_stop_at_rep, code_index=code_index, cache=cache,
+                                 counter=counter)
+    else:
+        # An arbitrary stop condition may need every instruction, so the code index is not used
+        disasm_line = trace_code(fn, offset, stop_cond=_stop_at_rep_or(stop_cond), cache=cache, counter=counter)
 
-    disasm_line = trace_code(fn, offset, stop_cond=default_stop_condition)
     if disasm_line is None:
         result = ('not reached',)
     elif str(disasm_line).startswith('rep'):
@@ -1,5 +1,11 @@
+import re
+
 from setuptools import setup, find_packages
 
+# The version is kept in one place, the analysis cache depends on it
+with open('dfrus/__init__.py') as file:
+    version = re.search(r"^__version__ = '(.+)'$", file.read(), re.MULTILINE).group(1)
+
 install_requires = [
       'pefile'
 ]
@@ -10,7 +16,7 @@ test_requires = [
 ]
 
 setup(name='dfrus',
-      version='0.0.4',
+      version=version,
       # description='',
       url='https://github.com/dfint/dfrus',
       author='insolor',
@@ -0,0 +1,105 @@
+import io
+import os
+
+from dfrus.analysis_cache import AnalysisCache, CacheEntry
+from dfrus.patchdf import Fix, Metadata, fix_len_cached, data_digest
+
+
+def test_analysis_cache(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    entry = cache.entry('0123')
+    assert 'xref_table' not in entry
+
+    xref_table = {0x100: [0x10, 0x20]}
+    entry.set('xref_table', xref_table)
+    xref_table[0x100][0] = 0  # Values stored in the cache are not affected by later changes
+    entry.set_fix_len_result((0x10, 3, 5, 0x401000, 0x402000), Fix(meta=Metadata(fixed='yes')), [(0x8, b'\x05')],
+                             [(0x0, 3, data_digest(b'\x6a\x03\x68'))])
+    cache.store(entry)
+
+    entry = cache.entry('0123')
+    assert entry.get('xref_table') == {0x100: [0x10, 0x20]}
+    fix, writes, reads = entry.get_fix_len_result((0x10, 3, 5, 0x401000, 0x402000))
+    assert fix.meta.fixed == 'yes'
+    assert writes == [(0x8, b'\x05')]
+    assert reads == [(0x0, 3, data_digest(b'\x6a\x03\x68'))]
+    assert entry.get_fix_len_result((0x10, 3, 6, 0x401000, 0x402000)) is None
+
+
+def test_analysis_cache_fix_len_results(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    entry = cache.entry('0123')
+    fix = Fix(new_code=b'\x90\xc3', src_off=0x20, deleted_relocs=[0x4], meta=Metadata(fixed='yes', len_='push',
+                                                                                       func=('call near', 0x10, 0x40)))
+    entry.set_fix_len_result((0x10, 3, 5, 0x401000, 0x402000), fix, [], [])
+    entry.set_fix_len_result((0x20, 3, 5, 0x401000, 0x402000), Fix(meta=Metadata(fixed='no')), [], [])
+    fix.meta.fixed = 'no'  # Results stored in the cache are not affected by later changes
+    cache.store(entry)
+    assert [path.name for path in tmp_path.iterdir()] == [entry.key + '.dfrus-cache']  # No temporary files left
+
+    entry = cache.entry('0123')
+    restored, _, _ = entry.get_fix_len_result((0x10, 3, 5, 0x401000, 0x402000))
+    assert repr(restored) == repr(Fix(new_code=b'\x90\xc3', src_off=0x20, deleted_relocs=[0x4]))
+    assert repr(restored.meta) == repr(Metadata(fixed='yes', len_='push', func=('call near', 0x10, 0x40)))
+    entry.set('charmap', 0x100)
+    cache.store(entry)
+
+    # Only the results used by the latest run are kept
+    entry = cache.entry('0123')
+    assert entry.get_fix_len_result((0x10, 3, 5, 0x401000, 0x402000)) is not None
+    assert entry.get_fix_len_result((0x20, 3, 5, 0x401000, 0x402000)) is None
+
+
+def test_analysis_cache_eviction(tmp_path):
+    cache = AnalysisCache(str(tmp_path), max_size=0)
+    for i, key in enumerate(['first', 'second']):
+        entry = cache.entry(key)
+        entry.set('relocs', set(range(i * 1000, i * 1000 + 1000)))
+        cache.store(entry)
+
+    # Only the most recently stored file is left
+    files = os.listdir(str(tmp_path))
+    assert len(files) == 1 and files[0].startswith('second-')
+
+
+def test_analysis_cache_broken_file(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    entry = cache.entry('0123')
+    entry.set('charmap', 0x100)
+    cache.store(entry)
+
+    # A file which is not a cache entry is ignored
+    path, = tmp_path.iterdir()
+    path.write_bytes(b'\x80\x04K\x01.')
+    assert 'charmap' not in cache.entry('0123')
+
+
+code = bytes(0x40) + bytes.fromhex(
+    '6A 05'  # push 5
+    '68 00 10 40 00'  # push offset str
+    'E8 00 00 00 00'  # call near
+    'C3'  # retn
+)
+
+
+def test_fix_len_cached_checks_data():
+    entry = CacheEntry('test')
+    args = (0x43, 5, 10, 0x402000, 0x401000)
+    fn = io.BytesIO(code)
+    assert fix_len_cached(fn, [entry], *args).meta.fixed == 'yes'
+    assert fn.getvalue()[0x41] == 10
+
+    # The result is replayed on the same code
+    fn = io.BytesIO(code)
+    assert fix_len_cached(fn, [entry], *args).meta.fixed == 'yes'
+    assert fn.getvalue()[0x41] == 10
+
+    # The length is pushed in another way, so the result is not valid anymore
+    changed = bytearray(code)
+    changed[0x41] = 6
+    fn = io.BytesIO(bytes(changed))
+    assert fix_len_cached(fn, [entry], *args).meta.fixed is None
+    assert fn.getvalue() == changed
+
+    # The cached result is replaced with the new one
+    assert entry.get_fix_len_result(args)[0].meta.fixed is None
@@ -0,0 +1,91 @@
+import contextlib
+import csv
+import io
+import json
+
+import pytest
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.batch import BatchJob, find_builds, load_batch_manifest, run_batch
+from dfrus.patchdf import fix_df_exe
+from dfrus.peclasses import PortableExecutable
+
+
+def test_find_builds(tmp_path):
+    for name in ['b', 'a', 'a/nested']:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'Dwarf Fortress.exe').write_bytes(b'')
+    (tmp_path / 'empty').mkdir()
+
+    jobs = find_builds(str(tmp_path), 'dict.txt', 'cp1251')
+    assert [job.path for job in jobs] == [str(tmp_path / name / 'Dwarf Fortress.exe')
+                                          for name in ['a', 'a/nested', 'b']]
+    assert jobs[0].dest == str(tmp_path / 'a' / 'Dwarf Fortress Patched.exe')
+    assert all(job.dictionary == 'dict.txt' and job.codepage == 'cp1251' for job in jobs)
+
+
+def test_load_batch_manifest(tmp_path):
+    path = tmp_path / 'batch.json'
+    path.write_text(json.dumps([
+        {'path': '0.47/Dwarf Fortress.exe', 'codepage': 'cp850'},
+        {'path': '0.44/Dwarf Fortress.exe', 'dest': 'out/patched.exe', 'dictionary': 'old.txt'},
+    ]))
+
+    jobs = load_batch_manifest(str(path), 'dict.txt', 'cp1251')
+    assert jobs == [
+        BatchJob(str(tmp_path / '0.47/Dwarf Fortress.exe'), str(tmp_path / '0.47/Dwarf Fortress Patched.exe'),
+                 'dict.txt', 'cp850', 'cp437'),
+        BatchJob(str(tmp_path / '0.44/Dwarf Fortress.exe'), str(tmp_path / 'out/patched.exe'),
+                 str(tmp_path / 'old.txt'), 'cp1251', 'cp437'),
+    ]
+
+
+def test_run_batch_failures(tmp_path):
+    dictionary = tmp_path / 'dict.txt'
+    dictionary.write_text('Dwarf Fortress,DF\n', encoding='utf-8')
+    broken = tmp_path / 'Dwarf Fortress.exe'
+    broken.write_bytes(b'MZ' + bytes(0x3E))
+    jobs = [BatchJob(str(broken), str(tmp_path / 'patched.exe'), str(dictionary), None, 'cp437'),
+            BatchJob(str(tmp_path / 'missing.exe'), str(tmp_path / 'patched2.exe'), str(dictionary), None, 'cp437')]
+
+    # Failed jobs don't stop the batch
+    results = list(run_batch(jobs))
+    assert [result.job for result in results] == jobs
+    assert "'%s' is broken" % broken in results[0].error
+    assert 'FileNotFoundError' in results[1].error
+    assert all(result.report is None for result in results)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_run_batch(tmp_path, capfd, workers):
+    image, strings = build_pe(60)
+    trans_table = make_translations(strings)
+    dictionary = tmp_path / 'dict.txt'
+    with open(str(dictionary), 'w', encoding='utf-8', newline='') as file:
+        csv.writer(file, 'unix').writerows(trans_table.items())
+
+    fn = io.BytesIO(image)
+    with contextlib.redirect_stdout(io.StringIO()):
+        fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', trans_table)
+    expected = fn.getvalue()
+
+    jobs = []
+    for name in ['a', 'b']:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'Dwarf Fortress.exe').write_bytes(image)
+        jobs.append(BatchJob(str(tmp_path / name / 'Dwarf Fortress.exe'), str(tmp_path / name / 'patched.exe'),
+                             str(dictionary), 'cp1251', 'cp437'))
+
+    capfd.readouterr()
+    results = list(run_batch(jobs, workers=workers))
+    assert [result.job for result in results] == jobs
+    for result in results:
+        assert result.error is None
+        assert result.report.counters['strings_translated'] > 0
+        assert 'Translating...' in result.log
+        with open(result.job.dest, 'rb') as file:
+            assert file.read() == expected
+
+    # The messages of the jobs are collected to their logs instead of being printed
+    captured = capfd.readouterr()
+    assert 'Translating...' not in captured.out
@@ -10,3 +10,59 @@ def test_binio():
     write_string(file_object, "1234")
 
     assert file_object.getvalue() == b'\xef\xbe\xad\xde1234\x00'
+
+
+def test_fpoke_bytes():
+    file_object = BytesIO(bytes(8))
+
+    fpoke(file_object, 2, b'\x01\x02')
+    fpoke(file_object, 4, [0xFF, -1])
+    fpoke4(file_object, 4, [0xDEADBEEF])
+
+    assert file_object.getvalue() == b'\0\0\x01\x02\xef\xbe\xad\xde'
+
+
+def test_recording_file():
+    file_object = BytesIO(bytes(8))
+    recorder = RecordingFile(file_object, passthrough=False)
+
+    fpoke4(recorder, 4, 0xDEADBEEF)
+    fpoke(recorder, 1, 0xFF)
+
+    assert read_bytes(recorder, 4, 4) == bytes(4)
+    assert recorder.writes == [(4, b'\xef\xbe\xad\xde'), (1, b'\xff')]
+
+    apply_writes(file_object, recorder.writes)
+    assert file_object.getvalue() == b'\0\xff\0\0\xef\xbe\xad\xde'
+
+
+def test_recording_file_overlay():
+    file_object = BytesIO(bytes(8))
+    recorder = RecordingFile(file_object, passthrough=False, overlay=True)
+
+    fpoke4(recorder, 2, 0xDEADBEEF)
+
+    assert read_bytes(recorder, 0, 8) == b'\0\0\xef\xbe\xad\xde\0\0'
+    assert file_object.getvalue() == bytes(8)
+    assert recorder.reads == [(0, 8)]
+
+
+def test_image_buffer():
+    image = ImageBuffer(bytes(8))
+
+    fpoke4(image, 4, 0xDEADBEEF)
+    fpoke(image, 1, [0xFF, -1])
+    assert read_bytes(image, 4, 4) == b'\xef\xbe\xad\xde'
+    assert read_bytes(image, 2) == 0xFF
+
+    # File protocol sees the same data
+    image.seek(0)
+    assert image.read(3) == b'\0\xff\xff'
+    assert image.tell() == 3
+
+    # Writing beyond the end extends the image
+    image.seek(10)
+    image.write(b'\x01')
+    assert image.getvalue() == b'\0\xff\xff\0\xef\xbe\xad\xde\0\0\x01'
+    image.seek(-1, 2)
+    assert image.read() == b'\x01'
@@ -0,0 +1,64 @@
+import io
+import pickle
+
+from dfrus.code_index import CodeIndex, InstructionClass, _rules_by_kind, _x0f_rules_by_kind
+from dfrus.disasm import disasm, opcode_decoders, x0f_opcode_decoders
+from dfrus.trace_machine_code import which_func
+
+code = bytes.fromhex(
+    '55'  # push ebp
+    '8B EC'  # mov ebp, esp
+    '8B 45 08'  # mov eax, [ebp+8]
+    '66 89 0E'  # mov [esi], cx
+    '74 02'  # jz short
+    'F3 A5'  # rep movsd
+    '64 A1 00 00 00 00'  # mov eax, fs:[0]
+    'E8 00 00 00 00'  # call near
+    '0F 84 00 00 00 00'  # jz near
+    '8D 4C 24 04'  # lea ecx, [esp+4]
+    'F3 8D 00'  # rep prefix shown as a separate line
+    'C3'  # retn
+)
+
+
+def test_code_index():
+    index = CodeIndex.from_bytes(code, 0x1000)
+    lines = list(disasm(code, 0x1000))
+    assert list(index.starts[:10]) == [line.address for line in lines[:10]]
+    assert list(index.lengths[:10]) == [len(line.data) for line in lines[:10]]
+    assert list(index.classes[:10]) == [
+        InstructionClass.other, InstructionClass.other, InstructionClass.other, InstructionClass.other,
+        InstructionClass.jcc, InstructionClass.other | InstructionClass.rep, InstructionClass.other,
+        InstructionClass.call, InstructionClass.jcc, InstructionClass.other,
+    ]
+    assert index.classes[10] == InstructionClass.unknown
+    assert index.classes[-1] == InstructionClass.ret
+    assert index.find(0x1001) == 1 and index.find(0x1002) is None
+
+    restored = pickle.loads(pickle.dumps(index))
+    assert (restored.starts, restored.lengths, restored.classes) == (index.starts, index.lengths, index.classes)
+
+
+def test_code_index_rule_kinds():
+    # A renamed decoder kind must not silently leave its instructions to the disassembler
+    assert set(_rules_by_kind) <= {decoder.kind for decoder in opcode_decoders}
+    assert set(_x0f_rules_by_kind) <= {decoder.kind for decoder in x0f_opcode_decoders}
+
+
+def test_code_index_significant_lines():
+    index = CodeIndex.from_bytes(code, 0x1000)
+    lines = list(disasm(code, 0x1000))
+    # Plain instructions are skipped until the first unknown one, then all instructions are yielded
+    expected = [lines[4], lines[5], lines[7], lines[8]] + lines[10:]
+    assert [str(line) for line in index.significant_lines(code, 0x1000)] == [str(line) for line in expected]
+
+    # Not an instruction boundary
+    assert [str(line) for line in index.significant_lines(code[2:], 0x1002)] == \
+        [str(line) for line in disasm(code[2:], 0x1002)]
+
+
+def test_which_func_with_code_index():
+    fn = io.BytesIO(code)
+    index = CodeIndex.from_bytes(code)
+    for offset in range(len(code)):
+        assert which_func(fn, offset, code_index=index) == which_func(fn, offset)
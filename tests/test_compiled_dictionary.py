@@ -0,0 +1,59 @@
+import pickle
+
+import pytest
+
+from dfrus.compiled_dictionary import compile_dictionary, CompiledDictionary, load_dictionary, closing_dictionary
+
+
+def test_compiled_dictionary(tmp_path):
+    pairs = [('Dwarf Fortress', 'Крепость дварфов'), ('a', 'б'), ('', 'empty'), ('a', 'в'), ('x\ty', 'x\ty')]
+    path = str(tmp_path / 'dict.bin')
+    compile_dictionary(pairs, path)
+
+    with CompiledDictionary(path) as dictionary:
+        assert dict(dictionary) == dict(pairs)
+        assert list(dictionary) == ['Dwarf Fortress', 'a', '', 'x\ty']
+        assert len(dictionary) == 4
+        assert 'a' in dictionary and 'b' not in dictionary and b'a' not in dictionary
+        with pytest.raises(KeyError):
+            dictionary['b']
+
+        restored = pickle.loads(pickle.dumps(dictionary))
+        assert dict(restored) == dict(pairs)
+        restored.close()
+
+
+def test_compiled_dictionary_empty(tmp_path):
+    path = str(tmp_path / 'dict.bin')
+    compile_dictionary([], path)
+    with CompiledDictionary(path) as dictionary:
+        assert len(dictionary) == 0 and 'a' not in dictionary
+
+
+def test_load_dictionary(tmp_path):
+    csv_path = tmp_path / 'dict.txt'
+    csv_path.write_text('Dwarf Fortress,Крепость дварфов\nx\\ty,x\\ty\n', encoding='utf-8')
+    pairs = load_dictionary(str(csv_path))
+    assert pairs == [('Dwarf Fortress', 'Крепость дварфов'), ('x\ty', 'x\ty')]
+
+    compiled_path = str(tmp_path / 'dict.bin')
+    compile_dictionary(pairs, compiled_path)
+    dictionary = load_dictionary(compiled_path)
+    assert isinstance(dictionary, CompiledDictionary) and dict(dictionary) == dict(pairs)
+    dictionary.close()
+
+    with pytest.raises(ValueError):
+        CompiledDictionary(str(csv_path))
+
+
+def test_closing_dictionary(tmp_path):
+    path = str(tmp_path / 'dict.bin')
+    compile_dictionary([('a', 'б')], path)
+
+    with closing_dictionary(load_dictionary(path)) as dictionary:
+        assert dictionary['a'] == 'б'
+    assert dictionary._data.closed
+
+    pairs = [('a', 'б')]
+    with closing_dictionary(pairs) as dictionary:
+        assert dictionary is pairs
@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+from dfrus.binio import to_dword
+from dfrus.cross_references import get_cross_references
+from dfrus.peclasses import Section, SectionTable
+
+image_base = 0x400000
+sections = SectionTable([
+    Section(name=b'.text', virtual_size=0x20, rva=0x1000, physical_size=0x20, physical_offset=0x200, flags=0),
+    Section(name=b'.rdata', virtual_size=0x10, rva=0x2000, physical_size=0x20, physical_offset=0x220, flags=0),
+])
+
+
+def test_get_cross_references():
+    data = bytearray(0x240)
+    data[0x201:0x205] = to_dword(image_base + 0x2004)  # reference to .rdata
+    data[0x20b:0x20f] = to_dword(image_base + 0x1010)  # reference to the code itself
+    data[0x213:0x217] = to_dword(image_base + 0x2004)
+    data[0x220:0x224] = to_dword(image_base + 0x2008)  # reference from .rdata to .rdata
+    relocs = [0x1013, 0x100b, 0x1001, 0x2000]
+
+    xrefs = get_cross_references(io.BytesIO(data), relocs, sections, image_base)
+
+    assert xrefs == {0x224: [0x213, 0x201], 0x228: [0x220]}
+
+
+def test_get_cross_references_beyond_section():
+    data = bytearray(0x240)
+    data[0x228:0x22c] = to_dword(image_base + 0x2018)  # beyond the virtual size of the section
+    with pytest.raises(AssertionError):
+        get_cross_references(io.BytesIO(data), [0x2008], sections, image_base)
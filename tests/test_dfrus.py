@@ -1,5 +1,7 @@
 import pytest
 
+from dfrus.compiled_dictionary import compile_dictionary, CompiledDictionary
+from dfrus.dfrus import destination_image_context, slice_translation
 from dfrus.patchdf import find_earliest_midrefs
 
 
@@ -20,3 +22,38 @@ def test_find_earliest_midrefs_sword():
         offset+4: [0x4a3065, 0x496c78, 0x49eb2b],
     }
     assert find_earliest_midrefs(offset, xref_table, len('SWORD')) == [0x4a3065, 0x496c78, 0x49eb2b]
+
+
+def test_destination_image_context(tmp_path):
+    src = tmp_path / 'src.exe'
+    dest = tmp_path / 'dest.exe'
+    src.write_bytes(b'MZ' + bytes(14))
+
+    with destination_image_context(str(src), str(dest)) as image:
+        image.seek(2)
+        image.write(b'\xff')
+
+    assert dest.read_bytes() == b'MZ\xff' + bytes(13)
+    assert src.read_bytes() == b'MZ' + bytes(14)
+
+
+def test_destination_image_context_failure(tmp_path):
+    src = tmp_path / 'src.exe'
+    dest = tmp_path / 'dest.exe'
+    src.write_bytes(bytes(16))
+
+    with pytest.raises(ValueError):
+        with destination_image_context(str(src), str(dest)):
+            raise ValueError
+
+    assert not dest.exists()
+
+
+def test_slice_translation_compiled_dictionary(tmp_path):
+    pairs = [('a', 'б'), ('b', 'в'), ('c', 'г')]
+    path = str(tmp_path / 'dict.bin')
+    compile_dictionary(pairs, path)
+
+    with CompiledDictionary(path) as dictionary:
+        assert slice_translation(dictionary, None) == dict(pairs)
+        assert slice_translation(dictionary, (1, 2)) == dict(pairs[1:])
@@ -1,6 +1,7 @@
 import pytest
 
-from dfrus.disasm import disasm, analyse_modrm, ModRM, Sib
+from dfrus.disasm import disasm, analyse_modrm, ModRM, Sib, DisasmCounter
+from dfrus.opcodes import Reg
 
 
 @pytest.mark.parametrize('hex_data,disasm_str', [
@@ -38,3 +39,36 @@ def test_analyse_modrm():
                   sib=Sib(scale=2, index_reg=1, base_reg=5),
                   disp=0x0AD0EEC0),
              len(data)))
+
+
+@pytest.mark.parametrize('hex_data,disasm_lines', [
+    # Prefixes which don't apply to the instruction are yielded as a separate line
+    ('66 E8 01000000', ['db 0x66', 'call near 7']),
+    ('64 90', ['db 0x64', 'nop']),
+    # Unrecognized instructions
+    ('0F 0B 90', ['db 0xF, 0xB', 'nop']),
+    ('C6 C8 90', ['db 0xC6', 'db 0xC8', 'nop']),
+])
+def test_disasm_prefixes_and_unknown(hex_data, disasm_lines):
+    assert [str(line) for line in disasm(bytes.fromhex(hex_data))] == disasm_lines
+
+
+def test_disasm_lazy_operands():
+    lines = list(disasm(bytes.fromhex('8b0c8dc0eed00a f3a5 66 e8 01000000'), 0x1000))
+    assert [line.mnemonic for line in lines] == ['mov', 'movsd', 'db', 'call near']
+    # Operands are decoded from the line data when accessed
+    dest, src = lines[0].operands
+    assert dest.reg == Reg.ecx and src.index_reg == Reg.ecx and src.disp == 0x0AD0EEC0
+    assert lines[1].has_rep_prefix and not lines[0].has_rep_prefix
+    assert [int(op) for op in lines[2].operands] == [0x66]
+    assert int(lines[3].operands[0]) == 0x1010
+
+
+def test_disasm_counter():
+    data = bytes.fromhex('8b0c8dc0eed00a f3a5 66 e8 01000000')
+    counter = DisasmCounter()
+    lines = disasm(data, 0x1000, counter)
+    next(lines)
+    assert (counter.lines, counter.bytes) == (1, 7)
+    list(lines)
+    assert (counter.lines, counter.bytes) == (4, len(data))
@@ -1,6 +1,9 @@
+import io
+
 import pytest
 
-from dfrus.extract_strings import check_string_array
+from dfrus.extract_strings import (check_string, check_string_array, extract_strings, encode_keys, get_byte_classes,
+                                   register_byte_classes, ByteClasses)
 
 
 @pytest.mark.parametrize('test_data,expected', [
@@ -14,3 +17,72 @@ from dfrus.extract_strings import check_string_array
 ])
 def test_check_string_array(test_data, expected):
     assert list(check_string_array(test_data, 0)) == expected
+
+
+@pytest.mark.parametrize('test_data,expected', [
+    (b'abc\0', (3, 3)),
+    (b'a b1\0', (4, 2)),
+    (b'a$b\0', (None, 0)),  # forbidden character
+    (b'\x81b\0', (None, 0)),  # not decodable in utf-8
+    (b'abc', (None, 0)),  # no terminator
+    (b'\0abc', (0, 0)),
+])
+def test_check_string(test_data, expected):
+    assert check_string(test_data, 'utf-8') == expected
+    assert check_string(b'xx' + test_data + b'yy\0', 'utf-8', 2, 2 + len(test_data)) == expected
+
+
+def test_extract_strings():
+    data = b'\0\0\0\0' + b'abc\0' + b'\x01\x02\x03\x04' + b'Hello, world\0\0\0\0' + b'foo\0bar\0' + b'1234\0'
+    xrefs = [4, 5, 8, 12, 16, 28, 32, 36]
+    assert list(extract_strings(io.BytesIO(data), xrefs)) == [
+        (4, 'abc', 4), (12, 'Hello, world', 16), (28, 'foo', 4), (32, 'bar', 4)
+    ]
+    # Strings are looked for in blocksize bytes after the reference
+    assert list(extract_strings(io.BytesIO(data), xrefs, blocksize=8)) == [(4, 'abc', 4), (28, 'foo', 4), (32, 'bar', 4)]
+    assert list(extract_strings(io.BytesIO(data), [])) == []
+
+
+def test_extract_strings_keys():
+    data = b'abc\0' + b'Hello, world\0\0\0\0' + b'\x80\x81\0\0' + b'foo\0bar\0'
+    xrefs = [0, 4, 8, 20, 24, 28]
+    keys = encode_keys(['Hello, world', 'foo', 'ЖЖ', '\u0100'], 'cp866')
+    assert keys == {b'Hello, world', b'foo', b'\x86\x86'}
+    expected = [item for item in extract_strings(io.BytesIO(data), xrefs, encoding='cp866', arrays=True)
+                if item[1].encode('cp866') in keys]
+    assert expected == [(4, 'Hello, world', 15), (24, 'foo', 3)]
+    # References inside of the strings without translations are skipped the same way
+    assert list(extract_strings(io.BytesIO(data), xrefs, encoding='cp866', arrays=True, keys=keys)) == expected
+
+
+def test_extract_strings_parallel():
+    data = b''.join(b'string %d\0' % i + b'\0' * (i % 4) for i in range(200)) + b'$$$\0foo\0bar\0'
+    xrefs = [i for i in range(len(data)) if i == 0 or data[i - 1] == 0 or i % 7 == 0]
+    for arrays in (False, True):
+        expected = list(extract_strings(io.BytesIO(data), xrefs, blocksize=64, arrays=arrays))
+        # References inside of the strings are skipped the same way at the boundaries of shards
+        assert list(extract_strings(io.BytesIO(data), xrefs, blocksize=64, arrays=arrays, workers=2)) == expected
+
+
+def test_byte_classes():
+    byte_classes = get_byte_classes('utf-8')
+    assert get_byte_classes('utf-8') is byte_classes
+    assert byte_classes.decodable == bytes(range(0x80))
+    assert byte_classes.is_valid(ord('a')) and byte_classes.is_valid(ord('\t'))
+    assert not byte_classes.is_valid(0) and not byte_classes.is_valid(ord('$')) and not byte_classes.is_valid(0x81)
+    assert byte_classes.count_letters(b'ab 12 c') == 3
+
+    assert get_byte_classes('cp1251').is_valid(0xC0)
+    assert not get_byte_classes('cp1251').is_valid(0x98)  # undefined in cp1251
+
+
+def test_registered_byte_classes():
+    import dfrus.patch_charmap  # noqa: F401 registers codecs of custom codepages
+
+    # Every byte is valid in a custom codepage
+    assert check_string(b'\x81\x90abc\0', 'viscii') == (5, 3)
+    assert list(check_string_array(b'\x81\0\0\x90\0', 0, 'viscii')) == [(0, b'\x81', 2), (3, b'\x90', 1)]
+
+    register_byte_classes('test-no-valid-bytes', ByteClasses(b''))
+    assert check_string(b'abc\0', 'test-no-valid-bytes') == (None, 0)
+    assert list(check_string_array(b'\0abc\0', 0, 'test-no-valid-bytes')) == []
@@ -0,0 +1,28 @@
+import contextlib
+import io
+
+import pytest
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.fan_out import patch_image_for_targets
+from dfrus.patchdf import fix_df_exe
+from dfrus.peclasses import PortableExecutable
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_patch_image_for_targets(workers):
+    image, strings = build_pe(60)
+    targets = [(make_translations(strings, seed), codepage)
+               for seed, codepage in [(0, 'cp1251'), (1, 'cp850'), (2, None)]]
+
+    results = patch_image_for_targets(image, targets, workers=workers)
+
+    assert len(results) == len(targets)
+    for (trans_table, codepage), result in zip(targets, results):
+        fn = io.BytesIO(image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            fix_df_exe(fn, PortableExecutable(fn), codepage, 'cp437', trans_table)
+        assert result.image == fn.getvalue()
+        assert result.image != image
+        assert 'Translating...' in result.log
+        assert result.report.counters['strings_translated'] > 0
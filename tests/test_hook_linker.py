@@ -0,0 +1,30 @@
+import io
+
+from dfrus.binio import to_dword
+from dfrus.hook_linker import HookLinker
+from dfrus.opcodes import jmp_near
+
+
+def hook_builder(body, dest_rva, relocations=()):
+    def build(hook_rva):
+        disp = dest_rva - (hook_rva + len(body) + 5)
+        return body + bytes((jmp_near,)) + to_dword(disp, signed=True), set(relocations)
+    return build
+
+
+def test_hook_linker():
+    fn = io.BytesIO()
+    linker = HookLinker(fn, 0x100, lambda offset: offset + 0x1000)
+
+    assert linker.link(hook_builder(b'\x6A\x05', 0x2000)) == 0x1100
+    assert linker.link(hook_builder(b'\x6A\x07', 0x2000)) == 0x1108
+    # The same code jumping to the same place is shared
+    assert linker.link(hook_builder(b'\x6A\x05', 0x2000)) == 0x1100
+    # Jumps to other places and other relocations make a different hook
+    assert linker.link(hook_builder(b'\x6A\x05', 0x3000)) == 0x1110
+    assert linker.link(hook_builder(b'\x6A\x05', 0x2000, {1})) == 0x1118
+
+    assert (linker.linked, linker.shared) == (4, 1)
+    assert linker.offset == 0x120
+    assert linker.relocations == {0x1119}
+    assert fn.getvalue()[0x100:0x108] == b'\x6A\x05\xE9' + to_dword(0x2000 - 0x1107, signed=True) + b'\xCC'
@@ -0,0 +1,98 @@
+import contextlib
+import io
+import os
+
+import dfrus.patchdf
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.binio import RecordingFile
+from dfrus.disasm import DisasmCounter
+from dfrus.patchdf import (merge_ranges, analyse_references, pieces_unchanged, fix_len, fix_df_exe, parallel_workers,
+                           isolated_references)
+from dfrus.peclasses import PortableExecutable
+
+code = bytes(0x40) + bytes.fromhex(
+    '6A 05'  # push 5
+    '68 00 10 40 00'  # push offset str
+    'E8 00 00 00 00'  # call near
+    '6A 07'  # push 7
+    '68 08 10 40 00'  # push offset str2
+    'E8 00 00 00 00'  # call near
+    'C3'  # retn
+)
+
+
+def test_merge_ranges():
+    assert merge_ranges([(10, 5), (0, 4), (4, 2), (12, 1), (20, 1)]) == [(0, 6), (10, 5), (20, 1)]
+
+
+def test_analyse_references():
+    jobs = [(0x43, 5, 10, 0x402000, 0x401000), (0x4F, 7, 3, 0x401008, 0x401008)]
+    counter = DisasmCounter()
+    results = analyse_references(code, jobs, workers=2, counter=counter)
+    assert counter.bytes > 0  # Counted in the workers
+
+    # The results are got with the image as it is before the fixes
+    fn = io.BytesIO(code)
+    for args in jobs:
+        (fix, writes), pieces = results[args[0]]
+        assert pieces and pieces_unchanged(fn, pieces)
+
+        recorder = RecordingFile(io.BytesIO(code))
+        serial_fix = fix_len(recorder, *args)
+        assert (repr(serial_fix), repr(serial_fix.meta)) == (repr(fix), repr(fix.meta))
+        assert recorder.writes == writes
+
+    # The second reference reads the code changed by the fix of the first one, so its result is not valid after it
+    fix_len(fn, *jobs[0])
+    assert not pieces_unchanged(fn, results[0x4F][1])
+
+
+def test_parallel_workers(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    assert parallel_workers(4, 100, 100) == 2
+    assert parallel_workers(4, 99, 100) == 1
+
+    monkeypatch.setattr(os, 'cpu_count', lambda: 1)
+    assert parallel_workers(4, 100, 100) == 1
+
+
+def test_isolated_references():
+    assert isolated_references([0x300, 0x100, 0x20, 0x400, 0x600], distance=0x100) == {0x300, 0x400, 0x600}
+    assert isolated_references([0x100]) == {0x100}
+
+
+def test_fix_df_exe_parallel(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    # The pieces of code which use the strings are far enough from each other to analyse their references in parallel
+    image, strings = build_pe(dfrus.patchdf.min_parallel_references * 3 // 2, code_gap=0x120)
+    trans_table = make_translations(strings)
+
+    patched = []
+    for workers in [1, 2]:
+        fn = io.BytesIO(image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', trans_table, workers=workers)
+        patched.append(fn.getvalue())
+
+    assert 'parallel analysis' in report.stages
+    assert patched[0] == patched[1]
+
+
+def test_fix_df_exe_small(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    extract_workers = []
+    original_extract_strings = dfrus.patchdf.extract_strings
+
+    def extract_strings(*args, workers=1, **kwargs):
+        extract_workers.append(workers)
+        return original_extract_strings(*args, workers=workers, **kwargs)
+
+    monkeypatch.setattr(dfrus.patchdf, 'extract_strings', extract_strings)
+    image, strings = build_pe(300, code_gap=0x120)
+    fn = io.BytesIO(image)
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', make_translations(strings), workers=4)
+
+    # Too few references to start the pools
+    assert extract_workers == [1]
+    assert 'parallel analysis' not in report.stages
@@ -14,3 +14,29 @@ def test_encoder(codepage_data, input_string, expected):
 def test_combining_grave_accent():
     text = 'ờ'
     assert get_encoder('viscii')(text)[0]
+
+
+def test_custom_codec():
+    import codecs
+    assert 'Ạ'.encode('viscii') == b'\x80'
+    assert b'\x80'.decode('viscii') == 'Ạ'
+    assert 'Ç'.encode('viscii') == b'\x80'  # replaced cp437 character is still encoded to its code
+    assert codecs.lookup('viscii').name == 'viscii'
+
+
+def test_encode_translations():
+    import codecs
+    from dfrus.patchdf import encode_translations
+    assert encode_translations(codecs.getencoder('cp437'), ['abc', '', 'Ç']) == [b'abc', b'', b'\x80']
+    assert encode_translations(codecs.getencoder('cp437'), []) == []
+    assert encode_translations(codecs.getencoder('cp437'), ['abc', 'Ж']) is None  # not encodable
+    assert encode_translations(get_encoder('viscii'), ['Ạ', 'Ç']) == [b'\x80', b'\x80']
+    assert encode_translations(codecs.getencoder('utf-16'), ['abc']) is None
+    assert encode_translations(get_encoder('viscii'), ['Ạ', 'a\u0323']) is None  # normalized to a single character
+
+    def encoder(text):
+        # One translation is shortened and the other one is lengthened, the total length is the same
+        return text.replace('ab', 'a').replace('c', 'cc').encode('ascii'), len(text)
+
+    assert encode_translations(encoder, ['ab', 'c']) is None
+    assert encode_translations(encoder, ['a', 'b']) == [b'a', b'b']  # not a single byte per character
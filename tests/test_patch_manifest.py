@@ -0,0 +1,122 @@
+import contextlib
+import io
+import pickle
+import zlib
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.patch_manifest import PatchManifest
+from dfrus.patchdf import Fix, Metadata, RangeSet, fix_df_exe
+from dfrus.peclasses import PortableExecutable
+
+
+def test_patch_manifest(tmp_path):
+    path = str(tmp_path / 'manifest')
+    manifest = PatchManifest.load(path, '0123')
+    assert manifest.strings_area_size == 0
+    assert manifest.find_place(0x1000, 10) is None
+
+    manifest.set_place(0x1000, 0, 10)
+    manifest.set_place(0x2000, 16, 5)
+    fix = Fix(deleted_relocs=[1], meta=Metadata(fixed='yes', len_='push'))
+    manifest.set_string_record(0x1000, [1, 2], [(0x10, b'ab')], [(0x20, 4)], [(0x30, manifest.fix_row(fix))])
+    manifest.set_string_record(0x3000, [3, 4], [], [], [])
+    manifest.save(path)
+
+    manifest = PatchManifest.load(path, '0123')
+    assert manifest.strings_area_size == 24
+    assert manifest.find_place(0x1000, 12) == 0  # Fits into the aligned capacity
+    assert manifest.find_place(0x2000, 9) is None
+    record = manifest.get_string_record(0x1000)
+    assert record.state == [1, 2]
+    assert record.writes == [(0x10, b'ab')]
+    assert record.reads == [[0x20, 4]]
+    [(offset, fix)] = record.fixes
+    assert offset == 0x30 and fix.deleted_relocs == [1] and fix.meta.len == 'push'
+    assert [record.state for record in manifest.other_string_records({0x1000})] == [[3, 4]]
+    manifest.save(path)
+
+    # Only the placements and the string records used by the latest run are kept
+    manifest = PatchManifest.load(path, '0123')
+    assert manifest.placements == {0x1000: (0, 12)}
+    assert manifest.get_string_record(0x1000).writes == [(0x10, b'ab')]
+    assert manifest.get_string_record(0x3000) is None
+
+
+def test_patch_manifest_other_executable(tmp_path):
+    path = str(tmp_path / 'manifest')
+    manifest = PatchManifest.load(path, '0123')
+    manifest.set_place(0x1000, 0, 10)
+    manifest.save(path)
+
+    manifest = PatchManifest.load(path, '4567')
+    assert not manifest.placements
+
+
+def test_patch_manifest_shared_place(tmp_path):
+    path = str(tmp_path / 'manifest')
+    manifest = PatchManifest.load(path, '0123')
+    manifest.set_place(0x1000, 0, 7, checksum=0x1234)
+    manifest.set_place(0x2000, 3, 4, checksum=0x5678)
+    manifest.save(path)
+
+    manifest = PatchManifest.load(path, '0123')
+    assert manifest.strings_area_size == 7
+    # Shared places are reused only by the same translations
+    assert manifest.find_place(0x1000, 7, checksum=0x4321) is None
+    assert manifest.find_place(0x2000, 4, checksum=0x5678) == 3
+
+
+def test_patch_manifest_not_json(tmp_path):
+    # Pickled data is not loaded
+    path = tmp_path / 'manifest'
+    path.write_bytes(zlib.compress(pickle.dumps(({}, {}, {0x1000: (0, 12)}))))
+    assert not PatchManifest.load(str(path), '0123').placements
+
+
+def test_range_set():
+    ranges = RangeSet()
+    assert not ranges.overlaps_any([(0, 100)])
+    ranges.add(10, 5)
+    ranges.add(20, 2)
+    ranges.add(15, 1)  # Merged with the first range
+    assert [ranges.overlaps(offset, 1) for offset in (9, 10, 15, 16, 19, 21, 22)] == \
+        [False, True, True, False, False, True, False]
+    assert ranges.overlaps(0, 11) and ranges.overlaps(16, 5) and not ranges.overlaps(16, 4)
+    ranges.add(0, 30)
+    assert ranges.overlaps(29, 1) and not ranges.overlaps(30, 5)
+    assert ranges.overlaps_any([(40, 1), (5, 1)])
+
+
+def test_patch_manifest_incremental():
+    image, strings = build_pe(300, pointer_count=1000)
+    trans_table = make_translations(strings)
+
+    # The previous dictionary has some other translations, one more translation and one less
+    previous_trans_table = dict(trans_table)
+    keys = list(trans_table)
+    for key in keys[10::30]:
+        previous_trans_table[key] = trans_table[key] + ' (old)'
+    previous_trans_table[keys[25]] = trans_table[keys[25]][:2]
+    del previous_trans_table[keys[50]]
+    del trans_table[keys[-10]]
+
+    def patch(trans_table, manifest):
+        fn = io.BytesIO(image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', trans_table, manifest=manifest)
+        return fn.getvalue(), report
+
+    manifest = PatchManifest('test')
+    patch(previous_trans_table, manifest)
+    data = manifest.to_bytes()
+
+    patched, report = patch(trans_table, PatchManifest.from_bytes('test', data))
+    assert 0 < report.counters['strings_reused'] < report.counters['strings_translated']
+
+    # The same translations are placed, but all the references are fixed again
+    manifest = PatchManifest.from_bytes('test', data)
+    manifest.string_records.clear()
+    expected, expected_report = patch(trans_table, manifest)
+    assert 'strings_reused' not in expected_report.counters
+    assert patched == expected
+    assert report.fix_len_outcomes == expected_report.fix_len_outcomes
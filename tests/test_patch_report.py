@@ -0,0 +1,69 @@
+import contextlib
+import io
+import json
+
+from benchmarks.synthetic_pe import build_pe, make_translations
+from dfrus.analysis_cache import CacheEntry
+from dfrus.patch_report import PatchReport
+from dfrus.patchdf import fix_df_exe
+from dfrus.peclasses import PortableExecutable
+
+
+def test_patch_report(tmp_path):
+    report = PatchReport()
+    report.stage('first')
+    report.count('references')
+    report.count('references', 2)
+    report.stage('second')
+    report.stage('first')
+    report.finish()
+    report.fix_len_outcomes['yes'] += 2
+    report.not_fixed_causes['to tight to call'] += 1
+
+    assert list(report.stages) == ['first', 'second']
+    assert all(wall_time >= 0 and cpu_time >= 0 for wall_time, cpu_time in report.stages.values())
+    assert report.counters == {'references': 3}
+
+    path = tmp_path / 'report.json'
+    report.save(str(path))
+    data = json.loads(path.read_text(encoding='utf-8'))
+    assert list(data['stages']) == ['first', 'second']
+    assert set(data['stages']['first']) == {'wall_time', 'cpu_time'}
+    assert data['counters'] == {'references': 3}
+    assert data['fix_len_outcomes'] == {'yes': 2}
+    assert data['not_fixed_causes'] == {'to tight to call': 1}
+
+
+def test_patch_report_counters():
+    image, strings = build_pe(60)
+    trans_table = make_translations(strings)
+
+    entry = CacheEntry('test')
+    reports = []
+    for cache in [None, entry, entry]:
+        fn = io.BytesIO(image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            reports.append(fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', trans_table, cache=cache))
+
+    # The strings are extracted in different ways with and without the cache, but they are counted the same way
+    assert reports[0].counters['strings_matched'] == reports[1].counters['strings_matched'] > 0
+    assert reports[0].counters['code_bytes_indexed'] == reports[1].counters['code_bytes_indexed'] > 0
+    assert reports[0].counters['code_bytes_disassembled'] == reports[1].counters['code_bytes_disassembled'] > 0
+
+    # The code index is taken from the cache
+    assert reports[2].counters['strings_matched'] == reports[0].counters['strings_matched']
+    assert 'code_bytes_indexed' not in reports[2].counters
+    # Results of fix_len() are taken from the cache, so nothing is disassembled
+    assert reports[2].counters['code_bytes_disassembled'] == 0
+
+
+def test_patch_report_hooks():
+    # The synthetic executable has the code patterns which need hooks and changes of relocations
+    image, strings = build_pe(300)
+    fn = io.BytesIO(image)
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = fix_df_exe(fn, PortableExecutable(fn), 'cp1251', 'cp437', make_translations(strings))
+
+    assert report.counters['hooks'] > 0
+    assert report.counters['relocations_added'] > 0
+    assert report.counters['relocations_removed'] > 0
@@ -1,6 +1,8 @@
+import io
+
 import pytest
 
-from dfrus.patchdf import get_length, mach_memcpy, get_start, match_mov_reg_imm32
+from dfrus.patchdf import get_length, mach_memcpy, get_start, match_mov_reg_imm32, fix_len
 from dfrus.disasm import disasm
 from dfrus.opcodes import *
 
@@ -57,6 +59,33 @@ test_data_push = bytes.fromhex(
 )
 
 
+def test_fix_len_moves():
+    # The copying code of "Fainted" at 0x40 is replaced with the copying of a longer translation
+    code = bytes(0x40) + test_data_1 + bytes.fromhex('E8 00 00 00 00')  # call near
+    fn = io.BytesIO(code)
+    fix = fix_len(fn, 0x42, 7, 10, 0x530000, 0x524b4c)
+    assert fix.meta.fixed == 'yes'
+    # Offsets are relative to the reference
+    assert sorted(fix.deleted_relocs) == [0, 7]
+    assert fix.pokes[-2][:2] == b'\x8b\xf0'  # mov esi, eax is kept at the start of the code
+
+
+def test_fix_len_moves_procedure():
+    # movups xmm0, [str]; movups [esp+20h], xmm0 is too short for the copying of a longer translation
+    code = bytes(0x40) + bytes.fromhex('0F 10 05 00 10 40 00  0F 11 44 24 20  E8 00 00 00 00')
+    fn = io.BytesIO(code)
+    fix = fix_len(fn, 0x43, 15, 20, 0x530000, 0x401000)
+    assert fix.meta.fixed == 'yes'
+    assert fix.deleted_relocs == [0]
+    assert fix.added_relocs is None
+
+    # The code is moved to a procedure, which is called from the place of the original code
+    proc = fix.fix
+    assert proc.src_off == 0x41
+    assert proc.pokes[0x40][0] == call_near
+    assert proc.added_relocs and proc.new_code[-1] == ret_near
+
+
 def test_get_length_push():
     result = get_length(test_data_push, 15)
     result['dest'] = str(result['dest'])
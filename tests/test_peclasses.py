@@ -0,0 +1,91 @@
+import io
+
+import pytest
+
+from benchmarks.synthetic_pe import build_pe
+from dfrus.peclasses import (Section, SectionTable, PortableExecutable, MappedPortableExecutable,
+                             mapped_portable_executable, ImageNTHeaders, DataDirectory)
+
+
+def test_section_from_buffer():
+    sections = [
+        Section(name=b'.text', virtual_size=0x1234, rva=0x1000, physical_size=0x1400, physical_offset=0x400,
+                flags=Section.IMAGE_SCN_CNT_CODE),
+        Section(name=b'.rdata', virtual_size=0x200, rva=0x3000, physical_size=0x200, physical_offset=0x1800,
+                flags=Section.IMAGE_SCN_CNT_INITIALIZED_DATA),
+    ]
+    buffer = bytearray(8) + b''.join(bytes(section) for section in sections)
+
+    section_table = SectionTable.from_buffer(buffer, 8, len(sections))
+    assert list(section_table) == sections
+    assert section_table.rva_to_offset(0x3010) == 0x1810
+
+    section_table[1].flags |= Section.IMAGE_SCN_MEM_READ
+    section_table[1].rewrite()
+    assert SectionTable.from_buffer(buffer, 8, len(sections))[1].flags == section_table[1].flags
+
+
+def pe_state(pe):
+    return (bytes(pe.dos_header), pe.nt_headers.offset, pe.nt_headers.signature, bytes(pe.file_header),
+            bytes(pe.optional_header), bytes(pe.data_directory), list(pe.section_table), pe.relocation_table)
+
+
+@pytest.fixture
+def image():
+    return build_pe(60, pointer_count=10)[0]
+
+
+def test_mapped_portable_executable(tmp_path, image):
+    expected = pe_state(PortableExecutable(io.BytesIO(image)))
+    assert len(expected[-1]) > 0
+
+    assert pe_state(MappedPortableExecutable(image)) == expected
+    assert pe_state(MappedPortableExecutable(memoryview(image))) == expected
+
+    path = tmp_path / 'test.exe'
+    path.write_bytes(image)
+    with mapped_portable_executable(str(path)) as pe:
+        assert pe_state(pe) == expected
+
+
+def test_headers_from_buffer(image):
+    pe = PortableExecutable(io.BytesIO(image))
+    nt_headers = ImageNTHeaders.from_buffer(image, pe.dos_header.e_lfanew)
+    assert bytes(nt_headers.file_header) == bytes(pe.file_header)
+    assert bytes(nt_headers.optional_header) == bytes(pe.optional_header)
+
+    offset = pe.dos_header.e_lfanew + ImageNTHeaders.sizeof() - DataDirectory.sizeof()
+    data_directory = DataDirectory.from_buffer(image, offset)
+    assert bytes(data_directory) == bytes(pe.data_directory)
+    assert data_directory.basereloc == pe.data_directory.basereloc
+
+    with pytest.raises(ValueError):
+        ImageNTHeaders.from_buffer(image, 0)
+
+
+def test_mapped_portable_executable_rewrite(tmp_path, image):
+    path = tmp_path / 'test.exe'
+    path.write_bytes(image)
+    with mapped_portable_executable(str(path), writable=True) as pe:
+        pe.file_header.timedate_stamp = 0x12345678
+        pe.file_header.rewrite()
+        pe.optional_header.size_of_image += 0x1000
+        pe.optional_header.rewrite()
+        pe.data_directory.basereloc.size -= 4
+        pe.data_directory.rewrite()
+        pe.section_table[1].flags |= Section.IMAGE_SCN_MEM_WRITE
+        pe.section_table[1].rewrite()
+
+    with open(str(path), 'rb') as file:
+        pe = PortableExecutable(file)
+        original = PortableExecutable(io.BytesIO(image))
+        assert pe.file_header.timedate_stamp == 0x12345678
+        assert pe.optional_header.size_of_image == original.optional_header.size_of_image + 0x1000
+        assert pe.data_directory.basereloc.size == original.data_directory.basereloc.size - 4
+        assert pe.section_table[1].flags == original.section_table[1].flags | Section.IMAGE_SCN_MEM_WRITE
+        assert list(pe.section_table)[2:] == list(original.section_table)[2:]
+
+    # A read-only buffer can't be changed
+    pe = MappedPortableExecutable(image)
+    with pytest.raises(TypeError):
+        pe.file_header.rewrite()
@@ -0,0 +1,17 @@
+import io
+
+from dfrus.extract_strings import check_string
+from dfrus.profiling import profile_call, write_hot_functions_report, hot_functions
+
+
+def test_profile_call():
+    result, stats = profile_call(lambda: [check_string(b'abc\0', 'cp437') for _ in range(3)])
+    assert result == [(3, 3)] * 3
+
+    output = io.StringIO()
+    write_hot_functions_report(stats, output)
+    lines = output.getvalue().splitlines()
+    # Each of the hot functions is reported in the same order, even if it wasn't called
+    assert [line.split()[0] for line in lines[1:]] == hot_functions + ['total']
+    assert lines[1 + hot_functions.index('check_string')].split()[1] == '3'
+    assert lines[1 + hot_functions.index('fix_len')].split()[1] == '0'
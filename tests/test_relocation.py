@@ -1,4 +1,5 @@
 import io
+from array import array
 
 from dfrus.peclasses import RelocationTable
 
@@ -21,3 +22,48 @@ def test_relocation():
     table = RelocationTable.from_file(file, len(file.getbuffer()))
     
     assert list(table) == relocs
+
+
+def test_relocation_from_buffer():
+    relocs = [0x123456, 0x123458, 0xdeadbeef]
+    file = io.BytesIO()
+    RelocationTable.build(relocs).to_file(file)
+    buffer = b'\xff' * 3 + file.getvalue()
+
+    table = RelocationTable.from_buffer(buffer, 3, len(buffer) - 3)
+
+    assert list(table) == relocs
+
+
+def test_relocation_updated():
+    table = RelocationTable.build([0x2004, 0x1000, 0x1008, 0x2000, 0x1000])
+    assert list(table) == [0x1000, 0x1008, 0x2000, 0x2004]
+    assert 0x1008 in table and 0x1004 not in table
+
+    updated = table.updated(added=[0x1004, 0x3000, 0x2000], removed=[0x1008, 0x2004, 0x5000])
+    assert list(updated) == [0x1000, 0x1004, 0x2000, 0x3000]
+    assert updated == RelocationTable.build([0x1000, 0x1004, 0x2000, 0x3000])
+    assert list(table) == [0x1000, 0x1008, 0x2000, 0x2004]
+
+
+def test_relocation_unordered_blocks():
+    file = io.BytesIO()
+    RelocationTable.build([0x2000]).to_file(file)
+    RelocationTable.build([0x1008, 0x1004]).to_file(file)
+
+    file.seek(0)
+    table = RelocationTable.from_file(file, len(file.getbuffer()))
+    assert list(table) == [0x1004, 0x1008, 0x2000]
+    assert table.size == 24
+
+
+def test_relocation_record_types():
+    file = io.BytesIO()
+    records = [0x3004, 0x0000, 0xA008, 0x3ffc, 0x0000, 0x0000]  # highlow, absolute, dir64, highlow, padding
+    array('I', [0x12345000, 8 + 2 * len(records)]).tofile(file)
+    array('H', records).tofile(file)
+    RelocationTable.build([0x12346000, 0x12346ffc]).to_file(file)
+
+    file.seek(0)
+    relocs = list(RelocationTable.iter_relocs(file, len(file.getbuffer())))
+    assert relocs == [0x12345004, 0x12345ffc, 0x12346000, 0x12346ffc]
@@ -0,0 +1,50 @@
+import json
+from array import array
+from collections import defaultdict
+
+import pytest
+
+from dfrus.code_index import CodeIndex
+from dfrus.machine_code import MachineCode, Reference
+from dfrus.patchdf import Fix, Metadata
+from dfrus.peclasses import RelocationTable
+from dfrus.serialization import encode, decode
+
+
+def round_trip(value):
+    return decode(json.loads(json.dumps(encode(value))))
+
+
+def test_plain_values():
+    value = {0x100: [(1, b'\x00\xff'), None], 'a': {1.5, 'b'}, (1, 2): bytearray(b'x'), 'c': array('I', [1, 2])}
+    assert round_trip(value) == value
+
+    xrefs = defaultdict(list, {1: [2, 3]})
+    restored = round_trip(xrefs)
+    assert restored == xrefs and restored.default_factory is list
+
+
+def test_objects():
+    new_code = MachineCode(0x6A, 0x05, 0xE8, Reference.relative(name='func'), func=0x401000)
+    fix = Fix(new_code=new_code, src_off=0x10, pokes={0x20: b'\x05'}, fix=Fix(src_off=1),
+              meta=Metadata(fixed='yes', func=('call near', 0x10, 0x20)))
+    restored = round_trip(fix)
+    assert (restored.src_off, restored.pokes, restored.fix.src_off) == (0x10, {0x20: b'\x05'}, 1)
+    assert repr(restored.meta) == repr(fix.meta)
+    assert bytes(restored.new_code) == bytes(new_code)
+
+    code_index = CodeIndex.from_bytes(bytes.fromhex('6A 05 E8 00 00 00 00 C3'), 0x1000)
+    restored = round_trip(code_index)
+    assert (restored.starts, restored.lengths, restored.classes) == (code_index.starts, code_index.lengths,
+                                                                     code_index.classes)
+
+    relocs = RelocationTable.build([0x1004, 0x1000])
+    assert round_trip(relocs) == relocs
+
+
+def test_not_allowed():
+    with pytest.raises(TypeError):
+        encode(object())
+
+    with pytest.raises(ValueError):
+        decode({'object': ['Popen', {}]})
@@ -0,0 +1,15 @@
+from dfrus.string_pool import StringPool
+
+
+def test_string_pool():
+    pool = StringPool()
+    for s in [b'concat\0', b'dog\0', b'cat\0', b'dog\0', b'at\0', b'category\0']:
+        pool.add(s)
+
+    offsets = pool.layout(0x100)
+    assert offsets == {b'concat\0': 0x100, b'dog\0': 0x108, b'cat\0': 0x103, b'at\0': 0x104, b'category\0': 0x10C}
+    assert pool.size == 0x18
+    assert len(pool) == 5
+
+    assert pool.is_shared(b'cat\0') and pool.is_shared(b'concat\0') and pool.is_shared(b'dog\0')
+    assert not pool.is_shared(b'category\0')
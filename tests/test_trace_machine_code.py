@@ -0,0 +1,38 @@
+import io
+
+from dfrus.binio import fpoke4
+from dfrus.trace_machine_code import which_func, TraceCache
+
+code = bytes.fromhex(
+    'EB 0E'  # 0x00: jmp short 0x10
+    '90 90 90 90 90 90'
+    'EB 06'  # 0x08: jmp short 0x10
+    '90 90 90 90 90 90'
+    'E8 00 01 00 00'  # 0x10: call near 0x115
+    'C3'
+)
+
+
+def test_which_func_cache():
+    fn = io.BytesIO(code)
+    cache = TraceCache()
+    assert which_func(fn, 0, cache=cache) == ('call near', 0x10, 0x115)
+    assert cache.info().misses == 2
+
+    # The code at the jump target is traced once
+    assert which_func(fn, 8, cache=cache) == ('call near', 0x10, 0x115)
+    assert which_func(fn, 0, cache=cache) == ('call near', 0x10, 0x115)
+    assert cache.info().hits == 2
+
+    # The results are not reused after the code was changed
+    fpoke4(fn, 0x11, 0x200)
+    assert which_func(fn, 0, cache=cache) == ('call near', 0x10, 0x215)
+    assert which_func(fn, 8, cache=cache) == ('call near', 0x10, 0x215)
+
+
+def test_trace_cache_size():
+    fn = io.BytesIO(code)
+    cache = TraceCache(maxsize=1)
+    which_func(fn, 0, cache=cache)
+    which_func(fn, 8, cache=cache)
+    assert cache.info().currsize == 1